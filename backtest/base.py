@@ -5,7 +5,7 @@ The author is Zmicier Gotowka
 Distributed under Fcore License 1.1 (see license.md)
 """
 from data.fvalues import Quotes, trading_days_per_year, Weighted
-from data.futils import thread_available, logger, add_column, get_dt
+from data.futils import thread_available, logger, add_column, get_dt, get_ts_array
 
 import abc
 from datetime import datetime
@@ -2436,6 +2436,7 @@ class BackTest(metaclass=abc.ABCMeta):
         self.__thread = None
 
         self._compositions = None  # Index compositions in a moment of time
+        self._compositions_cache = None  # (compositions, their number, sorted timestamps of the dates, sorted compositions)
 
         self._all_symbols = None  # All symbols used in the back test
         self._current_cmp = None  # Current composition of symbols (depends on date time)
@@ -3560,18 +3561,29 @@ class BackTest(metaclass=abc.ABCMeta):
             Returns:
                 list: current index composition.
         """
-        current_dt = get_dt(self.exec().get_row()[Quotes.TimeStamp])
+        current_ts = self.exec().get_row()[Quotes.TimeStamp]
         current_cmp = self._all_symbols
 
         if self._compositions is not None:
-            # Take the first composition as the default value
-            current_cmp = next(iter(self._compositions.values()))
+            cache = self._compositions_cache
 
-            for key in self._compositions.keys():
-                key_dt = get_dt(key)
+            # Dates of the compositions are converted and sorted once unless the compositions are replaced or changed
+            if cache is None or cache[0] is not self._compositions or cache[1] != len(self._compositions):
+                compositions_ts = get_ts_array(list(self._compositions.keys()))
+                compositions = list(self._compositions.values())
 
-                if current_dt >= key_dt:
-                    current_cmp = self._compositions[key]
+                order = np.argsort(compositions_ts, kind='stable')
+
+                self._compositions_cache = (self._compositions,
+                                            len(self._compositions),
+                                            compositions_ts[order],
+                                            [compositions[i] for i in order])
+
+            _, _, compositions_ts, compositions = self._compositions_cache
+
+            # The latest composition which started before the current date. The earliest composition is the default value.
+            idx = np.searchsorted(compositions_ts, current_ts, side='right') - 1
+            current_cmp = compositions[max(idx, 0)]
 
         return current_cmp
 
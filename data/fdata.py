@@ -5,22 +5,39 @@ The author is Zmicier Gotowka
 Distributed under Fcore License 1.1 (see license.md)
 """
 import abc
-
-from time import sleep, perf_counter
+import asyncio
+import copy
+import functools
+import types
+import zlib
+import os
+import glob
+import hashlib
+import tempfile
+import threading
+
+from time import sleep, perf_counter, time
 
 import http.client
 import urllib.error
+import urllib.parse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from data import fdatabase
 
-from data.fvalues import Timespans, SecType, Currency, def_first_date, def_last_date, DbTypes, Timezones
-from data.futils import get_dt, get_labelled_ndarray, logger
+from data.fvalues import Timespans, SecType, Currency, def_first_date, def_last_date, DbTypes, Timezones, Quotes, RefreshStatus
+from data.futils import get_dt, get_labelled_ndarray, get_sql_value, add_fields, logger, get_session_mask, get_session_query, \
+                         pack_objects, unpack_objects
 
 import settings
 
 import json
 
+import numpy as np
+import numpy.lib.recfunctions as rfn
+
 from datetime import datetime, timedelta
 from dateutil import tz
 import calendar
@@ -32,6 +49,47 @@ DB_VERSION = 22
 
 # TODO LOW Consider checking of sqlite version as well
 
+# Name of the column with the symbol id in multi-symbol query results
+batch_id = 'batch_symbol_id'
+
+# Declared dtypes of the base quotes columns. Volume dtype is inferred as it depends on the data source.
+quote_dtypes = {Quotes.TimeStamp: np.int64,
+                Quotes.DateTime: object,
+                Quotes.Open: np.float64,
+                Quotes.High: np.float64,
+                Quotes.Low: np.float64,
+                Quotes.Close: np.float64,
+                Quotes.Transactions: object}
+
+# Base quotes columns which are stored as objects
+quote_objects = [name for name, dtype in quote_dtypes.items() if dtype is object]
+
+def split_batch(rows):
+    """
+        Split the multi-symbol query result sorted by symbols to arrays per symbol.
+
+        Args:
+            rows(ndarray): labelled array with the symbol id column (or None).
+
+        Returns:
+            dict: labelled arrays (without the symbol id column) by symbol ids.
+    """
+    if rows is None:
+        return {}
+
+    names = [name for name in rows.dtype.names if name != batch_id]
+
+    ids = rows[batch_id]
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1, [len(rows)]))
+
+    result = {}
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # Copy the selected fields to get a packed array
+        result[int(ids[start])] = rfn.repack_fields(rows[start:end][names])
+
+    return result
+
 class Subquery():
     """
         Class which represents additional subqueries for optional data (fundamentals, global economic, customer data and so on).
@@ -81,6 +139,53 @@ class Subquery():
 
         return subquery
 
+    def align(self, source, ts):
+        """
+            Load the data for the whole requested period by a single query and align it to quote timestamps (as-of join).
+
+            If fill is True, each quote gets the most recent value at its timestamp. Otherwise only the first quote
+            at or after the report timestamp gets the value.
+
+            Args:
+                source(ReadOnlyData): connected data source.
+                ts(ndarray): sorted quote timestamps.
+
+            Returns:
+                list: values aligned to the quote timestamps (None if no value).
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        select_reports = f"""SELECT report_tbl.time_stamp AS report_ts, {self.column} AS report_value
+                                FROM {self.table} report_tbl
+                                WHERE report_tbl.symbol_id = ?
+                                AND report_tbl.time_stamp <= ?
+                                {self.condition}
+                                ORDER BY report_tbl.time_stamp;"""
+
+        try:
+            source.cur.execute(select_reports, (source.get_symbol_id(), int(ts[-1])))
+            reports = source.cur.fetchall()
+        except source.Error as e:
+            raise FdataError(f"Can't execute a query on a table '{self.table}': {e}\n{select_reports}") from e
+
+        if len(reports) == 0:
+            return [None] * len(ts)
+
+        report_ts = np.array([report['report_ts'] for report in reports])
+        values = [report['report_value'] for report in reports]
+
+        # Index of the most recent report for each quote
+        idx = np.searchsorted(report_ts, ts, side='right') - 1
+        valid = idx >= 0
+
+        if self.fill is False:
+            # The report should be newer than the previous quote
+            prev_ts = np.concatenate(([-np.inf], ts[:-1]))
+            valid &= report_ts[np.maximum(idx, 0)] > prev_ts
+
+        return [values[i] if is_valid else None for i, is_valid in zip(idx, valid)]
+
 class FdataError(Exception):
     """
         Base data exception class.
@@ -147,6 +252,11 @@ class ReadOnlyData():
         self._sec_type = None  # Cached security type to avoid too many db queries
         self._currency = None  # Cached security type to avoid too many db queries
 
+        self._ids = {}  # Cached symbol/source/timespan ids to avoid too many db queries
+        self._ids_version = 0  # The version of the cached ids of the connection (see _check_ids())
+
+        self._initially_connected = False  # Connection status before entering the context manager
+
     ########################################################
     # Get/set datetimes (depending on the input value type).
     ########################################################
@@ -306,6 +416,58 @@ class ReadOnlyData():
         """Returns True/False if db is connected."""
         return self._connected
 
+    def __enter__(self):
+        """
+            Connect to the database (if not connected yet) to keep the connection open for a batch of operations.
+
+            Returns:
+                ReadOnlyData: the current instance.
+        """
+        self._initially_connected = self.is_connected()
+
+        if self._initially_connected is False:
+            self.db_connect()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+            Resume the initial connection status.
+        """
+        if self._initially_connected is False and self.is_connected():
+            self.db_close()
+
+    def clone(self, symbol=None, share_connection=True):
+        """
+            Get a copy of the instance with the same settings but without the cached data of the symbol.
+
+            Args:
+                symbol(str): the symbol of the copy. The current symbol is used if None.
+                share_connection(bool): indicates if the copy should use the connection of the instance. Otherwise
+                                        the copy is disconnected (for example, to be connected in another thread).
+
+            Returns:
+                ReadOnlyData: the copy of the instance.
+        """
+        source = copy.copy(self)
+
+        if symbol is not None:
+            source.symbol = symbol
+
+        source._time_zone = None
+        source._sec_type = None
+        source._currency = None
+
+        source._ids = dict(self._ids)
+
+        if share_connection is False:
+            source.database = None
+            source.conn = None
+            source.cur = None
+            source._connected = False
+
+        return source
+
     def check_if_connected(self):
         """
             Raise an exception if db is not connected.
@@ -322,10 +484,32 @@ class ReadOnlyData():
             self.database.db_connect()
             self._connected = True
 
-            # Check the database integrity
-            self.check_database()
+            # Cached ids may belong to another database
+            self.reset_ids()
+
+            # Check the database integrity only if the schema was not validated for this class yet
+            fingerprint = self.get_schema_fingerprint()
+
+            if self.database.is_validated(fingerprint) is False:
+                environment = self._get_environment()
+
+                if environment is None or fingerprint not in environment['fingerprints']:
+                    self.database.begin()
+
+                    try:
+                        self.check_database()
+                        self._set_fingerprint(environment, fingerprint)
+                    except FdataError:
+                        self.database.rollback()
+                        raise
 
-            if self.check_source() == False:
+                    self.database.release()
+
+                # The created schema may be rolled back along with the pending changes of other instances
+                if self.conn.in_transaction is False:
+                    self.database.set_validated(fingerprint)
+
+            if self.get_source_id() is None:
                 self.add_source()
 
     def db_close(self):
@@ -334,9 +518,101 @@ class ReadOnlyData():
         """
         self.check_if_connected()
 
+        self._remove_stale_npy()
+
         self.database.db_close()
         self._connected = False
 
+        self.reset_ids()
+
+    def get_schema_fingerprint(self):
+        """
+            Get the fingerprint of the schema expected by the current class.
+
+            The fingerprint is calculated using DB_VERSION and the code of all check_database() methods in the class
+            hierarchy. It changes if any of the integrity check methods is altered.
+
+            Returns:
+                str: the schema fingerprint.
+        """
+        checksum = zlib.crc32(str(DB_VERSION).encode())
+
+        for cls in type(self).__mro__:
+            method = cls.__dict__.get('check_database')
+
+            if method is not None:
+                code = method.__code__
+                # Nested code objects are skipped as their representation contains memory addresses
+                consts = [const for const in code.co_consts if isinstance(const, types.CodeType) is False]
+
+                checksum = zlib.crc32(code.co_code + repr(consts).encode(), checksum)
+
+        return format(checksum, '08x')
+
+    def _get_environment(self):
+        """
+            Get the database version, the current schema version and validated schema fingerprints by a single query.
+
+            Validated fingerprints are considered only if the schema was not changed since the last validation.
+
+            Returns:
+                dict: environment data or None if the environment table is missing or broken.
+        """
+        self.check_if_connected()
+
+        environment_query = """SELECT version,
+                                    fingerprint,
+                                    (SELECT schema_version FROM pragma_schema_version) AS schema_version
+                                FROM environment;"""
+
+        try:
+            self.cur.execute(environment_query)
+            rows = self.cur.fetchall()
+        except self.Error:
+            return None  # The environment table is missing or outdated. The full check is needed.
+
+        if len(rows) != 1 or rows[0]['version'] != DB_VERSION:
+            return None
+
+        schema_version = rows[0]['schema_version']
+        fingerprints = set()
+
+        # The fingerprint is stored as 'schema_version:fingerprint1,fingerprint2,...'
+        if rows[0]['fingerprint'] is not None:
+            validated_version, _, validated = rows[0]['fingerprint'].partition(':')
+
+            if validated_version == str(schema_version):
+                fingerprints = set(validated.split(','))
+
+        return {'schema_version': schema_version, 'fingerprints': fingerprints}
+
+    def _set_fingerprint(self, environment, fingerprint):
+        """
+            Store the validated schema fingerprint in the environment table.
+
+            Args:
+                environment(dict): environment data obtained before the integrity check.
+                fingerprint(str): the fingerprint of the validated schema.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        fingerprints = {fingerprint}
+
+        # Keep fingerprints validated by other classes if the schema was not changed by a third party
+        if environment is not None:
+            fingerprints.update(environment['fingerprints'])
+
+        update_fingerprint = "UPDATE environment SET fingerprint = ?;"
+
+        try:
+            self.cur.execute("PRAGMA schema_version;")
+            schema_version = self.cur.fetchone()[0]
+
+            self.cur.execute(update_fingerprint, (f"{schema_version}:{','.join(sorted(fingerprints))}", ))
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'environment': {e}\n{update_fingerprint}") from e
+
     def check_database(self):
         """
             Database create/integrity check method.
@@ -358,7 +634,8 @@ class ReadOnlyData():
 
         if len(rows) == 0:
             create_environment = """CREATE TABLE environment(
-                                    version INTEGER NOT NULL UNIQUE
+                                    version INTEGER NOT NULL UNIQUE,
+                                    fingerprint TEXT
                                 );"""
 
             try:
@@ -366,6 +643,23 @@ class ReadOnlyData():
             except self.Error as e:
                 raise FdataError(f"Can't execute a query on a table 'environment': {e}\n{create_environment}") from e
 
+        # Check if the environment table has the column for schema fingerprints (added in the existing databases)
+        try:
+            check_fingerprint = "SELECT name FROM PRAGMA_TABLE_INFO('environment') WHERE name = 'fingerprint';"
+
+            self.cur.execute(check_fingerprint)
+            rows = self.cur.fetchall()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'environment': {e}\n{check_fingerprint}") from e
+
+        if len(rows) == 0:
+            add_fingerprint = "ALTER TABLE environment ADD COLUMN fingerprint TEXT;"
+
+            try:
+                self.cur.execute(add_fingerprint)
+            except self.Error as e:
+                raise FdataError(f"Can't execute a query on a table 'environment': {e}\n{add_fingerprint}") from e
+
         # Check if environment table is empty
         try:
             all_environment = "SELECT * FROM environment;"
@@ -627,23 +921,24 @@ class ReadOnlyData():
             except self.Error as e:
                 raise FdataError(f"Can't execute a query on a table 'timespans': {e}\n{insert_timespans}") from e
 
-        # Check if we need to create table 'quote_intervals'
+        # Check if we need to create table 'quote_ranges'
         try:
-            check_quote_intervals = "SELECT name FROM sqlite_master WHERE type='table' AND name='quote_intervals';"
+            check_quote_ranges = "SELECT name FROM sqlite_master WHERE type='table' AND name='quote_ranges';"
 
-            self.cur.execute(check_quote_intervals)
+            self.cur.execute(check_quote_ranges)
             rows = self.cur.fetchall()
         except self.Error as e:
-            raise FdataError(f"Can't execute a query on a table 'quote_intervals': {e}\n{check_quote_intervals}") from e
+            raise FdataError(f"Can't execute a query on a table 'quote_ranges': {e}\n{check_quote_ranges}") from e
 
         if len(rows) == 0:
-            create_quote_intervals = """CREATE TABLE quote_intervals (
-                                            quote_interval_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            # Disjoint merged ranges of requested quotes
+            create_quote_ranges = """CREATE TABLE quote_ranges (
+                                            quote_range_id INTEGER PRIMARY KEY AUTOINCREMENT,
                                             symbol_id INTEGER NOT NULL,
                                             source_id INTEGER NOT NULL,
                                             time_span_id INTEGER NOT NULL,
-                                            min_request_ts INTEGER NOT NULL,
-                                            max_request_ts INTEGER NOT NULL,
+                                            first_ts INTEGER NOT NULL,
+                                            last_ts INTEGER NOT NULL,
                                                 CONSTRAINT fk_timespans
                                                     FOREIGN KEY (time_span_id)
                                                     REFERENCES timespans(time_span_id)
@@ -656,21 +951,84 @@ class ReadOnlyData():
                                                     FOREIGN KEY (symbol_id)
                                                     REFERENCES symbols(symbol_id)
                                                     ON DELETE CASCADE
-                                            UNIQUE(symbol_id, source_id, time_span_id)
+                                            UNIQUE(symbol_id, source_id, time_span_id, first_ts)
+                                            );"""
+
+            try:
+                self.cur.execute(create_quote_ranges)
+            except self.Error as e:
+                raise FdataError(f"Can't create table quote_ranges: {e}") from e
+
+            # Create indexes for quote_ranges
+            create_quote_ranges_idx = "CREATE INDEX idx_quote_ranges ON quote_ranges(symbol_id, source_id, time_span_id, first_ts, last_ts);"
+
+            try:
+                self.cur.execute(create_quote_ranges_idx)
+            except self.Error as e:
+                raise FdataError(f"Can't create indexes for quote_ranges table: {e}") from e
+
+        # Migrate the single intervals of requested quotes used by the previous versions
+        try:
+            check_quote_intervals = "SELECT name FROM sqlite_master WHERE type='table' AND name='quote_intervals';"
+
+            self.cur.execute(check_quote_intervals)
+            rows = self.cur.fetchall()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'quote_intervals': {e}\n{check_quote_intervals}") from e
+
+        if len(rows):
+            migrate_quote_intervals = """INSERT OR IGNORE INTO quote_ranges (symbol_id, source_id, time_span_id, first_ts, last_ts)
+                                            SELECT symbol_id, source_id, time_span_id, min_request_ts, max_request_ts
+                                            FROM quote_intervals;"""
+
+            try:
+                self.cur.execute(migrate_quote_intervals)
+                self.cur.execute("DROP TABLE quote_intervals;")
+            except self.Error as e:
+                raise FdataError(f"Can't migrate quote_intervals table: {e}\n{migrate_quote_intervals}") from e
+
+        # Check if we need to create table 'refresh_tasks'
+        try:
+            check_refresh_tasks = "SELECT name FROM sqlite_master WHERE type='table' AND name='refresh_tasks';"
+
+            self.cur.execute(check_refresh_tasks)
+            rows = self.cur.fetchall()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'refresh_tasks': {e}\n{check_refresh_tasks}") from e
+
+        if len(rows) == 0:
+            # Planned data refresh of a universe of symbols. Tickers are used as the symbols may not be added yet.
+            create_refresh_tasks = """CREATE TABLE refresh_tasks (
+                                            refresh_task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                            ticker TEXT NOT NULL,
+                                            source_id INTEGER NOT NULL,
+                                            time_span_id INTEGER NOT NULL,
+                                            stale TEXT,
+                                            status INTEGER NOT NULL DEFAULT 0,
+                                            modified INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+                                                CONSTRAINT fk_timespans
+                                                    FOREIGN KEY (time_span_id)
+                                                    REFERENCES timespans(time_span_id)
+                                                    ON DELETE CASCADE
+                                                CONSTRAINT fk_source
+                                                    FOREIGN KEY (source_id)
+                                                    REFERENCES sources(source_id)
+                                                    ON DELETE CASCADE
+                                            UNIQUE(ticker, source_id, time_span_id)
                                             );"""
 
             try:
-                self.cur.execute(create_quote_intervals)
+                self.cur.execute(create_refresh_tasks)
             except self.Error as e:
-                raise FdataError(f"Can't create table quote_intervals: {e}") from e
+                raise FdataError(f"Can't create table refresh_tasks: {e}") from e
 
-            # Create indexes for quote_intervals
-            create_quote_intervals_idx = "CREATE INDEX idx_quote_intervals ON quote_intervals(symbol_id, source_id, time_span_id);"
+            # Create indexes for refresh_tasks
+            create_refresh_tasks_idx = "CREATE INDEX idx_refresh_tasks ON refresh_tasks(source_id, time_span_id, status);"
 
             try:
-                self.cur.execute(create_quote_intervals_idx)
+                self.cur.execute(create_refresh_tasks_idx)
             except self.Error as e:
-                raise FdataError(f"Can't create indexes for quote_intervals table: {e}") from e
+                raise FdataError(f"Can't create indexes for refresh_tasks table: {e}") from e
 
         # TODO Mid need to think of a better way how to combine data from various sources
         # Check if we need to create table 'quotes'
@@ -794,8 +1152,6 @@ class ReadOnlyData():
             except self.Error as e:
                 raise FdataError(f"Can't create trigger for sec_info: {e}") from e
 
-        self.conn.commit()
-
     def check_source(self):
         """
             Check if the current source exists in the table 'sources'
@@ -830,12 +1186,180 @@ class ReadOnlyData():
 
         insert_source = f"INSERT OR IGNORE INTO sources (title) VALUES ('{self.source_title}')"
 
+        self.database.begin()
+
         try:
             self.cur.execute(insert_source)
-            self.conn.commit()
         except self.Error as e:
+            self.database.rollback()
             raise FdataError(f"Can't execute a query on a table 'sources': {e}\n{insert_source}") from e
 
+        self.database.release()
+
+        self.reset_ids('sources')
+
+    ########################################
+    # Cached ids of symbols/sources/timespans
+    ########################################
+
+    def reset_ids(self, table=None):
+        """
+            Invalidate the cached ids.
+
+            Args:
+                table(str): the table to invalidate the ids for. All the cached ids are invalidated if None.
+        """
+        if table is None:
+            self._ids = {}
+        else:
+            self._ids = {key: value for key, value in self._ids.items() if key[0] != table}
+
+    def _check_ids(self):
+        """
+            Invalidate the cached ids if they were invalidated by another instance which shares the connection.
+        """
+        if self.is_connected():
+            version = self.database.get_ids_version()
+
+            if version != self._ids_version:
+                self._ids = {}
+                self._ids_version = version
+
+    def _get_id(self, table, id_column, title_column, title, nocase=False):
+        """
+            Get the id of an entry by its title. The id is cached until the cache is invalidated.
+
+            Args:
+                table(str): the table to query.
+                id_column(str): the column with the id.
+                title_column(str): the column with the title.
+                title(str): the title to get the id for.
+                nocase(bool): indicates if the title comparison is case insensitive.
+
+            Returns:
+                int: the id of the entry or None if the entry does not exist.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        key = (table, str(title))
+
+        self._check_ids()
+
+        if key in self._ids:
+            return self._ids[key]
+
+        self.check_if_connected()
+
+        collate = ''
+
+        if nocase:
+            collate = 'COLLATE NOCASE'
+
+        get_id = f"SELECT {id_column} FROM {table} WHERE {title_column} = ? {collate};"
+
+        try:
+            self.cur.execute(get_id, (str(title), ))
+            row = self.cur.fetchone()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table '{table}': {e}\n{get_id}") from e
+
+        if row is None:
+            return None  # Do not cache missing entries as they may be added later
+
+        self._ids[key] = row[0]
+
+        return row[0]
+
+    def get_symbol_id(self, symbol=None):
+        """
+            Get the id of the symbol.
+
+            Args:
+                symbol(str): the symbol to get the id. The current symbol is used if None.
+
+            Returns:
+                int: the id of the symbol or None if the symbol is not in the database.
+        """
+        if symbol is None:
+            symbol = self.symbol
+
+        return self._get_id('symbols', 'symbol_id', 'ticker', symbol)
+
+    def get_symbol_ids(self, symbols):
+        """
+            Get the ids of multiple symbols by a minimal number of queries.
+
+            Args:
+                symbols(list): the symbols to get the ids.
+
+            Returns:
+                dict: ids by symbols. Symbols which are not in the database are omitted.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        result = {}
+        missing = []
+
+        self._check_ids()
+
+        for symbol in dict.fromkeys(symbols):
+            if ('symbols', str(symbol)) in self._ids:
+                result[symbol] = self._ids[('symbols', str(symbol))]
+            else:
+                missing.append(symbol)
+
+        # Keep the number of query parameters below the default SQLite limit
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+
+            get_ids = f"SELECT ticker, symbol_id FROM symbols WHERE ticker IN ({', '.join(['?'] * len(chunk))});"
+
+            try:
+                self.cur.execute(get_ids, chunk)
+                rows = self.cur.fetchall()
+            except self.Error as e:
+                raise FdataError(f"Can't execute a query on a table 'symbols': {e}\n{get_ids}") from e
+
+            for row in rows:
+                self._ids[('symbols', row[0])] = row[1]
+                result[row[0]] = row[1]
+
+        return result
+
+    def get_source_id(self, source_title=None):
+        """
+            Get the id of the source.
+
+            Args:
+                source_title(str): the title of the source. The current source is used if None.
+
+            Returns:
+                int: the id of the source or None if the source is not in the database.
+        """
+        if source_title is None:
+            source_title = self.source_title
+
+        return self._get_id('sources', 'source_id', 'title', source_title)
+
+    def get_timespan_id(self, timespan=None):
+        """
+            Get the id of the timespan.
+
+            Args:
+                timespan(Timespans): the timespan to get the id. The current timespan is used if None.
+
+            Returns:
+                int: the id of the timespan or None if the timespan is not in the database.
+        """
+        if timespan is None:
+            timespan = self.timespan
+
+        return self._get_id('timespans', 'time_span_id', 'title', timespan, nocase=True)
+
     ##################################
     # Read only methods to obtain data
     ##################################
@@ -862,7 +1386,16 @@ class ReadOnlyData():
 
         return rows
 
-    def get_quotes(self, num=0, columns=None, joins=None, queries=None, ignore_last_date=False, ignore_source=False):
+    def get_quotes(self,
+                   num=0,
+                   columns=None,
+                   joins=None,
+                   queries=None,
+                   ignore_last_date=False,
+                   ignore_source=False,
+                   asof=False,
+                   dtypes=None,
+                   session=None):
         """
             Get quotes for specified symbol, dates and timespan (if any). Additional columns from other tables
             linked by symbol_id may be requested (like fundamental data)
@@ -874,29 +1407,177 @@ class ReadOnlyData():
                 queries(list): additional queries from other tables (like funamental, global economic data).
                 ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
                 ignore_souce(bool): indicates if quotes should be obtained only from a particular source
+                asof(bool): indicates if additional queries should be loaded once per table and aligned to quotes
+                            in numpy (as-of join) instead of correlated subqueries per row.
+                dtypes(dict): declared dtypes of additional columns. Otherwise dtypes are inferred from the first row.
+                session(tuple): the (start, end) session window in HH:MM format in the exchange time zone. Only
+                                the quotes within the window are obtained. The window may cross the midnight.
 
             Returns:
-                list: list with quotes data.
+                list: list with quotes data. If settings.Quotes.npy_cache_dir is set, the quotes without
+                      additional data are memory-mapped from the cache.
 
             Raises:
                 FdataError: sql error happened.
         """
         self.check_if_connected()
 
-        # Timespan subquery
-        timespan_query = ""
+        symbol_id = self.get_symbol_id()
 
-        if self.timespan != Timespans.All:
-            timespan_query = "AND timespans.title = '" + self.timespan.value + "'"
+        asof_queries = []
 
-        # TODO LOW Think what to do with sectype and currency. Ignore it for now.
-        # # Sectype subquery
-        # sectype_query = ""
+        if asof and isinstance(queries, list):
+            asof_queries = queries
+            queries = None
 
-        # if self.get_sectype() != SecType.All:
-        #     sectype_query = "AND sectypes.title = '" + self.get_sectype() + "'"
+        rows = None
 
-        # # Currency subquery
+        # The memory-mapped cache is shared with other processes, so it is neither read nor written while
+        # the pending changes (which may be rolled back) are visible
+        use_npy = self.conn.in_transaction is False and columns is None and joins is None and queries is None
+
+        if use_npy:
+            self._remove_stale_npy()
+
+        if symbol_id is not None and use_npy and self._get_npy_path(ignore_source) is not None:
+            if session is None:
+                rows = self._get_npy_quotes(num=num, ignore_last_date=ignore_last_date, ignore_source=ignore_source)
+            else:
+                rows = self._get_npy_quotes(ignore_last_date=ignore_last_date, ignore_source=ignore_source)
+
+                if rows is not None:
+                    rows = self._trim_session(rows, session, num)
+        elif symbol_id is not None:
+            rows = self._select_quotes(symbol_ids=[symbol_id],
+                                       num=num,
+                                       columns=columns,
+                                       joins=joins,
+                                       queries=queries,
+                                       ignore_last_date=ignore_last_date,
+                                       ignore_source=ignore_source,
+                                       dtypes=dtypes,
+                                       session=session)
+
+        if rows is None:
+            self.log("No data obtained.")
+            return None
+
+        if len(asof_queries):
+            rows = add_fields(rows, [(query.title, query.align(self, rows['time_stamp'])) for query in asof_queries])
+
+        return rows
+
+    def get_quotes_batch(self,
+                         symbols,
+                         columns=None,
+                         joins=None,
+                         ignore_last_date=False,
+                         ignore_source=False,
+                         dtypes=None):
+        """
+            Get quotes for multiple symbols using the current dates, timespan and source by a single query.
+
+            Args:
+                symbols(list): symbols to get quotes for.
+                columns(list): additional columns to query.
+                joins(list): additional joins to get data from other tables.
+                ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
+                ignore_souce(bool): indicates if quotes should be obtained only from a particular source
+                dtypes(dict): declared dtypes of additional columns. Otherwise dtypes are inferred from the first row.
+
+            Returns:
+                dict: labelled arrays with quotes by symbols (None if no quotes for a symbol).
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        result = dict.fromkeys(symbols)
+
+        symbol_ids = self.get_symbol_ids(symbols)
+
+        if len(symbol_ids) == 0:
+            return result
+
+        quotes = self._select_quotes(symbol_ids=list(symbol_ids.values()),
+                                     columns=columns,
+                                     joins=joins,
+                                     ignore_last_date=ignore_last_date,
+                                     ignore_source=ignore_source,
+                                     dtypes=dtypes,
+                                     batch=True)
+
+        symbols_by_id = {symbol_id: symbol for symbol, symbol_id in symbol_ids.items()}
+
+        for symbol_id, rows in quotes.items():
+            result[symbols_by_id[symbol_id]] = rows
+
+        return result
+
+    def _select_quotes(self,
+                       symbol_ids,
+                       num=0,
+                       columns=None,
+                       joins=None,
+                       queries=None,
+                       ignore_last_date=False,
+                       ignore_source=False,
+                       dtypes=None,
+                       batch=False,
+                       first_ts=None,
+                       session=None):
+        """
+            Select quotes for the symbols using the current dates, timespan and source.
+
+            In batch mode the result is split by symbols.
+
+            Args:
+                symbol_ids(list): ids of the symbols.
+                num(int): the number of rows to get. 0 gets all the quotes.
+                columns(list): additional columns to query.
+                joins(list): additional joins to get data from other tables.
+                queries(list): additional queries from other tables (like funamental, global economic data).
+                ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
+                ignore_souce(bool): indicates if quotes should be obtained only from a particular source
+                dtypes(dict): declared dtypes of additional columns. Otherwise dtypes are inferred from the first row.
+                batch(bool): indicates if the result is requested for multiple symbols.
+                first_ts(int): overridden first timestamp of the quotes.
+                session(tuple): the (start, end) session window in HH:MM format in the exchange time zone.
+
+            Returns:
+                ndarray: labelled array with quotes data or None if no data obtained. In batch mode the dict
+                         with labelled arrays by symbol ids is returned.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        params = list(symbol_ids)
+
+        symbols_query = "quotes.symbol_id = ?"
+        batch_column = ""
+        order_query = "ORDER BY time_stamp"
+
+        if batch:
+            symbols_query = f"quotes.symbol_id IN ({', '.join(['?'] * len(symbol_ids))})"
+            batch_column = f", quotes.symbol_id AS {batch_id}"
+            order_query = "ORDER BY quotes.symbol_id, time_stamp"
+
+        # Timespan subquery
+        timespan_query = ""
+
+        if self.timespan != Timespans.All:
+            timespan_query = "AND quotes.time_span_id = ?"
+            params.append(self.get_timespan_id())
+
+        # TODO LOW Think what to do with sectype and currency. Ignore it for now.
+        # # Sectype subquery
+        # sectype_query = ""
+
+        # if self.get_sectype() != SecType.All:
+        #     sectype_query = "AND sectypes.title = '" + self.get_sectype() + "'"
+
+        # # Currency subquery
         # currency_query = ""
 
         # if self.get_currency() != Currency.All:
@@ -933,34 +1614,31 @@ class ReadOnlyData():
         if ignore_last_date:
             last_date_ts = def_last_date
 
+        if first_ts is None:
+            first_ts = self.first_date_ts
+
         source_query = ''
 
         if ignore_source is False:
-            source_query = f"AND source_id = (SELECT source_id FROM sources WHERE title = '{self.source_title}')"
-
-        # select_quotes = f"""SELECT time_stamp,
-        #                         datetime(time_stamp, 'unixepoch') AS date_time,
-        #                         opened,
-        #                         high,
-        #                         low,
-        #                         closed,
-        #                         volume,
-        #                         transactions
-        #                         {additional_columns}
-        #                         {additional_queries}
-        #                     FROM quotes INNER JOIN symbols ON quotes.symbol_id = symbols.symbol_id
-        #                     INNER JOIN timespans ON quotes.time_span_id = timespans.time_span_id
-        #                     INNER JOIN sectypes ON quotes.sec_type_id = sectypes.sec_type_id
-        #                     INNER JOIN currency ON quotes.currency_id = currency.currency_id
-        #                     {additional_joins}
-        #                     WHERE symbols.ticker = '{self.symbol}'
-        #                     {timespan_query}
-        #                     {sectype_query}
-        #                     {currency_query}
-        #                     AND time_stamp >= {self.first_date_ts}
-        #                     AND time_stamp <= {self.last_date_ts}
-        #                     ORDER BY time_stamp
-        #                     {num_query};"""
+            source_query = "AND quotes.source_id = ?"
+            params.append(self.get_source_id())
+
+        # Time of day predicate of the session window
+        session_query = ''
+        exact_session = True
+
+        if session is not None:
+            predicate, exact_session = get_session_query(*session,
+                                                         timezone=self.get_timezone(),
+                                                         first_ts=first_ts,
+                                                         last_ts=min(last_date_ts, self.current_ts()))
+
+            if len(predicate):
+                session_query = f"AND {predicate}"
+
+            # The quotes are filtered after the query as well, so the number of rows is limited after filtering
+            if exact_session is False:
+                num_query = ""
 
         select_quotes = f"""SELECT time_stamp,
                                 datetime(time_stamp, 'unixepoch') AS date_time,
@@ -972,28 +1650,258 @@ class ReadOnlyData():
                                 transactions
                                 {additional_columns}
                                 {additional_queries}
+                                {batch_column}
                             FROM quotes INNER JOIN symbols ON quotes.symbol_id = symbols.symbol_id
                             INNER JOIN timespans ON quotes.time_span_id = timespans.time_span_id
                             {additional_joins}
-                            WHERE symbols.ticker = '{self.symbol}'
+                            WHERE {symbols_query}
                             {timespan_query}
-                            AND time_stamp >= {self.first_date_ts}
+                            AND time_stamp >= {first_ts}
                             AND time_stamp <= {last_date_ts}
                             {source_query}
-                            ORDER BY time_stamp
+                            {session_query}
+                            {order_query}
                             {num_query};"""
 
+        # Plain tuples are obtained for the columnar conversion
+        self.cur.row_factory = None
+
         try:
-            self.cur.execute(select_quotes)
+            self.cur.execute(select_quotes, params)
             rows = self.cur.fetchall()
+            names = [column[0] for column in self.cur.description]
         except self.Error as e:
             raise FdataError(f"Can't execute a query on a table 'quotes': {e}\n{select_quotes}") from e
+        finally:
+            self.cur.row_factory = self.conn.row_factory
+
+        column_dtypes = dict(quote_dtypes)
+
+        if dtypes is not None:
+            column_dtypes.update(dtypes)
+
+        if batch:
+            # Rows are split by symbols before the conversion. The symbol id column is the last one.
+            result = {}
+
+            if len(rows):
+                ids = np.fromiter((row[-1] for row in rows), dtype=np.int64, count=len(rows))
+                bounds = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1, [len(rows)]))
+
+                for start, end in zip(bounds[:-1], bounds[1:]):
+                    result[int(ids[start])] = get_labelled_ndarray(rows[start:end], names=names[:-1], dtypes=column_dtypes)
+
+            return result
 
         if len(rows) == 0:
-            self.log("No data obtained.")
             return None
 
-        return get_labelled_ndarray(rows)
+        rows = get_labelled_ndarray(rows, names=names, dtypes=column_dtypes)
+
+        if exact_session is False:
+            rows = self._trim_session(rows, session, num)
+
+        return rows
+
+    def _trim_session(self, rows, session, num=0):
+        """
+            Keep only the quotes within the session window.
+
+            Args:
+                rows(ndarray): labelled array with quotes data.
+                session(tuple): the (start, end) session window in HH:MM format in the exchange time zone.
+                num(int): the number of rows to keep. 0 keeps all the quotes.
+
+            Returns:
+                ndarray: labelled array with quotes data or None if no quotes are within the window.
+        """
+        rows = rows[get_session_mask(rows[Quotes.TimeStamp], *session, timezone=self.get_timezone())]
+
+        if num > 0:
+            rows = rows[:num]
+
+        if len(rows) == 0:
+            return None
+
+        return rows
+
+    def _get_npy_dir(self):
+        """
+            Get the directory of the memory-mapped quotes cache for the current database.
+
+            Returns:
+                str: the directory or None if the cache is disabled or the database is in memory.
+        """
+        if settings.Quotes.npy_cache_dir is None or self.db_name == '' or ':memory:' in self.db_name or \
+           'mode=memory' in self.db_name:
+            return None
+
+        # The same cache directory may be used by several databases
+        db_path = os.path.abspath(self.db_name)
+        db_title = f"{os.path.basename(db_path)}_{zlib.crc32(db_path.encode()):08x}"
+
+        return os.path.join(settings.Quotes.npy_cache_dir, db_title)
+
+    def _get_npy_path(self, ignore_source=False):
+        """
+            Get the path of the memory-mapped quotes history for the current symbol, source and timespan.
+
+            Args:
+                ignore_souce(bool): indicates if quotes from all the sources are cached.
+
+            Returns:
+                str: the path or None if the cache is disabled or the symbol is not in the database.
+        """
+        npy_dir = self._get_npy_dir()
+        symbol_id = self.get_symbol_id()
+
+        if npy_dir is None or symbol_id is None:
+            return None
+
+        source_id = 'all'
+
+        if ignore_source is False:
+            source_id = self.get_source_id()
+
+        return os.path.join(npy_dir, f"{symbol_id}_{source_id}_{self.timespan}.npy")
+
+    def _get_npy_quotes(self, num=0, ignore_last_date=False, ignore_source=False):
+        """
+            Get quotes for the current dates from the memory-mapped quotes history. The whole history of
+            the symbol is written to the cache if it is not cached yet.
+
+            The history is mapped in copy-on-write mode, so all the processes which read the same history share
+            the pages of the file. The requested rows are copied with restored object columns (like date_time),
+            so the dtypes are the same as of the quotes obtained from the database.
+
+            Args:
+                num(int): the number of rows to get. 0 gets all the quotes.
+                ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
+                ignore_souce(bool): indicates if quotes should be obtained only from a particular source
+
+            Returns:
+                ndarray: labelled array with quotes data or None if no data obtained.
+
+            Raises:
+                FdataError: sql or file system error happened.
+        """
+        path = self._get_npy_path(ignore_source)
+
+        try:
+            history = np.load(path, mmap_mode='c')
+        except (FileNotFoundError, ValueError):
+            history = None
+        except OSError as e:
+            raise FdataError(f"Can't read the quotes cache {path}: {e}") from e
+
+        if history is None:
+            rows = self._select_quotes(symbol_ids=[self.get_symbol_id()],
+                                       ignore_last_date=True,
+                                       ignore_source=ignore_source,
+                                       first_ts=def_first_date)
+
+            if rows is None:
+                return None
+
+            # Object columns can not be memory-mapped
+            history = pack_objects(rows)
+
+            # Write to a temporary file at first to prevent reading of incomplete files by other processes
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+
+                try:
+                    with os.fdopen(fd, 'wb') as npy_file:
+                        np.save(npy_file, history)
+
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+                history = np.load(path, mmap_mode='c')
+            except OSError as e:
+                raise FdataError(f"Can't write the quotes cache {path}: {e}") from e
+
+        last_date_ts = calendar.timegm(self.set_eod_time(self.last_date).utctimetuple())
+
+        if ignore_last_date:
+            last_date_ts = def_last_date
+
+        first_idx = np.searchsorted(history[Quotes.TimeStamp], self.first_date_ts, side='left')
+        last_idx = np.searchsorted(history[Quotes.TimeStamp], last_date_ts, side='right')
+
+        if num > 0:
+            last_idx = min(last_idx, first_idx + num)
+
+        if last_idx <= first_idx:
+            return None
+
+        return unpack_objects(history[first_idx:last_idx], quote_objects)
+
+    def remove_npy_quotes(self, symbol_id=None):
+        """
+            Remove the memory-mapped quotes histories of the symbol (for all sources and timespans).
+
+            Args:
+                symbol_id(int): the id of the symbol. The current symbol is used if None.
+
+            Raises:
+                FdataError: file system error happened.
+        """
+        npy_dir = self._get_npy_dir()
+
+        if symbol_id is None:
+            symbol_id = self.get_symbol_id()
+
+        if npy_dir is None or symbol_id is None:
+            return
+
+        for path in glob.glob(os.path.join(npy_dir, f"{symbol_id}_*.npy")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                raise FdataError(f"Can't remove the quotes cache {path}: {e}") from e
+
+    def _invalidate_npy_quotes(self, symbol_id=None):
+        """
+            Invalidate the memory-mapped quotes histories of the symbol changed by the current transaction.
+
+            The histories are removed only when the changes are committed. Otherwise other processes may write
+            the history of the symbol again using the data which is not changed yet.
+
+            Args:
+                symbol_id(int): the id of the symbol. The current symbol is used if None.
+
+            Raises:
+                FdataError: file system error happened.
+        """
+        if symbol_id is None:
+            symbol_id = self.get_symbol_id()
+
+        if self._get_npy_dir() is None or symbol_id is None:
+            return
+
+        self.database.get_stale_npy().add(symbol_id)
+
+        self._remove_stale_npy()
+
+    def _remove_stale_npy(self):
+        """
+            Remove the memory-mapped quotes histories which are stale after the commit of the changes.
+            Nothing is removed while the transaction is open.
+
+            Raises:
+                FdataError: file system error happened.
+        """
+        stale = self.database.get_stale_npy()
+
+        while len(stale) and self.conn.in_transaction is False:
+            self.remove_npy_quotes(stale.pop())
 
     def get_quotes_num(self):
         """
@@ -1042,9 +1950,9 @@ class ReadOnlyData():
         self.check_if_connected()
 
         get_num = f"""SELECT COUNT(*) FROM {table}
-                        WHERE symbol_id = (SELECT symbol_id FROM symbols where ticker = '{self.symbol}');"""
+                        WHERE symbol_id = ?;"""
         try:
-            self.cur.execute(get_num)
+            self.cur.execute(get_num, (self.get_symbol_id(), ))
         except self.Error as e:
             raise FdataError(f"Can't query table '{table}': {e}\n\nThe query is\n{get_num}") from e
 
@@ -1069,11 +1977,11 @@ class ReadOnlyData():
         self.check_if_connected()
 
         get_mod_ts = f"""SELECT {column} FROM {table}
-                            WHERE symbol_id = (SELECT symbol_id FROM symbols where ticker = '{self.symbol}')
+                            WHERE symbol_id = ?
                             ORDER BY modified DESC LIMIT 1;"""
 
         try:
-            self.cur.execute(get_mod_ts)
+            self.cur.execute(get_mod_ts, (self.get_symbol_id(), ))
         except self.Error as e:
             raise FdataError(f"Can't query table '{table}': {e}\n\nThe query is\n{get_mod_ts}") from e
 
@@ -1143,14 +2051,14 @@ class ReadOnlyData():
             dt_str = f"AND time_stamp >= {self.first_date_ts} AND time_stamp <= {last_date_ts}"
 
         num_query = f"""SELECT COUNT(*) FROM quotes
-                            WHERE symbol_id = (SELECT symbol_id FROM symbols where ticker = '{self.symbol}')
+                            WHERE symbol_id = ?
                             {dt_str}
-                            AND time_span_id = (SELECT time_span_id FROM timespans where title = '{self.timespan}')
-                            AND source_id = (SELECT source_id FROM sources where title = '{self.source_title}')
+                            AND time_span_id = ?
+                            AND source_id = ?
                         ;"""
 
         try:
-            self.cur.execute(num_query)
+            self.cur.execute(num_query, (self.get_symbol_id(), self.get_timespan_id(), self.get_source_id()))
         except self.Error as e:
             raise FdataError(f"Can't execute a query on a table 'quotes': {e}\n{num_query}") from e
 
@@ -1184,15 +2092,12 @@ class ReadOnlyData():
         self.check_if_connected()
 
         timestamp_query = f"""SELECT {minmax}({column}) FROM {table}
-                                    INNER JOIN symbols ON {table}.symbol_id = symbols.symbol_id
-                                    INNER JOIN sources on {table}.source_id = sources.source_id
-                                    INNER JOIN timespans on {table}.time_span_id = timespans.time_span_id
-                                    WHERE symbols.ticker = '{self.symbol}'
-                                    AND sources.title = '{self.source_title}'
-                                    AND timespans.title = '{self.timespan}';"""
+                                    WHERE symbol_id = ?
+                                    AND source_id = ?
+                                    AND time_span_id = ?;"""
 
         try:
-            self.cur.execute(timestamp_query)
+            self.cur.execute(timestamp_query, (self.get_symbol_id(), self.get_source_id(), self.get_timespan_id()))
         except self.Error as e:
             raise FdataError(f"Can't execute a query on a table '{table}': {e}\n{timestamp_query}") from e
 
@@ -1206,17 +2111,43 @@ class ReadOnlyData():
             Return:
                 int: the earliest request timestamp.
         """
-        return self._get_ts(table='quote_intervals', column='min_request_ts')
+        return self._get_ts(is_max=False, table='quote_ranges', column='first_ts')
 
     def get_max_request_ts(self):
         """
-            Get the earliest request timestamp to obtain quotes for a particular symbol,
+            Get the latest request timestamp to obtain quotes for a particular symbol,
             timespan, source.
 
             Return:
-                int: the earliest request timestamp.
+                int: the latest request timestamp.
+        """
+        return self._get_ts(table='quote_ranges', column='last_ts')
+
+    def get_quote_ranges(self):
+        """
+            Get the ranges of requested quotes for a particular symbol, timespan, source.
+
+            Returns:
+                list: (first_ts, last_ts) pairs of the ranges ordered by the first timestamp.
+
+            Raises:
+                FdataError: sql error happened.
         """
-        return self._get_ts(table='quote_intervals', column='max_request_ts')
+        self.check_if_connected()
+
+        ranges_query = """SELECT first_ts, last_ts FROM quote_ranges
+                                WHERE symbol_id = ?
+                                AND source_id = ?
+                                AND time_span_id = ?
+                                ORDER BY first_ts;"""
+
+        try:
+            self.cur.execute(ranges_query, (self.get_symbol_id(), self.get_source_id(), self.get_timespan_id()))
+            rows = self.cur.fetchall()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'quote_ranges': {e}\n{ranges_query}") from e
+
+        return [(row[0], row[1]) for row in rows]
 
     def get_max_ts(self):
         """
@@ -1258,10 +2189,10 @@ class ReadOnlyData():
         info_query = f"""SELECT time_zone, s.title as sec_type, c.title as curr FROM sec_info si
                             INNER JOIN sectypes s ON si.sec_type_id = s.sec_type_id
                             INNER JOIN currency c ON si.currency_id = c.currency_id
-                            WHERE symbol_id = (SELECT symbol_id FROM symbols WHERE ticker='{self.symbol}')"""
+                            WHERE symbol_id = ?"""
 
         try:
-            self.cur.execute(info_query)
+            self.cur.execute(info_query, (self.get_symbol_id(), ))
             rows = self.cur.fetchall()
         except self.Error as e:
             raise FdataError(f"Can't execute a query on a table 'sec_info': {e}\n{info_query}") from e
@@ -1417,6 +2348,8 @@ class ReadOnlyData():
         except self.Error as e:
             raise FdataError(f"Can't commit: {e}") from e
 
+        self._remove_stale_npy()
+
 #############################
 # Read/Write operations class
 #############################
@@ -1474,12 +2407,18 @@ class ReadWriteData(ReadOnlyData):
         insert_symbol = f"""INSERT OR IGNORE INTO symbols (ticker) VALUES (
                                 '{self.symbol}');"""
 
+        self.database.begin()
+
         try:
             self.cur.execute(insert_symbol)
-            self.conn.commit()
         except self.Error as e:
+            self.database.rollback()
             raise FdataError(f"Can't execute a query on a table 'symbols': {e}\n{insert_symbol}") from e
 
+        self.database.release()
+
+        self.reset_ids('symbols')
+
     def remove_symbol(self):
         """
             Remove a symbol completely.
@@ -1493,14 +2432,26 @@ class ReadWriteData(ReadOnlyData):
 
         # Cascade delete will remove the corresponding entries in tables related to specific security data
         # like fundamentals for stock
-        delete_symbol = f"DELETE FROM symbols WHERE symbol_id = (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}');"
+        delete_symbol = "DELETE FROM symbols WHERE symbol_id = ?;"
+
+        symbol_id = self.get_symbol_id()
+
+        self.database.begin()
 
         try:
-            self.cur.execute(delete_symbol)
-            self.conn.commit()
+            self.cur.execute(delete_symbol, (symbol_id, ))
         except self.Error as e:
+            self.database.rollback()
             raise FdataError(f"Can't execute a query on a table 'symbols': {e}\n{delete_symbol}") from e
 
+        self.database.release()
+
+        self._invalidate_npy_quotes(symbol_id)
+
+        # The removed id may be cached by other instances which share the connection
+        self.reset_ids('symbols')
+        self.database.invalidate_ids()
+
     def _add_base_quote_data(self, quote):
         """
             Add base quote data (similar for all security types) to the database but do not perform commit.
@@ -1527,10 +2478,10 @@ class ReadWriteData(ReadOnlyData):
                                                                     volume,
                                                                     transactions)
                             VALUES (
-                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
+                            ({self.get_symbol_id()}),
+                            ({self.get_source_id()}),
                             ({quote['ts']}),
-                            (SELECT time_span_id FROM timespans WHERE title = '{self.timespan.value}' COLLATE NOCASE),
+                            ({self.get_timespan_id()}),
                             ({quote['open']}),
                             ({quote['high']}),
                             ({quote['low']}),
@@ -1546,103 +2497,298 @@ class ReadWriteData(ReadOnlyData):
 
         return self.cur.lastrowid
 
-    def add_quotes(self, quotes_dict):
+    def add_quotes_bulk(self, quotes_dict):
         """
-            Add quotes to the database.
+            Add quotes to the database using one prepared statement in a single transaction.
+
+            Symbol, source and timespan ids are resolved only once and all the rows are passed to executemany().
+            The rows are added within the savepoint of the instance, so the pending changes of other instances
+            which share the connection are neither rolled back on error nor committed.
 
             Args:
                 quotes_dict(list of dictionaries): quotes obtained from an API wrapper.
 
             Returns:
-                (int, int): the total number of quotes before and after the operation.
+                dict: the number of 'inserted' and 'replaced' (or 'ignored' if update is False) rows and
+                      'elapsed' time in seconds.
 
             Raises:
                 FdataError: sql error happened.
         """
         self.check_if_connected()
 
+        start = perf_counter()
+
+        stats = {'inserted': 0, 'replaced': 0, 'ignored': 0, 'elapsed': 0}
+
+        if quotes_dict is None:
+            return stats
+
         # Insert new symbols to 'symbols' table (if the symbol does not exist)
         if self.get_total_symbol_quotes_num() == 0:
             self.add_symbol()
 
-        num_before = self.get_quotes_num()
+        symbol_id = self.get_symbol_id()
+        source_id = self.get_source_id()
+        time_span_id = self.get_timespan_id()
+
+        rows = [(symbol_id,
+                 source_id,
+                 get_sql_value(quote['ts']),
+                 time_span_id,
+                 get_sql_value(quote['open']),
+                 get_sql_value(quote['high']),
+                 get_sql_value(quote['low']),
+                 get_sql_value(quote['close']),
+                 get_sql_value(quote['volume']),
+                 get_sql_value(quote['transactions'])) for quote in quotes_dict]
 
-        if quotes_dict is not None:
-            for quote in quotes_dict:
-                self._add_base_quote_data(quote)
+        if len(rows) == 0:
+            return stats
 
-            self.commit()
+        min_ts = min(row[2] for row in rows)
+        max_ts = max(row[2] for row in rows)
 
-        num_after = self.get_quotes_num()
+        count_quotes = """SELECT COUNT(*) FROM quotes
+                            WHERE symbol_id = ?
+                            AND source_id = ?
+                            AND time_span_id = ?
+                            AND time_stamp >= ?
+                            AND time_stamp <= ?;"""
 
-        self.update_quote_intervals()
+        count_params = (symbol_id, source_id, time_span_id, min_ts, max_ts)
 
-        return (num_before, num_after)
+        insert_quotes = f"""INSERT OR {self._update} INTO quotes (symbol_id,
+                                                                    source_id,
+                                                                    time_stamp,
+                                                                    time_span_id,
+                                                                    opened,
+                                                                    high,
+                                                                    low,
+                                                                    closed,
+                                                                    volume,
+                                                                    transactions)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""
 
-    def update_quote_intervals(self):
-        """
-            Update the earliest requested quote (if needed).
-        """
-        now = self.current_ts(adjusted=True)
-        ts = min(now, self.last_date_ts)
-
-        # TODO LOW Write it in a more rational way (if it is ever possible on sqlite)
-        update_fetched = f"""INSERT OR REPLACE INTO quote_intervals (symbol_id, time_span_id, source_id, min_request_ts, max_request_ts)
-                              VALUES ((SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                      (SELECT time_span_id FROM timespans WHERE title = '{self.timespan}'),
-                                      (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
-                                      (SELECT ifnull(
-                                                     (SELECT min(min_request_ts, {self.first_date_ts})
-	                                                  FROM quote_intervals
-	                                                  WHERE symbol_id = (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}')
-	                                                  AND source_id = (SELECT source_id FROM sources WHERE title = '{self.source_title}')
-	                                                  AND time_span_id = (SELECT time_span_id FROM timespans WHERE title = '{self.timespan}')
-                                              ), {self.first_date_ts})),
-                                      (SELECT ifnull(
-                                                     (SELECT max(max_request_ts, {ts})
-                                                      FROM quote_intervals
-                                                      WHERE symbol_id = (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}')
-                                                      AND source_id = (SELECT source_id FROM sources WHERE title = '{self.source_title}')
-                                                      AND time_span_id = (SELECT time_span_id FROM timespans WHERE title = '{self.timespan}')
-                                              ), {ts}))
-                           );"""
+        self.database.begin()
 
         try:
-            self.cur.execute(update_fetched)
-            self.conn.commit()
+            self.cur.execute(count_quotes, count_params)
+            num_before = self.cur.fetchone()[0]
+
+            self.cur.executemany(insert_quotes, rows)
+
+            self.cur.execute(count_quotes, count_params)
+            num_after = self.cur.fetchone()[0]
         except self.Error as e:
-            raise FdataError(f"Can't execute a query on a table 'quote_intervals': {e}\n{update_fetched}") from e
+            self.database.rollback()
+            raise FdataError(f"Can't add quotes data to a table 'quotes': {e}\n\nThe query is\n{insert_quotes}") from e
 
-    def remove_quotes(self):
-        """
-            Remove quotes from the database.
+        self.database.release()
 
-            Raises:
-                FdataError: sql error happened.
-        """
-        self.check_if_connected()
+        self._invalidate_npy_quotes()
 
-        remove_quotes = f"""DELETE FROM quotes WHERE symbol_id = (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}')
-                            AND time_stamp >= {self.first_date_ts} AND time_stamp <= {self.last_date_ts};"""
+        stats['inserted'] = num_after - num_before
 
-        try:
-            self.cur.execute(remove_quotes)
-            self.conn.commit()
-        except self.Error as e:
-            raise FdataError(f"Can't execute a query on a table 'quotes': {e}\n{remove_quotes}") from e
+        if self.update:
+            stats['replaced'] = len(rows) - stats['inserted']
+        else:
+            stats['ignored'] = len(rows) - stats['inserted']
 
-        # Check if symbol is removed completely
-        if self.get_total_symbol_quotes_num() == 0:
-            self.remove_symbol()
+        stats['elapsed'] = perf_counter() - start
 
-    def add_info(self, info):
+        self.log(f"Quotes for {self.symbol} inserted: {stats['inserted']}, replaced: {stats['replaced']}, " +\
+                 f"ignored: {stats['ignored']} in {round(stats['elapsed'], 3)} seconds.")
+
+        return stats
+
+    def add_quotes(self, quotes_dict, bulk=True, first_ts=None, last_ts=None):
         """
-            Add security info to the database.
+            Add quotes to the database.
 
             Args:
-                info(dict): Security info obtained from an API wrapper.
+                quotes_dict(list of dictionaries): quotes obtained from an API wrapper.
+                bulk(bool): indicates if the bulk ingestion path should be used. Otherwise each quote is inserted
+                            by a separate query.
+                first_ts(int): the first timestamp of the requested range (the current first date is used if None).
+                last_ts(int): the last timestamp of the requested range (the current last date is used if None).
 
-            Raises:
+            Returns:
+                (int, int): the total number of quotes before and after the operation.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        # Insert new symbols to 'symbols' table (if the symbol does not exist)
+        if self.get_total_symbol_quotes_num() == 0:
+            self.add_symbol()
+
+        num_before = self.get_quotes_num()
+
+        if quotes_dict is not None:
+            if bulk:
+                self.add_quotes_bulk(quotes_dict)
+            else:
+                self.database.begin()
+
+                try:
+                    for quote in quotes_dict:
+                        self._add_base_quote_data(quote)
+                except FdataError:
+                    self.database.rollback()
+                    raise
+
+                self.database.release()
+
+                self._invalidate_npy_quotes()
+
+        num_after = self.get_quotes_num()
+
+        self.update_quote_intervals(first_ts=first_ts, last_ts=last_ts)
+
+        return (num_before, num_after)
+
+    def update_quote_intervals(self, first_ts=None, last_ts=None):
+        """
+            Add the range of requested quotes. The ranges which overlap or adjoin the new one are merged with it.
+
+            Args:
+                first_ts(int): the first timestamp of the range. The current first date is used if None.
+                last_ts(int): the last timestamp of the range. The current last date (but not later than the
+                              current time) is used if None.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        if first_ts is None:
+            first_ts = self.first_date_ts
+
+        if last_ts is None:
+            last_ts = self.last_date_ts
+
+        last_ts = min(last_ts, self.current_ts(adjusted=True))
+
+        if first_ts > last_ts:
+            return
+
+        params = {'symbol_id': self.get_symbol_id(),
+                  'source_id': self.get_source_id(),
+                  'time_span_id': self.get_timespan_id(),
+                  'first_ts': first_ts,
+                  'last_ts': last_ts}
+
+        condition = """WHERE symbol_id = :symbol_id
+                        AND source_id = :source_id
+                        AND time_span_id = :time_span_id
+                        AND first_ts <= :last_ts + 1
+                        AND last_ts >= :first_ts - 1"""
+
+        get_merged = f"SELECT min(min(first_ts), :first_ts), max(max(last_ts), :last_ts) FROM quote_ranges {condition};"
+        remove_merged = f"DELETE FROM quote_ranges {condition};"
+        insert_range = """INSERT INTO quote_ranges (symbol_id, source_id, time_span_id, first_ts, last_ts)
+                                VALUES (:symbol_id, :source_id, :time_span_id, :first_ts, :last_ts);"""
+
+        self.database.begin()
+
+        try:
+            self.cur.execute(get_merged, params)
+            row = self.cur.fetchone()
+
+            if row[0] is not None:
+                params['first_ts'], params['last_ts'] = row[0], row[1]
+
+            self.cur.execute(remove_merged, params)
+            self.cur.execute(insert_range, params)
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't execute a query on a table 'quote_ranges': {e}\n{get_merged}") from e
+
+        self.database.release()
+
+    def _remove_quote_ranges(self, first_ts, last_ts):
+        """
+            Exclude the range from the requested ranges of quotes of the current symbol for all sources and timespans.
+
+            Args:
+                first_ts(int): the first timestamp of the range to exclude.
+                last_ts(int): the last timestamp of the range to exclude.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        params = {'symbol_id': self.get_symbol_id(), 'first_ts': first_ts, 'last_ts': last_ts}
+
+        condition = """WHERE symbol_id = :symbol_id
+                        AND first_ts <= :last_ts
+                        AND last_ts >= :first_ts"""
+
+        get_affected = f"SELECT source_id, time_span_id, first_ts, last_ts FROM quote_ranges {condition};"
+        remove_affected = f"DELETE FROM quote_ranges {condition};"
+        insert_range = """INSERT INTO quote_ranges (symbol_id, source_id, time_span_id, first_ts, last_ts)
+                                VALUES (?, ?, ?, ?, ?);"""
+
+        try:
+            self.cur.execute(get_affected, params)
+            rows = self.cur.fetchall()
+
+            self.cur.execute(remove_affected, params)
+
+            # Keep the parts of the ranges which are outside of the excluded range
+            for row in rows:
+                if row['first_ts'] < first_ts:
+                    self.cur.execute(insert_range, (params['symbol_id'], row['source_id'], row['time_span_id'],
+                                                    row['first_ts'], first_ts - 1))
+
+                if row['last_ts'] > last_ts:
+                    self.cur.execute(insert_range, (params['symbol_id'], row['source_id'], row['time_span_id'],
+                                                    last_ts + 1, row['last_ts']))
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'quote_ranges': {e}\n{get_affected}") from e
+
+    def remove_quotes(self):
+        """
+            Remove quotes from the database.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        remove_quotes = f"""DELETE FROM quotes WHERE symbol_id = ?
+                            AND time_stamp >= {self.first_date_ts} AND time_stamp <= {self.last_date_ts};"""
+
+        self.database.begin()
+
+        try:
+            self.cur.execute(remove_quotes, (self.get_symbol_id(), ))
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't execute a query on a table 'quotes': {e}\n{remove_quotes}") from e
+
+        try:
+            self._remove_quote_ranges(self.first_date_ts, self.last_date_ts)
+        except FdataError:
+            self.database.rollback()
+            raise
+
+        self.database.release()
+
+        self._invalidate_npy_quotes()
+
+        # Check if symbol is removed completely
+        if self.get_total_symbol_quotes_num() == 0:
+            self.remove_symbol()
+
+    def add_info(self, info):
+        """
+            Add security info to the database.
+
+            Args:
+                info(dict): Security info obtained from an API wrapper.
+
+            Raises:
                 FdataError: sql error happened.
         """
         if self._sec_info_supported:
@@ -1666,19 +2812,173 @@ class ReadWriteData(ReadOnlyData):
                                         sec_type_id,
                                         currency_id)
                                     VALUES (
-                                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
+                                            ({self.get_symbol_id()}),
+                                            ({self.get_source_id()}),
                                             ('{time_zone}'),
                                             (SELECT sec_type_id FROM sectypes WHERE title = '{sec_type}'),
                                             (SELECT currency_id FROM currency WHERE title = '{currency}')
                                         );"""
 
+            self.database.begin()
+
             try:
                 self.cur.execute(insert_info)
             except self.Error as e:
+                self.database.rollback()
                 raise FdataError(f"Can't add a record to a table 'sec_info': {e}\n\nThe query is\n{insert_info}") from e
 
-            self.commit()
+            self.database.release()
+
+#####################
+# API queries limiting
+#####################
+class RateLimiter():
+    """
+        Thread safe token bucket limiter of API queries.
+
+        The bucket allows a burst of queries and then refills at the constant rate. The burst and the rate are chosen
+        so that the number of queries within any minute does not exceed the limit.
+    """
+    def __init__(self, max_queries, burst=None):
+        """
+            Initialize the limiter.
+
+            Args:
+                max_queries(int): the maximum number of queries per minute.
+                burst(int): the number of queries allowed without waiting. 10% of the limit is used if None.
+        """
+        self._lock = threading.Lock()
+
+        self.set_limit(max_queries, burst)
+
+        self._tokens = self._burst
+        self._updated = perf_counter()
+
+    def set_limit(self, max_queries, burst=None):
+        """
+            Set the limit of queries.
+
+            Args:
+                max_queries(int): the maximum number of queries per minute.
+                burst(int): the number of queries allowed without waiting. 10% of the limit is used if None.
+        """
+        if burst is None:
+            burst = max(1, max_queries // 10)
+
+        burst = min(burst, max_queries)
+
+        with self._lock:
+            self.max_queries = max_queries
+            self._burst = burst
+
+            # Queries per second. At least the burst is kept for the next minute if the limit is too low.
+            self._rate = max(max_queries - burst, 1) / 60
+
+    def acquire(self):
+        """
+            Take a token from the bucket waiting for it if needed.
+
+            Tokens are reserved in the order of requests, so the waiting threads are served in turn.
+
+            Returns:
+                float: time in seconds spent for waiting.
+        """
+        with self._lock:
+            now = perf_counter()
+
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+
+            self._tokens -= 1
+
+            wait_time = max(0, -self._tokens / self._rate)
+
+        if wait_time > 0:
+            sleep(wait_time)
+
+        return wait_time
+
+# Limiters shared among all data source instances in the process
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(source_title, api_key, max_queries):
+    """
+        Get the limiter of API queries shared by all data sources using the same API key.
+
+        Args:
+            source_title(str): the title of the data source.
+            api_key(str): the API key.
+            max_queries(int): the maximum number of queries per minute.
+
+        Returns:
+            RateLimiter: the limiter for the source and API key.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get((source_title, api_key))
+
+        if limiter is None:
+            limiter = RateLimiter(max_queries)
+            _limiters[(source_title, api_key)] = limiter
+        elif limiter.max_queries != max_queries:
+            limiter.set_limit(max_queries)
+
+    return limiter
+
+###############
+# HTTP sessions
+###############
+
+# Sessions shared among all data source instances in the process
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_http_session(source_title):
+    """
+        Get the HTTP session shared by all instances of the data source.
+
+        The session keeps the connections alive, so the following requests to the same host do not need new TCP and TLS
+        handshakes. Failed requests are retried with backoff according to the settings.
+
+        Args:
+            source_title(str): the title of the data source.
+
+        Returns:
+            requests.Session: the session of the data source.
+    """
+    with _sessions_lock:
+        session = _sessions.get(source_title)
+
+        if session is None:
+            retry = Retry(total=settings.Http.retries,
+                          backoff_factor=settings.Http.backoff_factor,
+                          status_forcelist=settings.Http.retry_statuses,
+                          allowed_methods=['GET'],
+                          raise_on_status=False)
+
+            adapter = HTTPAdapter(pool_connections=settings.Http.pool_size,
+                                  pool_maxsize=settings.Http.pool_size,
+                                  max_retries=retry)
+
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Cache-Control': 'no-cache',  # Disable cache for the requests
+                                    'Accept-Encoding': 'gzip, deflate'})
+
+            _sessions[source_title] = session
+
+    return session
+
+def close_http_sessions():
+    """
+        Close all the shared HTTP sessions (new ones will be created on the next requests).
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+
+        _sessions.clear()
 
 ##########################
 # Base data fetching class
@@ -1692,10 +2992,10 @@ class BaseFetcher(ReadWriteData, metaclass=abc.ABCMeta):
         super().__init__(**kwargs)
 
         self.max_queries = None # Maximul allowed number of API queries per minute
-        self._queries = []  # List of queries to calculate API call pauses
+        self.api_key = None  # API key of the data source (queries limit is shared by all instances with the same key)
 
     # TODO LOW Think of adding an argument flag which indicates if quotes should be re-fetched
-    def get(self, num=0, columns=None, joins=None, queries=None, ignore_last_date=False):
+    def get(self, num=0, columns=None, joins=None, queries=None, ignore_last_date=False, asof=False, session=None):
         """
             Check is the required number of quotes exist in the database and fetch if not.
             The data will be cached in the database. This method will connect to the database automatically if needed.
@@ -1707,6 +3007,8 @@ class BaseFetcher(ReadWriteData, metaclass=abc.ABCMeta):
                 joins(list): additional joins to get data from other tables.
                 queries(list): additional queries from other tables (like funamental, global economic data).
                 ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
+                asof(bool): indicates if additional queries should be aligned to quotes by as-of join.
+                session(tuple): the (start, end) session window in HH:MM format in the exchange time zone.
 
             Returns:
                 array: the fetched data.
@@ -1717,94 +3019,577 @@ class BaseFetcher(ReadWriteData, metaclass=abc.ABCMeta):
         if self.is_connected() is False:
             self.db_connect()
 
-        current_num = self.get_symbol_quotes_num()
-        total_num = self.get_symbol_quotes_num(dt=False)
+        self.fetch_missing_quotes()
 
-        last_ts_adj = min(self.last_date_ts, self.current_ts())
+        rows = self.get_quotes(num=num,
+                               columns=columns,
+                               joins=joins,
+                               queries=queries,
+                               ignore_last_date=ignore_last_date,
+                               asof=asof,
+                               session=session)
 
-        # We need to check if the earliest and latest dates in database exceed the requested date for specified
-        # source and time span. If not, no need to fetch.
-        if current_num == 0 or self.first_date_ts < self.get_min_request_ts() or last_ts_adj > self.get_max_request_ts():
-            intervals = []
+        if initially_connected is False:
+            self.db_close()
 
-            # Adjust intervals to avoid gaps in quotes database and also to avoid excessive fetching of quotes
-            # if they already present in DB.
-            if total_num:
-                # New interval exceeds the old one on both sides
-                if self.first_date_ts < self.get_min_request_ts() and last_ts_adj > self.get_max_request_ts():
-                    intervals.append([self.first_date_ts, self.get_min_request_ts()])
-                    intervals.append([self.get_max_request_ts(), last_ts_adj])
+        return rows
 
-                # New interval is completely before the old interval
-                elif self.first_date_ts < self.get_min_request_ts() and last_ts_adj < self.get_min_request_ts():
-                    intervals.append([self.first_date_ts, self.get_min_request_ts()])
+    def fetch_missing_data(self, stale=None):
+        """
+            Fetch all the data of the current symbol which is not requested yet and add it to the database.
+            The same data as by fetch_missing_data_async() is fetched but API requests are issued sequentially.
 
-                # New interval is completely after the old interval
-                elif self.first_date_ts > self.get_max_request_ts() and last_ts_adj > self.get_max_request_ts():
-                    intervals.append([self.get_max_request_ts(), last_ts_adj])
+            Args:
+                stale(set): the tables which data is stale according to the refresh plan (see get_refresh_plan()).
+                            If None, the freshness of each data is checked separately.
 
-                # New interval is before the old inverval but has an overlap with the old one
-                elif self.first_date_ts < self.get_min_request_ts() and last_ts_adj > self.get_min_request_ts():
-                    intervals.append([self.first_date_ts, self.get_min_request_ts()])
+            Raises:
+                FdataError: sql error happened or the data can't be fetched.
+        """
+        initially_connected = self.is_connected()
 
-                # New interval is after the old interval but has an overlap with the old one
-                elif self.first_date_ts < self.get_max_request_ts() and last_ts_adj > self.get_max_request_ts():
-                    intervals.append([self.get_max_request_ts(), last_ts_adj])
-            else:
-                intervals.append([self.first_date_ts, last_ts_adj])
+        if self.is_connected() is False:
+            self.db_connect()
 
-            for first_ts, last_ts in intervals:
-                self.log(f"Fetching contiguous data for {self.symbol} from {get_dt(first_ts)} to {get_dt(last_ts)}...")
+        try:
+            prerequisites, jobs = self._get_fetch_jobs(stale)
 
-                self.add_quotes(self.fetch_quotes(first_ts=first_ts, last_ts=last_ts))
+            for fetch, add in prerequisites:
+                add(fetch())
 
-        rows = self.get_quotes(num=num, columns=columns, joins=joins, queries=queries, ignore_last_date=ignore_last_date)
+            self.fetch_missing_quotes(self._get_quotes_fetcher())
 
-        if initially_connected is False:
-            self.db_close()
+            for fetch, add in jobs:
+                add(fetch())
+        finally:
+            if initially_connected is False:
+                self.db_close()
 
-        return rows
+    def fetch_missing_quotes(self, fetch_quotes=None):
+        """
+            Fetch the quotes which are not requested yet for the current dates and add them to the database.
+
+            Args:
+                fetch_quotes(callable): the method to fetch quotes which accepts first_ts and last_ts.
+                                        fetch_quotes() is used if None.
+        """
+        if fetch_quotes is None:
+            fetch_quotes = self.fetch_quotes
+
+        for first_ts, last_ts in self.get_missing_intervals():
+            self.log(f"Fetching contiguous data for {self.symbol} from {get_dt(first_ts)} to {get_dt(last_ts)}...")
+
+            self.add_quotes(fetch_quotes(first_ts=first_ts, last_ts=last_ts), first_ts=first_ts, last_ts=last_ts)
+
+    def get_missing_intervals(self):
+        """
+            Get the intervals of quotes which are not requested yet for the current dates. These are the gaps between
+            the requested ranges of quotes within the current dates.
+
+            Returns:
+                list: [first_ts, last_ts] pairs of the intervals to fetch.
+        """
+        self.check_if_connected()
+
+        first_ts = self.first_date_ts
+        # The current period of the time span is requested as a whole, so recent quotes are re-checked once per period
+        last_ts = min(self.last_date_ts, self.current_ts(adjusted=True))
+
+        intervals = []
+
+        for range_first, range_last in self.get_quote_ranges():
+            if first_ts > last_ts or range_first > last_ts:
+                break
+
+            if range_last < first_ts:
+                continue
+
+            if range_first > first_ts:
+                intervals.append([first_ts, range_first - 1])
+
+            first_ts = max(first_ts, range_last + 1)
+
+        if first_ts <= last_ts:
+            intervals.append([first_ts, last_ts])
+
+        return intervals
+
+    ###########################
+    # Concurrent data fetching
+    ###########################
+
+    def _get_fetch_jobs(self, stale=None):
+        """
+            Get the jobs to fetch the missing data of the current symbol (except quotes) concurrently.
+
+            Each job is a pair of a callable without arguments which performs API requests and parses the response
+            and a method to add the parsed result to the database. Fetching callables are invoked in worker threads,
+            so they must not access the database. Derived classes may add jobs for additional data.
+
+            Args:
+                stale(set): the tables which data is stale according to the refresh plan. If None, the freshness
+                            of each data is checked separately.
+
+            Returns:
+                list: prerequisite jobs which results should be added before fetching quotes.
+                list: other jobs.
+        """
+        return ([], [])
+
+    def _get_quotes_fetcher(self):
+        """
+            Get the callable to fetch quotes in a worker thread. It is obtained when prerequisite data is already
+            in the database. Derived classes may override it if fetching quotes needs some database data.
+
+            Returns:
+                callable: the method to fetch quotes which accepts first_ts and last_ts.
+        """
+        return self.fetch_quotes
+
+    async def fetch_missing_data_async(self, stale=None):
+        """
+            Fetch all the data of the current symbol which is not requested yet and add it to the database
+            issuing independent API requests concurrently.
+
+            API requests are performed in worker threads and they are limited by the shared limiter of API queries.
+            The parsed results are added to the database by the thread which runs the event loop (as the database
+            connection can't be shared among threads). Usage: asyncio.run(source.fetch_missing_data_async())
+
+            Args:
+                stale(set): the tables which data is stale according to the refresh plan (see get_refresh_plan()).
+                            If None, the freshness of each data is checked separately.
+
+            Raises:
+                FdataError: sql error happened or the data can't be fetched.
+        """
+        initially_connected = self.is_connected()
+
+        if self.is_connected() is False:
+            self.db_connect()
+
+        try:
+            # Info is used to parse the most of responses, so it is obtained (and cached) at first.
+            self.get_timezone()
+            self.get_currency()
+
+            prerequisites, jobs = self._get_fetch_jobs(stale)
+
+            started = {}  # Add methods by all started tasks
+
+            try:
+                other_tasks = self._start_jobs(jobs, started)
+
+                await self._add_fetched(self._start_jobs(prerequisites, started))
+
+                fetch_quotes = self._get_quotes_fetcher()
+                quote_jobs = []
+
+                for first_ts, last_ts in self.get_missing_intervals():
+                    self.log(f"Fetching contiguous data for {self.symbol} from {get_dt(first_ts)} to {get_dt(last_ts)}...")
+
+                    quote_jobs.append((functools.partial(fetch_quotes, first_ts=first_ts, last_ts=last_ts),
+                                       functools.partial(self.add_quotes, first_ts=first_ts, last_ts=last_ts)))
+
+                await self._add_fetched(self._start_jobs(quote_jobs, started))
+                await self._add_fetched(other_tasks)
+            finally:
+                # Worker threads can't be interrupted, so wait for them before closing the connection
+                await asyncio.gather(*started, return_exceptions=True)
+        finally:
+            if initially_connected is False:
+                self.db_close()
+
+    @staticmethod
+    def _start_jobs(jobs, started):
+        """
+            Start the fetching jobs in worker threads.
+
+            Args:
+                jobs(list): (fetch, add) pairs of jobs to start.
+                started(dict): add methods by all started tasks to update.
+
+            Returns:
+                dict: add methods by the started tasks.
+        """
+        tasks = {asyncio.create_task(asyncio.to_thread(fetch)): add for fetch, add in jobs}
+
+        started.update(tasks)
+
+        return tasks
+
+    async def _add_fetched(self, tasks):
+        """
+            Add the results of the fetching tasks to the database in the order of completion.
+
+            Args:
+                tasks(dict): add methods by the tasks.
+
+            Raises:
+                FdataError: sql error happened or the data can't be fetched.
+        """
+        pending = set(tasks)
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                tasks[task](task.result())
+
+    ##################
+    # Refresh planning
+    ##################
+
+    def _get_refresh_columns(self):
+        """
+            Get the columns of the query which obtains the state of the data of multiple symbols for the refresh plan.
+
+            Each column is a subquery correlated by s.symbol_id of 'symbols' table. The query parameters :source_id,
+            :time_span_id, :first_ts and :last_ts may be used. Derived classes may add columns for additional data.
+
+            Returns:
+                list: the columns of the query.
+        """
+        # Ranges of requested quotes are merged, so the dates are covered only if they are within a single range
+        return ["""EXISTS (SELECT 1 FROM quote_ranges qr
+                        WHERE qr.symbol_id = s.symbol_id
+                        AND qr.source_id = :source_id
+                        AND qr.time_span_id = :time_span_id
+                        AND qr.first_ts <= :first_ts
+                        AND qr.last_ts >= :last_ts) AS covered"""]
+
+    def _get_stale_data(self, row):
+        """
+            Get the stale data of a symbol using the state obtained by the refresh plan query.
+            Derived classes may check additional data.
+
+            Args:
+                row(sqlite3.Row): the state of the symbol data.
+
+            Returns:
+                set: the tables which data is stale or None if the staleness can't be determined by the state.
+        """
+        stale = set()
+
+        if row['covered'] == 0 and self.first_date_ts <= min(self.last_date_ts, self.current_ts(adjusted=True)):
+            stale.add('quotes')
+
+        return stale
+
+    def get_refresh_plan(self, symbols):
+        """
+            Get the data which needs to be fetched for the symbols for the current dates, timespan and source.
+
+            The state of the data of all the symbols is obtained by a few set-based queries instead of checking
+            the freshness of each data of each symbol separately.
+
+            Args:
+                symbols(list): symbols to check.
+
+            Returns:
+                dict: the stale tables (set) by the symbols which data needs to be fetched. The value is None if
+                      the symbol is not in the database or the staleness can't be determined by the plan.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        params = {'source_id': self.get_source_id(),
+                  'time_span_id': self.get_timespan_id(),
+                  'first_ts': self.first_date_ts,
+                  'last_ts': min(self.last_date_ts, self.current_ts(adjusted=True))}
+
+        symbols = list(dict.fromkeys(symbols))
+        plan = dict.fromkeys(symbols)
+
+        # Keep the number of query parameters below the default SQLite limit
+        for i in range(0, len(symbols), 500):
+            chunk = symbols[i:i + 500]
+            params.update({f"symbol{j}": symbol for j, symbol in enumerate(chunk)})
+
+            get_state = f"""SELECT s.ticker,
+                                    {', '.join(self._get_refresh_columns())}
+                                FROM symbols s
+                                WHERE s.ticker IN ({', '.join([f":symbol{j}" for j in range(len(chunk))])});"""
+
+            try:
+                self.cur.execute(get_state, params)
+                rows = self.cur.fetchall()
+            except self.Error as e:
+                raise FdataError(f"Can't execute a query to check symbols: {e}\n{get_state}") from e
+
+            for row in rows:
+                stale = self._get_stale_data(row)
+
+                if stale is not None and len(stale) == 0:
+                    del plan[row['ticker']]
+                else:
+                    plan[row['ticker']] = stale
+
+        return plan
+
+    def get_stale_symbols(self, symbols):
+        """
+            Get the symbols which data needs to be fetched for the current dates, timespan and source.
+
+            Args:
+                symbols(list): symbols to check.
+
+            Returns:
+                list: the symbols which need to be fetched.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        return list(self.get_refresh_plan(symbols))
+
+    def add_refresh_tasks(self, plan, replace=True):
+        """
+            Store the refresh plan for the current source and timespan.
+
+            Args:
+                plan(dict): the refresh plan obtained by get_refresh_plan().
+                replace(bool): indicates if the previous plan should be replaced. Otherwise the tasks are added to it.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        if self.get_source_id() is None:
+            self.add_source()
+
+        ids = (self.get_source_id(), self.get_timespan_id())
+        rows = [(symbol, *ids, None if stale is None else ','.join(sorted(stale))) for symbol, stale in plan.items()]
+
+        remove_tasks = "DELETE FROM refresh_tasks WHERE source_id = ? AND time_span_id = ?;"
+        insert_tasks = "INSERT INTO refresh_tasks (ticker, source_id, time_span_id, stale) VALUES (?, ?, ?, ?);"
+
+        self.database.begin()
+
+        try:
+            if replace:
+                self.cur.execute(remove_tasks, ids)
+
+            self.cur.executemany(insert_tasks, rows)
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't execute a query on a table 'refresh_tasks': {e}\n{insert_tasks}") from e
+
+        self.database.release()
+
+    def get_refresh_tasks(self, status=RefreshStatus.Pending):
+        """
+            Get the stored refresh plan for the current source and timespan.
+
+            Args:
+                status(RefreshStatus): the status of the tasks to get.
+
+            Returns:
+                dict: the stale tables (set or None) by the symbols with the requested status.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        get_tasks = """SELECT ticker, stale FROM refresh_tasks
+                            WHERE source_id = ? AND time_span_id = ? AND status = ?
+                            ORDER BY refresh_task_id;"""
+
+        try:
+            self.cur.execute(get_tasks, (self.get_source_id(), self.get_timespan_id(), int(status)))
+            rows = self.cur.fetchall()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'refresh_tasks': {e}\n{get_tasks}") from e
+
+        return {row['ticker']: None if row['stale'] is None else set(row['stale'].split(',')) for row in rows}
+
+    def set_refresh_status(self, symbol, status):
+        """
+            Set the status of the planned refresh of a symbol for the current source and timespan.
+
+            Args:
+                symbol(str): the symbol to set the status.
+                status(RefreshStatus): the new status.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        update_status = """UPDATE refresh_tasks SET status = ?, modified = strftime('%s', 'now')
+                                WHERE ticker = ? AND source_id = ? AND time_span_id = ?;"""
+
+        self.database.begin()
+
+        try:
+            self.cur.execute(update_status, (int(status), symbol, self.get_source_id(), self.get_timespan_id()))
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't execute a query on a table 'refresh_tasks': {e}\n{update_status}") from e
+
+        self.database.release()
 
     def query_api(self, url, timeout=30):
         """
             Check if we need to wait before the next API query, wait if needed and query the API.
 
+            If the response cache is enabled, the cached response is returned if it is not expired. In the replay
+            mode all the responses are obtained from the cache only.
+
             Args:
                 url(string): URL to fetch
                 timeout(int): timeout for a response
 
             Returns:
                 Response: obtained data
+
+            Raises:
+                FdataError: network error happened or no cached response in the replay mode.
         """
-        # Check if we are about to reach the API key limit for queries
-        if len(self._queries) >= self.max_queries:
-            # Get the first query time from the array
-            first_query_time = self._queries[0]
+        ttl = 0
+
+        if settings.Http.response_cache_dir is not None:
+            ttl = self.get_response_ttl(url)
 
-            # Calculate time to sleep and sleep if needed
-            sleep_time = max(0, 60 - (perf_counter() - first_query_time))
+            if ttl != 0 or settings.Http.response_replay:
+                response = self._get_cached_response(url, ttl)
 
-            self.log(f"Sleeping for {round(sleep_time, 2)} seconds to avoid API key queries limit..")
+                if response is not None:
+                    return response
 
-            sleep(sleep_time)
+        if settings.Http.response_replay:
+            raise FdataError(f"No cached response for URL in the replay mode: {url}")
 
-            self._queries = []
+        # Wait if we are about to reach the API key limit for queries
+        if self.max_queries is not None:
+            sleep_time = get_rate_limiter(self.source_title, self.api_key, self.max_queries).acquire()
+
+            if sleep_time >= 1:
+                self.log(f"Waited for {round(sleep_time, 2)} seconds to avoid API key queries limit..")
 
         # Perform the query
         try:
             self.log(f"Fetching URL: {url}")
 
-            session = requests.Session()
-            headers = {'Cache-Control': 'no-cache'}  # Disable cache for the request
-            response = session.get(url, headers=headers, timeout=timeout)
-            session.close()
-        except (urllib.error.HTTPError, urllib.error.URLError, http.client.HTTPException, json.decoder.JSONDecodeError) as e:
+            response = get_http_session(self.source_title).get(url, timeout=timeout)
+        except (requests.exceptions.RequestException,
+                urllib.error.HTTPError,
+                urllib.error.URLError,
+                http.client.HTTPException,
+                json.decoder.JSONDecodeError) as e:
             raise FdataError(f"Can't fetch quotes: {e}") from e
-        finally:
-            self._queries.append(perf_counter())
+
+        if ttl != 0 and response.status_code == 200:
+            self._cache_response(url, response)
 
         return response
 
+    def get_response_ttl(self, url):
+        """
+            Get the time to live of the cached response for the URL. Data sources may override it to set TTLs
+            for particular endpoints.
+
+            Args:
+                url(str): the requested URL.
+
+            Returns:
+                int: TTL in seconds. 0 means that the response should not be cached, None - the response never expires.
+        """
+        return settings.Http.response_ttl
+
+    def _get_response_path(self, url):
+        """
+            Get the path of the cached response. API keys are excluded from the key of the cache.
+
+            Args:
+                url(str): the requested URL.
+
+            Returns:
+                str: the path of the cached response.
+        """
+        parts = urllib.parse.urlsplit(url)
+
+        query = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                 if key.lower() != 'apikey']
+
+        key_url = urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+        key = hashlib.sha256(key_url.encode()).hexdigest()
+
+        return os.path.join(settings.Http.response_cache_dir, key[:2], key)
+
+    def _get_cached_response(self, url, ttl):
+        """
+            Get the cached response.
+
+            Args:
+                url(str): the requested URL.
+                ttl(int): time to live of the response in seconds (None if it never expires).
+
+            Returns:
+                Response: the cached response or None if it does not exist or it is expired.
+        """
+        path = self._get_response_path(url)
+
+        try:
+            with open(path, 'rb') as response_file:
+                if settings.Http.response_replay is False and ttl is not None and \
+                   time() - os.fstat(response_file.fileno()).st_mtime > ttl:
+                    return None
+
+                meta = json.loads(response_file.readline())
+                content = response_file.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.log(f"Can't read the cached response for {url}: {e}")
+
+            return None
+
+        self.log(f"Using the cached response for URL: {url}")
+
+        response = requests.Response()
+        response.status_code = meta['status']
+        response.encoding = meta['encoding']
+        response.headers.update(meta['headers'])
+        response.url = url
+        response._content = content
+
+        return response
+
+    def _cache_response(self, url, response):
+        """
+            Write the response to the cache. The first line of the file contains the metadata of the response,
+            the rest is the content.
+
+            Args:
+                url(str): the requested URL.
+                response(Response): the response to cache.
+        """
+        path = self._get_response_path(url)
+
+        meta = {'status': response.status_code,
+                'encoding': response.encoding,
+                'headers': {'Content-Type': response.headers.get('Content-Type', '')}}
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+
+            try:
+                with os.fdopen(fd, 'wb') as response_file:
+                    response_file.write(json.dumps(meta).encode() + b'\n')
+                    response_file.write(response.content)
+
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except OSError as e:
+            self.log(f"Can't cache the response for {url}: {e}")
+
     def get_request_datetimes(self, first_ts, last_ts, trim_last=False):
         """
             Get the datetimes adjusted to the time zone of symbol's exchange for the request.
@@ -8,6 +8,112 @@ import sqlite3
 from sqlite3 import Error
 
 import abc
+import threading
+
+import settings
+
+from data.fvalues import DbProfiles
+
+# Process-wide pool of SQLite connections. SQLite connections can't be shared between threads, so each thread
+# has its own pool.
+_pool = threading.local()
+
+# Pragmas for SQLite performance profiles. Default profile keeps the defaults of SQLite.
+# Negative cache_size is in KiB, mmap_size is in bytes, busy_timeout is in milliseconds.
+sqlite_profiles = {
+    DbProfiles.Default: {},
+    DbProfiles.BulkLoad: {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000
+    },
+    DbProfiles.ReadHeavy: {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -131072,
+        'mmap_size': 1073741824,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000
+    }
+}
+
+# Pragmas which may be set by a performance profile. The order matters as journal mode should be set at first.
+sqlite_pragmas = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')
+
+def get_sqlite_pragmas():
+    """
+        Get the pragmas of the performance profile from settings with applied overrides.
+
+        Returns:
+            dict: pragmas to apply.
+
+        Raises:
+            FdatabaseError: unknown profile or pragma.
+    """
+    try:
+        pragmas = dict(sqlite_profiles[settings.Quotes.db_profile])
+    except KeyError as e:
+        raise FdatabaseError(f"Unknown database performance profile: {settings.Quotes.db_profile}") from e
+
+    pragmas.update(settings.Quotes.db_pragmas)
+
+    for pragma in pragmas:
+        if pragma not in sqlite_pragmas:
+            raise FdatabaseError(f"Unsupported pragma for the performance profile: {pragma}")
+
+    return pragmas
+
+class PooledConnection():
+    """
+        Pooled connection to the database which may be shared among data source instances in the same thread.
+
+        The instances which share the connection share its transaction as well. Write operations which may fail
+        in the middle use savepoints of the instance, so only the changes of the failed operation are rolled back.
+    """
+    def __init__(self, conn):
+        """
+            Initialize the pooled connection.
+
+            Args:
+                conn: the database connection.
+        """
+        self.conn = conn
+        self.refs = 0  # The number of data source instances which use the connection
+        self.validated = set()  # Schema fingerprints which are already validated for this connection
+        self.ids_version = 0  # Incremented when the cached ids of the instances which use the connection are stale
+        self.stale_npy = set()  # Ids of symbols which memory-mapped quotes histories are stale after the commit
+
+def get_pool():
+    """
+        Get the connections pool of the current thread.
+
+        Returns:
+            dict: pooled connections by the database name.
+    """
+    if hasattr(_pool, 'connections') is False:
+        _pool.connections = {}
+
+    return _pool.connections
+
+def close_all():
+    """
+        Close all the pooled connections of the current thread which are not used by any data source instance.
+
+        Returns:
+            int: the number of closed connections.
+    """
+    pool = get_pool()
+    closed = 0
+
+    for db_name in list(pool.keys()):
+        if pool[db_name].refs == 0:
+            pool.pop(db_name).conn.close()
+            closed += 1
+
+    return closed
 
 # Exception class for general database errors
 class FdatabaseError(Exception):
@@ -31,6 +137,67 @@ class DBConn(metaclass=abc.ABCMeta):
 
         self.source = source
 
+        self._pooled = None  # Pooled connection (if any)
+
+        self._stale_npy = set()  # Ids of symbols which memory-mapped quotes histories are stale after the commit
+
+        self._started = []  # Indicates if the transaction was started by the savepoint (for each nested savepoint)
+
+    def is_validated(self, fingerprint):
+        """
+            Check if the schema with the fingerprint is already validated for the current connection.
+
+            Args:
+                fingerprint(str): the schema fingerprint.
+
+            Returns:
+                bool: True if the schema is already validated, False otherwise.
+        """
+        return self._pooled is not None and fingerprint in self._pooled.validated
+
+    def set_validated(self, fingerprint):
+        """
+            Mark the schema with the fingerprint as validated for the current connection.
+
+            Args:
+                fingerprint(str): the schema fingerprint.
+        """
+        if self._pooled is not None:
+            self._pooled.validated.add(fingerprint)
+
+    def get_ids_version(self):
+        """
+            Get the version of the cached ids of the instances which use the connection.
+
+            Returns:
+                int: the version of the cached ids.
+        """
+        if self._pooled is None:
+            return 0
+
+        return self._pooled.ids_version
+
+    def invalidate_ids(self):
+        """
+            Invalidate the cached ids of all the instances which use the connection (for example, when a symbol
+            is removed).
+        """
+        if self._pooled is not None:
+            self._pooled.ids_version += 1
+
+    def get_stale_npy(self):
+        """
+            Get the ids of symbols which memory-mapped quotes histories become stale when the pending changes
+            of the connection are committed.
+
+            Returns:
+                set: the ids of symbols.
+        """
+        if self._pooled is None:
+            return self._stale_npy
+
+        return self._pooled.stale_npy
+
     # Abstract method to connect to db
     @abc.abstractmethod
     def db_connect(self):
@@ -46,32 +213,159 @@ class DBConn(metaclass=abc.ABCMeta):
         """
 
 class SQLiteConn(DBConn):
+    def is_poolable(self):
+        """
+            Check if the connection may be taken from the pool.
+
+            In-memory databases are never pooled as each connection to them represents a separate database.
+
+            Returns:
+                bool: True if the connection may be pooled, False otherwise.
+        """
+        db_name = str(self.source.db_name)
+
+        return settings.Quotes.db_pool and db_name != '' and ':memory:' not in db_name and 'mode=memory' not in db_name
+
     # Connect to the database
     def db_connect(self):
         """
-            Connect to SQLite database.
+            Connect to SQLite database. The already opened connection is borrowed from the pool if possible.
+
+            Raises:
+                FdatabaseError: Can't connect to a database.
+        """
+        self.source.Error = Error
+
+        if self.is_poolable():
+            pool = get_pool()
+            self._pooled = pool.get(self.source.db_name)
+
+            if self._pooled is None:
+                self._pooled = PooledConnection(self._connect())
+                pool[self.source.db_name] = self._pooled
+
+            self._pooled.refs += 1
+            self.source.conn = self._pooled.conn
+        else:
+            self.source.conn = self._connect()
+
+        self.source.cur = self.source.conn.cursor()
+
+    def _connect(self):
+        """
+            Open a new connection to SQLite database and set it up.
+
+            Returns:
+                sqlite3.Connection: the new connection.
 
             Raises:
                 FdatabaseError: Can't connect to a database.
         """
         try:
-            self.source.conn = sqlite3.connect(self.source.db_name)
+            conn = sqlite3.connect(self.source.db_name)
         except Error as e:
             raise FdatabaseError(f"An error has happened when trying to connect to a {self.source.db_name}: {e}") from e
 
         # Set the row factory
-        self.source.conn.row_factory = sqlite3.Row
-
-        self.source.cur = self.source.conn.cursor()
-        self.source.Error = Error
+        conn.row_factory = sqlite3.Row
 
         # Enable foreign keys
         try:
-            self.source.cur.execute("PRAGMA foreign_keys=on;")
-        except self.source.Error as e:
+            conn.execute("PRAGMA foreign_keys=on;")
+        except Error as e:
             raise FdatabaseError(f"Can't enable foreign keys: {e}") from e
 
+        # Apply the performance profile
+        pragmas = get_sqlite_pragmas()
+
+        for pragma in sqlite_pragmas:
+            if pragma in pragmas:
+                try:
+                    conn.execute(f"PRAGMA {pragma}={pragmas[pragma]};").fetchall()
+                except Error as e:
+                    raise FdatabaseError(f"Can't set {pragma}={pragmas[pragma]}: {e}") from e
+
+        return conn
+
+    def get_savepoint(self):
+        """
+            Get the name of the savepoint of the current instance.
+
+            Returns:
+                str: the name of the savepoint.
+        """
+        return f"fcore_{id(self)}"
+
+    def begin(self):
+        """
+            Start the savepoint of the current instance.
+
+            If there is no transaction, a new one is started and it is committed on the release. The write lock is
+            taken at once, so the queries within the savepoint do not deadlock with other connections. Otherwise
+            the changes are committed along with the pending changes of the other instances which share
+            the connection.
+
+            Raises:
+                FdatabaseError: sql error happened.
+        """
+        started = self.source.conn.in_transaction is False
+
+        try:
+            if started:
+                self.source.conn.execute("BEGIN IMMEDIATE;")
+
+            self.source.conn.execute(f"SAVEPOINT {self.get_savepoint()};")
+        except Error as e:
+            raise FdatabaseError(f"Can't start a savepoint: {e}") from e
+
+        self._started.append(started)
+
+    def release(self):
+        """
+            Release the savepoint of the current instance. The transaction is committed if it was started
+            by the savepoint.
+
+            Raises:
+                FdatabaseError: sql error happened.
+        """
+        try:
+            self.source.conn.execute(f"RELEASE {self.get_savepoint()};")
+
+            if self._started.pop():
+                self.source.conn.commit()
+        except Error as e:
+            raise FdatabaseError(f"Can't release a savepoint: {e}") from e
+
+    def rollback(self):
+        """
+            Roll back the changes made after the savepoint of the current instance and release it.
+            The pending changes of the other instances which share the connection are kept.
+
+            Raises:
+                FdatabaseError: sql error happened.
+        """
+        try:
+            self.source.conn.execute(f"ROLLBACK TO {self.get_savepoint()};")
+        except Error as e:
+            raise FdatabaseError(f"Can't roll back to a savepoint: {e}") from e
+
+        self.release()
+
     # Close the connection
     def db_close(self):
+        """
+            Close the connection to SQLite database. Pooled connection is returned to the pool.
+        """
         self.source.cur.close()
-        self.source.conn.close()
+
+        if self._pooled is None:
+            self.source.conn.close()
+            return
+
+        self._pooled.refs -= 1
+
+        # Discard uncommitted changes the same way as closing of a connection does (no other instances use it)
+        if self._pooled.refs == 0 and self.source.conn.in_transaction:
+            self.source.conn.rollback()
+
+        self._pooled = None
@@ -0,0 +1,446 @@
+"""Export and import of the quotes database to/from partitioned Parquet datasets.
+
+Each table which is related to symbols (quotes, dividends, splits, fundamentals, capitalization etc.) is written
+to a separate Parquet dataset partitioned by symbol (and timespan if the table has it). Ids of symbols, sources
+and other enumerations are replaced by their titles so the datasets may be imported to any database.
+
+The author is Zmicier Gotowka
+
+Distributed under Fcore License 1.1 (see license.md)
+"""
+import os
+
+# pyarrow is needed only for export and import, so other modules work without it
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    ds = None
+
+from data.fdata import FdataError
+
+# Number of rows in each row group during export and in each batch during import
+batch_rows = 100000
+
+# Tables which are not exported as they may be restored from other tables
+skipped_tables = ['adjusted_quotes_cache']
+
+# Columns which do not have foreign keys declared but store ids of enumerations
+implicit_references = {'reported_period': ('report_periods', 'period_id')}
+
+def _check_pyarrow():
+    """
+        Check if pyarrow is installed.
+
+        Raises:
+            FdataError: pyarrow is not installed.
+    """
+    if pa is None:
+        raise FdataError("pyarrow is required to export and import Parquet datasets. Install it using 'pip install pyarrow'.")
+
+def _get_title_column(table):
+    """
+        Get the column with a title of the referenced table.
+
+        Args:
+            table(str): the referenced table.
+
+        Returns:
+            str: the title column.
+    """
+    if table == 'symbols':
+        return 'ticker'
+
+    return 'title'
+
+def _get_export_column(column):
+    """
+        Get the name of the exported column which stores the title instead of the id.
+
+        Args:
+            column(str): the column with the id.
+
+        Returns:
+            str: the name of the exported column.
+    """
+    if column.endswith('_id'):
+        return column[:-3]
+
+    return column
+
+def _get_tables(source):
+    """
+        Get the tables which are related to symbols.
+
+        Args:
+            source(ReadOnlyData): the connected data source.
+
+        Returns:
+            list: table names.
+
+        Raises:
+            FdataError: sql error happened.
+    """
+    get_tables = """SELECT m.name FROM sqlite_master m
+                        WHERE m.type = 'table'
+                        AND EXISTS (SELECT 1 FROM pragma_table_info(m.name) p WHERE p.name = 'symbol_id')
+                        AND m.name <> 'symbols'
+                        ORDER BY m.name;"""
+
+    try:
+        source.cur.execute(get_tables)
+        rows = source.cur.fetchall()
+    except source.Error as e:
+        raise FdataError(f"Can't get the tables of the database: {e}\n{get_tables}") from e
+
+    return [row[0] for row in rows if row[0] not in skipped_tables]
+
+def _get_table_info(source, table):
+    """
+        Get the columns of the table and the tables referenced by them.
+
+        The primary key and the last modification time are skipped as they are generated by the database.
+
+        Args:
+            source(ReadOnlyData): the connected data source.
+            table(str): the table name.
+
+        Returns:
+            list: columns of the table.
+            dict: referenced (table, id column) by columns.
+
+        Raises:
+            FdataError: sql error happened.
+    """
+    get_columns = f"SELECT name, pk FROM pragma_table_info('{table}') ORDER BY cid;"
+    get_references = f"SELECT \"from\", \"table\", \"to\" FROM pragma_foreign_key_list('{table}');"
+
+    try:
+        source.cur.execute(get_columns)
+        columns = [row[0] for row in source.cur.fetchall() if row[1] == 0 and row[0] != 'modified']
+
+        source.cur.execute(get_references)
+        references = {row[0]: (row[1], row[2]) for row in source.cur.fetchall()}
+    except source.Error as e:
+        raise FdataError(f"Can't get the columns of the table '{table}': {e}") from e
+
+    for column, reference in implicit_references.items():
+        if column in columns:
+            references[column] = reference
+
+    return columns, references
+
+def _get_partitioning(columns):
+    """
+        Get the partitioning of the exported table.
+
+        Args:
+            columns(list): columns of the table.
+
+        Returns:
+            pyarrow.dataset.Partitioning: hive partitioning by symbol (and timespan if the table has it).
+    """
+    fields = [('symbol', pa.string())]
+
+    if 'time_span_id' in columns:
+        fields.append(('time_span', pa.string()))
+
+    return ds.partitioning(pa.schema(fields), flavor='hive')
+
+def _get_schema(source, table, columns, references):
+    """
+        Get the schema of the exported table.
+
+        SQLite has flexible typing and the declared type of the column may not correspond to the stored values.
+        That is why types are obtained from the stored values.
+
+        Args:
+            source(ReadOnlyData): the connected data source.
+            table(str): the table name.
+            columns(list): columns of the table.
+            references(dict): referenced tables by columns.
+
+        Returns:
+            pyarrow.Schema: the schema of the exported table.
+
+        Raises:
+            FdataError: sql error happened.
+    """
+    storage_classes = ", ".join([f"GROUP_CONCAT(DISTINCT typeof({column}))" for column in columns])
+    get_storage_classes = f"SELECT {storage_classes} FROM {table};"
+
+    try:
+        source.cur.execute(get_storage_classes)
+        row = source.cur.fetchone()
+    except source.Error as e:
+        raise FdataError(f"Can't get the types of the table '{table}': {e}\n{get_storage_classes}") from e
+
+    fields = []
+
+    for column, classes in zip(columns, row):
+        classes = (classes or '').split(',')
+
+        if column in references or 'text' in classes:
+            arrow_type = pa.string()
+        elif 'blob' in classes:
+            arrow_type = pa.binary()
+        elif 'real' in classes:
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.int64()
+
+        fields.append((_get_export_column(column), arrow_type))
+
+    return pa.schema(fields)
+
+def export_parquet(source, path, symbols=None, tables=None):
+    """
+        Export the tables related to symbols to partitioned Parquet datasets.
+
+        Each table is written to path/table_name/symbol=.../[time_span=.../]*.parquet. The existing partitions
+        of the exported symbols are replaced.
+
+        Args:
+            source(ReadOnlyData): the connected data source.
+            path(str): the directory to export to.
+            symbols(list): symbols to export. All symbols are exported if None.
+            tables(list): tables to export. All tables related to symbols are exported if None.
+
+        Returns:
+            dict: the number of exported rows by tables.
+
+        Raises:
+            FdataError: sql or file system error happened or pyarrow is not installed.
+    """
+    _check_pyarrow()
+
+    source.check_if_connected()
+
+    if tables is None:
+        tables = _get_tables(source)
+
+    result = {}
+
+    for table in tables:
+        columns, references = _get_table_info(source, table)
+
+        schema = _get_schema(source, table, columns, references)
+
+        # Ids are replaced by titles of the referenced tables
+        select_columns = []
+
+        for column in columns:
+            if column in references:
+                ref_table, ref_column = references[column]
+
+                select_columns.append(f"""(SELECT {_get_title_column(ref_table)} FROM {ref_table}
+                                              WHERE {ref_table}.{ref_column} = t.{column}) AS {_get_export_column(column)}""")
+            else:
+                select_columns.append(f"t.{column}")
+
+        params = []
+        symbols_query = ""
+
+        if symbols is not None:
+            symbols_query = f"AND ticker IN ({', '.join(['?'] * len(symbols))})"
+            params = list(symbols)
+
+        get_symbol_ids = f"""SELECT symbol_id FROM symbols
+                                WHERE symbol_id IN (SELECT DISTINCT symbol_id FROM {table})
+                                {symbols_query};"""
+
+        select_table = f"""SELECT {', '.join(select_columns)}
+                            FROM {table} t
+                            WHERE t.symbol_id = ?;"""
+
+        result[table] = 0
+
+        # Each symbol is written separately to keep the memory usage low. Only the partitions of the exported
+        # symbol are replaced.
+        try:
+            source.cur.execute(get_symbol_ids, params)
+            symbol_ids = [row[0] for row in source.cur.fetchall()]
+        except source.Error as e:
+            raise FdataError(f"Can't execute a query on a table '{table}': {e}\n{get_symbol_ids}") from e
+
+        for symbol_id in symbol_ids:
+            source.cur.row_factory = None
+
+            try:
+                source.cur.execute(select_table, (symbol_id, ))
+                rows = source.cur.fetchall()
+            except source.Error as e:
+                raise FdataError(f"Can't execute a query on a table '{table}': {e}\n{select_table}") from e
+            finally:
+                source.cur.row_factory = source.conn.row_factory
+
+            data = pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                                        schema=schema)
+
+            try:
+                ds.write_dataset(data,
+                                 os.path.join(path, table),
+                                 format='parquet',
+                                 partitioning=_get_partitioning(columns),
+                                 existing_data_behavior='delete_matching',
+                                 max_rows_per_group=batch_rows)
+            except (OSError, pa.ArrowException) as e:
+                raise FdataError(f"Can't export the table '{table}' to {path}: {e}") from e
+
+            result[table] += len(rows)
+
+        source.log(f"Exported {result[table]} rows of the table '{table}'.")
+
+    return result
+
+def import_parquet(source, path, symbols=None, tables=None, first_ts=None, last_ts=None):
+    """
+        Import the tables related to symbols from partitioned Parquet datasets.
+
+        Only the partitions of the requested symbols are read and the time stamp filter is pushed down to
+        the Parquet row groups. Missing symbols and sources are added to the database. Existing rows are replaced
+        or ignored depending on the update flag of the source.
+
+        Args:
+            source(ReadWriteData): the connected data source. It should be an instance of the class which creates
+                                   the imported tables (like FmpStock for the FMP fundamental data).
+            path(str): the directory to import from.
+            symbols(list): symbols to import. All symbols are imported if None.
+            tables(list): tables to import. All tables which present in both the export and the database are
+                          imported if None.
+            first_ts(int): the first time stamp of the imported rows (for the tables with time stamps).
+            last_ts(int): the last time stamp of the imported rows (for the tables with time stamps).
+
+        Returns:
+            dict: the number of imported rows by tables.
+
+        Raises:
+            FdataError: sql or file system error happened, unknown titles are met or pyarrow is not installed.
+    """
+    _check_pyarrow()
+
+    source.check_if_connected()
+
+    db_tables = _get_tables(source)
+
+    if tables is None:
+        try:
+            tables = [table for table in db_tables if os.path.isdir(os.path.join(path, table))]
+        except OSError as e:
+            raise FdataError(f"Can't read the directory {path}: {e}") from e
+
+    # Ids by titles for each referenced table
+    titles = {}
+
+    def get_id(ref_table, ref_column, title):
+        """
+            Get the id of the title in the referenced table. Missing symbols and sources are added.
+        """
+        if title is None:
+            return None
+
+        if ref_table not in titles:
+            get_titles = f"SELECT {_get_title_column(ref_table)}, {ref_column} FROM {ref_table};"
+
+            try:
+                source.cur.execute(get_titles)
+                titles[ref_table] = {row[0]: row[1] for row in source.cur.fetchall()}
+            except source.Error as e:
+                raise FdataError(f"Can't execute a query on a table '{ref_table}': {e}\n{get_titles}") from e
+
+        if title not in titles[ref_table]:
+            if ref_table not in ('symbols', 'sources'):
+                raise FdataError(f"Unknown value '{title}' of the table '{ref_table}'. Make sure that the source creates this table.")
+
+            add_title = f"INSERT INTO {ref_table} ({_get_title_column(ref_table)}) VALUES (?);"
+
+            try:
+                source.cur.execute(add_title, (title, ))
+                titles[ref_table][title] = source.cur.lastrowid
+            except source.Error as e:
+                raise FdataError(f"Can't add a record to a table '{ref_table}': {e}\n{add_title}") from e
+
+        return titles[ref_table][title]
+
+    result = {}
+    symbol_ids = set()
+
+    for table in tables:
+        if table not in db_tables:
+            raise FdataError(f"The table '{table}' is not in the database. Make sure that the source creates this table.")
+
+        columns, references = _get_table_info(source, table)
+
+        try:
+            dataset = ds.dataset(os.path.join(path, table), format='parquet', partitioning=_get_partitioning(columns))
+        except (OSError, pa.ArrowException) as e:
+            raise FdataError(f"Can't read the dataset of the table '{table}' from {path}: {e}") from e
+
+        # Only the columns which present in both the export and the database are imported
+        columns = [column for column in columns if _get_export_column(column) in dataset.schema.names]
+
+        # Filters are pushed down to partitions and row groups
+        condition = None
+
+        if symbols is not None:
+            condition = ds.field('symbol').isin(symbols)
+
+        if 'time_stamp' in columns:
+            if first_ts is not None:
+                condition = (ds.field('time_stamp') >= first_ts) if condition is None else condition & (ds.field('time_stamp') >= first_ts)
+
+            if last_ts is not None:
+                condition = (ds.field('time_stamp') <= last_ts) if condition is None else condition & (ds.field('time_stamp') <= last_ts)
+
+        insert_rows = f"""INSERT OR {source._update} INTO {table} ({', '.join(columns)})
+                            VALUES ({', '.join(['?'] * len(columns))});"""
+
+        result[table] = 0
+
+        # Only the changes of the failed table are rolled back as the connection may be shared
+        source.database.begin()
+
+        try:
+            for batch in dataset.to_batches(columns=[_get_export_column(column) for column in columns],
+                                            filter=condition,
+                                            batch_size=batch_rows):
+                values = []
+
+                for column in columns:
+                    column_values = batch.column(_get_export_column(column)).to_pylist()
+
+                    if column in references:
+                        ref_table, ref_column = references[column]
+                        column_values = [get_id(ref_table, ref_column, title) for title in column_values]
+
+                    values.append(column_values)
+
+                if 'symbol_id' in columns:
+                    symbol_ids.update(values[columns.index('symbol_id')])
+
+                source.cur.executemany(insert_rows, zip(*values))
+
+                result[table] += batch.num_rows
+        except source.Error as e:
+            source.database.rollback()
+            raise FdataError(f"Can't import the table '{table}': {e}\n\nThe query is\n{insert_rows}") from e
+        except (OSError, pa.ArrowException) as e:
+            source.database.rollback()
+            raise FdataError(f"Can't read the dataset of the table '{table}' from {path}: {e}") from e
+        except FdataError:
+            source.database.rollback()
+            raise
+
+        source.database.release()
+
+        source.log(f"Imported {result[table]} rows of the table '{table}'.")
+
+    # Cached data of the imported symbols is not valid anymore (including the ids cached by other instances)
+    source.reset_ids()
+    source.database.invalidate_ids()
+
+    for symbol_id in symbol_ids:
+        source._invalidate_npy_quotes(symbol_id)
+
+    return result
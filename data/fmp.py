@@ -5,24 +5,23 @@ The author is Zmicier Gotowka
 Distributed under Fcore License 1.1 (see license.md)
 """
 from data import stock
-from data.fvalues import SecType, Timespans, def_first_date
+from data.fvalues import SecType, Timespans, ReportPeriod, def_first_date
 from data.fdata import FdataError
 
-from data.futils import get_dt, get_labelled_ndarray
+from data.futils import get_dt, get_dt_array, get_ts_array, get_labelled_ndarray, get_split_factors, get_sql_value
 
 import settings
 
 import numpy as np
 import pandas as pd
-import math
 
 from datetime import datetime, timedelta, timezone
 from dateutil import tz
 import calendar
 
 import json
-
-import pandas as pd
+import functools
+import urllib.parse
 
 # Time zones of some popular exchanges for FMP data source
 Exchanges = {
@@ -46,6 +45,37 @@ Exchanges = {
     'XETRA':    'Europe/Frankfurt'
 }
 
+# Columns of income statement reports (except ids and the reported period)
+income_statement_columns = ('time_stamp', 'fiscalDate', 'revenue', 'costOfRevenue', 'grossProfit', 'grossProfitRatio',
+                            'researchAndDevelopmentExpenses', 'generalAndAdministrativeExpenses', 'sellingAndMarketingExpenses',
+                            'sellingGeneralAndAdministrativeExpenses', 'otherExpenses', 'operatingExpenses', 'costAndExpenses',
+                            'interestIncome', 'interestExpense', 'depreciationAndAmortization', 'ebitda', 'ebitdaratio', 'operatingIncome',
+                            'operatingIncomeRatio', 'totalOtherIncomeExpensesNet', 'incomeBeforeTax', 'incomeBeforeTaxRatio',
+                            'incomeTaxExpense', 'netIncome', 'netIncomeRatio', 'eps', 'epsdiluted', 'weightedAverageShsOut',
+                            'weightedAverageShsOutDil')
+
+# Columns of balance sheet reports (except ids and the reported period)
+balance_sheet_columns = ('time_stamp', 'fiscalDate', 'cashAndCashEquivalents', 'shortTermInvestments', 'cashAndShortTermInvestments',
+                         'netReceivables', 'inventory', 'otherCurrentAssets', 'totalCurrentAssets', 'propertyPlantEquipmentNet', 'goodwill',
+                         'intangibleAssets', 'goodwillAndIntangibleAssets', 'longTermInvestments', 'taxAssets', 'otherNonCurrentAssets',
+                         'totalNonCurrentAssets', 'otherAssets', 'totalAssets', 'accountPayables', 'shortTermDebt', 'taxPayables',
+                         'deferredRevenue', 'otherCurrentLiabilities', 'totalCurrentLiabilities', 'longTermDebt',
+                         'deferredRevenueNonCurrent', 'deferredTaxLiabilitiesNonCurrent', 'otherNonCurrentLiabilities',
+                         'totalNonCurrentLiabilities', 'otherLiabilities', 'capitalLeaseObligations', 'totalLiabilities', 'preferredStock',
+                         'commonStock', 'retainedEarnings', 'accumulatedOtherComprehensiveIncomeLoss', 'othertotalStockholdersEquity',
+                         'totalStockholdersEquity', 'totalEquity', 'totalLiabilitiesAndStockholdersEquity', 'minorityInterest',
+                         'totalLiabilitiesAndTotalEquity', 'totalInvestments', 'totalDebt', 'netDebt')
+
+# Columns of cash flow statement reports (except ids and the reported period)
+cash_flow_columns = ('time_stamp', 'fiscalDate', 'netIncome', 'depreciationAndAmortization', 'deferredIncomeTax',
+                     'stockBasedCompensation', 'changeInWorkingCapital', 'accountsReceivables', 'inventory', 'accountsPayables',
+                     'otherWorkingCapital', 'otherNonCashItems', 'netCashProvidedByOperatingActivities',
+                     'investmentsInPropertyPlantAndEquipment', 'acquisitionsNet', 'purchasesOfInvestments',
+                     'salesMaturitiesOfInvestments', 'otherInvestingActivites', 'netCashUsedForInvestingActivites', 'debtRepayment',
+                     'commonStockIssued', 'commonStockRepurchased', 'dividendsPaid', 'otherFinancingActivites',
+                     'netCashUsedProvidedByFinancingActivities', 'effectOfForexChangesOnCash', 'netChangeInCash', 'cashAtEndOfPeriod',
+                     'cashAtBeginningOfPeriod', 'operatingCashFlow', 'capitalExpenditure', 'freeCashFlow')
+
 class FmpStock(stock.StockFetcher):
     """
         FMP API wrapper class.
@@ -57,6 +87,7 @@ class FmpStock(stock.StockFetcher):
         # Default values
         self.source_title = "FMP"
         self.api_key = settings.FMP.api_key
+        self.base_url = settings.FMP.base_url
 
         if settings.FMP.plan == settings.FMP.Plan.Basic:
             self.max_queries = 250
@@ -507,7 +538,7 @@ class FmpStock(stock.StockFetcher):
         cap_data = []
 
         while True:
-            cap_url = f"https://financialmodelingprep.com/api/v3/historical-market-capitalization/{self.symbol}?limit={num}&from={first_date}&to={last_date}&apikey={self.api_key}"
+            cap_url = f"{self.base_url}/api/v3/historical-market-capitalization/{self.symbol}?limit={num}&from={first_date}&to={last_date}&apikey={self.api_key}"
 
             # Get capitalization data
             results = self.query_and_parse(cap_url)
@@ -555,30 +586,34 @@ class FmpStock(stock.StockFetcher):
 
         num_before = self.get_cap_num()
 
-        for result in results:
-            # Need to convert date to a time stamp
-            try:
-                dt = get_dt(result['date'], self.get_timezone()).replace(hour=23, minute=59, second=59)
-                result['date'] = calendar.timegm(dt.utctimetuple())
-            except TypeError as e:
-                raise FdataError(f"Unexpected data. API key limit is possible. {e}")
-
-            insert_cap = f"""INSERT OR {self._update} INTO fmp_capitalization (symbol_id,
-                                        source_id,
-                                        time_stamp,
-                                        cap)
-                                    VALUES (
-                                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
-                                            {result['date']},
-                                            {result['marketCap']});"""
+        # Need to convert dates to time stamps
+        try:
+            dt = get_dt_array([result['date'] for result in results], self.get_timezone())
+            cap = [get_sql_value(result['marketCap']) for result in results]
+        except (TypeError, KeyError, ValueError) as e:
+            raise FdataError(f"Unexpected data. API key limit is possible. {e}")
 
-            try:
-                self.cur.execute(insert_cap)
-            except self.Error as e:
-                raise FdataError(f"Can't add a record to a table 'fmp_capitalization': {e}\n\nThe query is\n{insert_cap}") from e
+        # Keep all timestamps at 23:59:59
+        ts = (dt.astype('datetime64[D]') + np.timedelta64(86399, 's')).astype(np.int64).tolist()
 
-        self.commit()
+        symbol_id = self.get_symbol_id()
+        source_id = self.get_source_id()
+
+        insert_cap = f"""INSERT OR {self._update} INTO fmp_capitalization (symbol_id,
+                                    source_id,
+                                    time_stamp,
+                                    cap)
+                                VALUES (?, ?, ?, ?);"""
+
+        self.database.begin()
+
+        try:
+            self.cur.executemany(insert_cap, [(symbol_id, source_id, *row) for row in zip(ts, cap)])
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't add records to a table 'fmp_capitalization': {e}\n\nThe query is\n{insert_cap}") from e
+
+        self.database.release()
 
         return(num_before, self.get_cap_num())
 
@@ -598,18 +633,10 @@ class FmpStock(stock.StockFetcher):
 
         num = self.get_cap_num()
 
-        mod_ts = self.get_last_modified('fmp_capitalization')
-
-        current = min(datetime.now().replace(tzinfo=None), self.last_date.replace(tzinfo=None))
-
-        # Fetch data if no data present or day difference between current/requested data more than 1 day
-        if mod_ts is None:
-            self.add_cap(self.fetch_cap())
-        else:
-            days_delta = (current - get_dt(mod_ts)).days
+        fetch_method = self._get_cap_fetcher(self.get_last_modified('fmp_capitalization'))
 
-            if self.last_date_ts > mod_ts and days_delta:
-                self.add_cap(self.fetch_cap(days_delta + 1))
+        if fetch_method is not None:
+            self.add_cap(fetch_method())
 
         new_num = self.get_cap_num()
 
@@ -618,6 +645,29 @@ class FmpStock(stock.StockFetcher):
 
         return (new_num - num)
 
+    def _get_cap_fetcher(self, mod_ts):
+        """
+            Get the method to fetch the missing capitalization data.
+
+            Args:
+                mod_ts(int): the last modification timestamp of the capitalization data.
+
+            Returns:
+                callable: the method to fetch the data (None if no need to fetch).
+        """
+        current = min(datetime.now().replace(tzinfo=None), self.last_date.replace(tzinfo=None))
+
+        # Fetch data if no data present or day difference between current/requested data more than 1 day
+        if mod_ts is None:
+            return self.fetch_cap
+
+        days_delta = (current - get_dt(mod_ts)).days
+
+        if self.last_date_ts > mod_ts and days_delta:
+            return functools.partial(self.fetch_cap, days_delta + 1)
+
+        return None
+
     ######################################################
     # Methods related to earnings surprise data processing
     ######################################################
@@ -644,9 +694,9 @@ class FmpStock(stock.StockFetcher):
                 list: surprises data.
         """
         if num is not None:
-            surprises_url = f"https://financialmodelingprep.com/api/v3/earnings-surprises/{self.symbol}?limit={num}&apikey={self.api_key}"
+            surprises_url = f"{self.base_url}/api/v3/earnings-surprises/{self.symbol}?limit={num}&apikey={self.api_key}"
         else:
-            surprises_url = f"https://financialmodelingprep.com/api/v3/earnings-surprises/{self.symbol}?apikey={self.api_key}"
+            surprises_url = f"{self.base_url}/api/v3/earnings-surprises/{self.symbol}?apikey={self.api_key}"
 
         # Get the surprises data
         results = self.query_and_parse(surprises_url, timeout=120)
@@ -674,38 +724,32 @@ class FmpStock(stock.StockFetcher):
 
         num_before = self.get_surprises_num()
 
-        for result in results:
-            # Need to convert date to a time stamp
-            try:
-                dt = get_dt(result['date'], self.get_timezone())
-                result['date'] = calendar.timegm(dt.utctimetuple())
-
-                if result['actualEarningResult'] == None:
-                    result['actualEarningResult'] = 'NULL'
-
-                if result['estimatedEarning'] is None:
-                    result['estimatedEarning'] = 'NULL'
-            except TypeError as e:
-                raise FdataError(f"Unexpected data. API key limit is possible. {e}")
-
-            insert_surprises = f"""INSERT OR {self._update} INTO fmp_surprises (symbol_id,
-                                        source_id,
-                                        time_stamp,
-                                        actualEarning,
-                                        estimatedEarning)
-                                    VALUES (
-                                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
-                                            {result['date']},
-                                            {result['actualEarningResult']},
-                                            {result['estimatedEarning']});"""
+        # Need to convert dates to time stamps
+        try:
+            ts = get_ts_array([result['date'] for result in results], self.get_timezone()).tolist()
+            earnings = [(get_sql_value(result['actualEarningResult']), get_sql_value(result['estimatedEarning'])) for result in results]
+        except (TypeError, KeyError, ValueError) as e:
+            raise FdataError(f"Unexpected data. API key limit is possible. {e}")
 
-            try:
-                self.cur.execute(insert_surprises)
-            except self.Error as e:
-                raise FdataError(f"Can't add a record to a table 'fmp_surprises': {e}\n\nThe query is\n{insert_surprises}") from e
+        symbol_id = self.get_symbol_id()
+        source_id = self.get_source_id()
+
+        insert_surprises = f"""INSERT OR {self._update} INTO fmp_surprises (symbol_id,
+                                    source_id,
+                                    time_stamp,
+                                    actualEarning,
+                                    estimatedEarning)
+                                VALUES (?, ?, ?, ?, ?);"""
+
+        self.database.begin()
+
+        try:
+            self.cur.executemany(insert_surprises, [(symbol_id, source_id, ts[i], *earnings[i]) for i in range(len(ts))])
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't add records to a table 'fmp_surprises': {e}\n\nThe query is\n{insert_surprises}") from e
 
-        self.commit()
+        self.database.release()
 
         return(num_before, self.get_surprises_num())
 
@@ -727,24 +771,8 @@ class FmpStock(stock.StockFetcher):
 
         num = self.get_surprises_num()
 
-        mod_ts = self.get_last_modified('fmp_surprises')
-
-        current = min(datetime.now(timezone.utc).replace(tzinfo=None), self.last_date.replace(tzinfo=None))
-
-        # TODO LOW Ideally here implementation based on earnings calendar is needed
-        # Fetch data if no data present or day difference between current/requested data more than 90 days
-        if mod_ts is None:
+        if self._need_surprises(self.get_last_modified('fmp_surprises'), self.get_last_timestamp('fmp_surprises')):
             self.add_surprises(self.fetch_surprises())
-        else:
-            last_ts = self.get_last_timestamp('fmp_surprises')
-
-            days_delta = (current - get_dt(last_ts)).days
-            days_delta_mod = (current - get_dt(mod_ts)).days
-
-            # TODO LOW It should be done in a better way than just checking for 90 days difference.
-            if self.last_date_ts > mod_ts and days_delta >= 90 and days_delta_mod:
-                #self.add_surprises(self.fetch_surprises(round(days_delta / 90 + 1)))
-                self.add_surprises(self.fetch_surprises())
 
         new_num = self.get_surprises_num()
 
@@ -753,6 +781,30 @@ class FmpStock(stock.StockFetcher):
 
         return (new_num - num)
 
+    def _need_surprises(self, mod_ts, last_ts):
+        """
+            Check if the surprises data needs to be fetched.
+
+            Args:
+                mod_ts(int): the last modification timestamp of the surprises data.
+                last_ts(int): the timestamp of the last modified surprises entry.
+
+            Returns:
+                bool: indicates if the data should be fetched.
+        """
+        current = min(datetime.now(timezone.utc).replace(tzinfo=None), self.last_date.replace(tzinfo=None))
+
+        # TODO LOW Ideally here implementation based on earnings calendar is needed
+        # Fetch data if no data present or day difference between current/requested data more than 90 days
+        if mod_ts is None:
+            return True
+
+        days_delta = (current - get_dt(last_ts)).days
+        days_delta_mod = (current - get_dt(mod_ts)).days
+
+        # TODO LOW It should be done in a better way than just checking for 90 days difference.
+        return self.last_date_ts > mod_ts and days_delta >= 90 and days_delta_mod != 0
+
     #########################
     # Methods to fetch quotes
     #########################
@@ -791,6 +843,33 @@ class FmpStock(stock.StockFetcher):
 
         return results
 
+    def get_response_ttl(self, url):
+        """
+            Get the time to live of the cached response for the URL. Real time quotes are not cached and historical
+            ranges which ended in the past never expire.
+
+            Note that FMP historical prices are split-adjusted, so the cached ranges should be dropped if a new split
+            happens.
+
+            Args:
+                url(str): the requested URL.
+
+            Returns:
+                int: TTL in seconds. 0 means that the response should not be cached, None - the response never expires.
+        """
+        parts = urllib.parse.urlsplit(url)
+
+        if '/quote-order/' in parts.path:
+            return 0
+
+        last_date = urllib.parse.parse_qs(parts.query).get('to')
+
+        if '/historical-' in parts.path and last_date is not None:
+            if (datetime.now(timezone.utc).date() - get_dt(last_date[0]).date()).days > 1:
+                return None
+
+        return super().get_response_ttl(url)
+
     def get_timespan_str(self):
         """
             Get timespan string (like '5min' and so on) to query a particular data source based on the timespan specified
@@ -831,6 +910,34 @@ class FmpStock(stock.StockFetcher):
             Raises:
                 FdataError: incorrect API key(limit reached), http error happened, invalid timespan or no data obtained.
         """
+        self.get_splits()  # Split data is necessary for reverse-adjustment. Can't proceed without split data (it any).
+
+        return self._fetch_quotes(first_ts=first_ts, last_ts=last_ts, splits=self.get_db_splits())
+
+    def _get_quotes_fetcher(self):
+        """
+            Get the callable to fetch quotes in a worker thread with the split data obtained in advance.
+
+            Returns:
+                callable: the method to fetch quotes which accepts first_ts and last_ts.
+        """
+        return functools.partial(self._fetch_quotes, splits=self.get_db_splits())
+
+    def _fetch_quotes(self, first_ts=None, last_ts=None, splits=None):
+        """
+            Fetch quotes and reverse-adjust them using the provided split data. The database is not accessed here.
+
+            Args:
+                first_ts(int): overridden first ts to fetch.
+                last_ts(int): overridden last ts to fetch.
+                splits(ndarray): split data of the symbol.
+
+            Returns:
+                list: quotes data
+
+            Raises:
+                FdataError: incorrect API key(limit reached), http error happened, invalid timespan or no data obtained.
+        """
         # Adjust dates for the exchange time zone for the request
         first_datetime, last_datetime = self.get_request_datetimes(first_ts, last_ts)
 
@@ -839,9 +946,6 @@ class FmpStock(stock.StockFetcher):
         # Parsed quotes data. Lets keep it in the same object because it is very unlikely that it won't fit in the memory.
         quotes_data = []
 
-        self.get_splits()  # Split data is necessary for reverse-adjustment. Can't proceed without split data (it any).
-        splits = self.get_db_splits()
-
         first_date = first_datetime.date()
         last_date = last_datetime.date()
         earliest_date = None  # The earliest date in the obtained data
@@ -849,9 +953,9 @@ class FmpStock(stock.StockFetcher):
         while True:
             if self.is_intraday():
                 request_first_date = get_dt(def_first_date).date()  # Use the earliest possible date in intraday request
-                url = f"https://financialmodelingprep.com/api/v3/historical-chart/{self.get_timespan_str()}/{self.symbol}?from={request_first_date}&to={last_date}&apikey={self.api_key}"
+                url = f"{self.base_url}/api/v3/historical-chart/{self.get_timespan_str()}/{self.symbol}?from={request_first_date}&to={last_date}&apikey={self.api_key}"
             else:
-                url = f"https://financialmodelingprep.com/api/v3/historical-price-full/{self.symbol}?from={first_date}&to={last_date}&apikey={self.api_key}"
+                url = f"{self.base_url}/api/v3/historical-price-full/{self.symbol}?from={first_date}&to={last_date}&apikey={self.api_key}"
 
             historical = not self.is_intraday()
             json_results = self.query_and_parse(url, historical=historical)
@@ -888,50 +992,54 @@ class FmpStock(stock.StockFetcher):
                 # Need to substract one day from the last date
                 last_date = earliest_date - timedelta(days=1)
 
-        # Process the fetched data
+        # Process the fetched data column-wise
 
-        quotes = []  # Processed quotes
+        if len(quotes_data) == 0:
+            return []
 
-        for quote in quotes_data:
-            dt = get_dt(quote['date'], self.get_timezone())
+        data = pd.DataFrame(quotes_data)
 
-            # No need to add quotes to DB which are outside of the requested interval
-            if dt.date() < first_date:
-                break
+        # Quotes are in the exchange time zone
+        dt = get_dt_array(data['date'], self.get_timezone())
 
-            if self.is_intraday():
-                volume = quote['volume']
-            else:
-                # Keep all non-intraday timestamps at 23:59:59
-                dt = dt.replace(hour=23, minute=59, second=59)
+        # No need to add quotes to DB which are outside of the requested interval (quotes are in descending order)
+        outside = dt < np.datetime64(first_date)
 
-                volume = quote['unadjustedVolume']
+        if outside.any():
+            length = int(np.argmax(outside))
 
-            # Get the combined split ratio over the available history
-            ratio = 1
+            data = data.iloc[:length]
+            dt = dt[:length]
 
-            ts = calendar.timegm(dt.utctimetuple())
+        if self.is_intraday():
+            volume = data['volume'].to_numpy(dtype=float)
+        else:
+            # Keep all non-intraday timestamps at 23:59:59
+            dt = dt.astype('datetime64[D]') + np.timedelta64(86399, 's')
 
-            if splits is not None:
-                idx = np.where(ts <= splits['split_date'])
-                ratio = math.prod(splits['split_ratio'][idx])
+            volume = data['unadjustedVolume'].to_numpy(dtype=float)
 
-            if ratio == 0:
-                ratio = 1
+        ts = dt.astype(np.int64)
 
-            quote_dict = {
-                'ts': ts,
-                'open': quote['open'] * ratio,
-                'high': quote['high'] * ratio,
-                'low': quote['low'] * ratio,
-                'close': quote['close'] * ratio,
-                'volume': volume / ratio,
-                'transactions': 'NULL',
-            }
+        # Get the combined split ratio over the available history
+        ratio = np.ones(len(ts))
+
+        if splits is not None:
+            ratio = get_split_factors(ts, splits['split_date'], splits['split_ratio'])
+
+        ratio[ratio == 0] = 1
 
-            quotes.append(quote_dict)
+        quotes = pd.DataFrame({
+            'ts': ts,
+            'open': data['open'].to_numpy(dtype=float) * ratio,
+            'high': data['high'].to_numpy(dtype=float) * ratio,
+            'low': data['low'].to_numpy(dtype=float) * ratio,
+            'close': data['close'].to_numpy(dtype=float) * ratio,
+            'volume': volume / ratio,
+            'transactions': 'NULL'
+        })
 
-        return quotes
+        return quotes.to_dict('records')
 
     #######################################
     # Methods to fetch dividends and splits
@@ -940,7 +1048,7 @@ class FmpStock(stock.StockFetcher):
         """
             Fetch the cash dividend data.
         """
-        url_divs = f"https://financialmodelingprep.com/api/v3/historical-price-full/stock_dividend/{self.symbol}?apikey={self.api_key}"
+        url_divs = f"{self.base_url}/api/v3/historical-price-full/stock_dividend/{self.symbol}?apikey={self.api_key}"
 
         json_results = None
         json_results = self.query_and_parse(url_divs, historical=True)
@@ -995,7 +1103,7 @@ class FmpStock(stock.StockFetcher):
         """
             Fetch the split data.
         """
-        url_splits = f"https://financialmodelingprep.com/api/v3/historical-price-full/stock_split/{self.symbol}?apikey={self.api_key}"
+        url_splits = f"{self.base_url}/api/v3/historical-price-full/stock_split/{self.symbol}?apikey={self.api_key}"
 
         json_results = None
         json_results = self.query_and_parse(url_splits, historical=True)
@@ -1030,7 +1138,7 @@ class FmpStock(stock.StockFetcher):
             Returns
                 dict: stock info.
         """
-        profile_url = f"https://financialmodelingprep.com/api/v3/profile/{self.symbol}?apikey={self.api_key}"
+        profile_url = f"{self.base_url}/api/v3/profile/{self.symbol}?apikey={self.api_key}"
 
         # Get company profile
         json_data = self.query_and_parse(profile_url)
@@ -1053,7 +1161,7 @@ class FmpStock(stock.StockFetcher):
             The usage of this method should be limited even for screening as data request from DB (and this request is
             not DB related) may involve additional data.
         """
-        quote_url = f"https://financialmodelingprep.com/api/v3/quote-order/{self.symbol}?apikey={self.api_key}"
+        quote_url = f"{self.base_url}/api/v3/quote-order/{self.symbol}?apikey={self.api_key}"
 
         # Get company profile
         json_data = self.query_and_parse(quote_url)
@@ -1101,9 +1209,9 @@ class FmpStock(stock.StockFetcher):
                 FdataError: incorrect API key(limit reached), http error happened or no data obtained.
 
             Returns:
-                list: fundamental data
+                DataFrame: fundamental data
         """
-        url = f'https://financialmodelingprep.com/api/v3/{report}/{self.symbol}?period={reported_period}&limit=10000&apikey={self.api_key}'
+        url = f'{self.base_url}/api/v3/{report}/{self.symbol}?period={reported_period}&limit=10000&apikey={self.api_key}'
 
         # Get fundamental data
         json_data = self.query_and_parse(url)
@@ -1116,16 +1224,10 @@ class FmpStock(stock.StockFetcher):
         reports['reported_period'] = reported_period
 
         # Replace string datetime to timestamp
-        reports['time_stamp'] = reports['fillingDate'].apply(get_dt)
-        reports['time_stamp'] = reports['time_stamp'].apply(lambda x: int(datetime.timestamp(x)))
+        reports['time_stamp'] = get_ts_array(reports['fillingDate'])
+        reports['fiscalDate'] = get_ts_array(reports['date'])
 
-        reports['fiscalDate'] = reports['date'].apply(get_dt)
-        reports['fiscalDate'] = reports['fiscalDate'].apply(lambda x: int(datetime.timestamp(x)))
-
-        # Convert dataframe to dictionary
-        fundamental_results = reports.T.to_dict().values()
-
-        return fundamental_results
+        return reports
 
     def fetch_income_statement(self):
         """
@@ -1135,7 +1237,7 @@ class FmpStock(stock.StockFetcher):
                 FdataError: incorrect API key(limit reached), http error happened or no data obtained.
 
             Returns:
-                list: fundamental data
+                DataFrame: fundamental data
         """
         return self._fetch_fundamentals('income-statement')
 
@@ -1147,7 +1249,7 @@ class FmpStock(stock.StockFetcher):
                 FdataError: incorrect API key(limit reached), http error happened or no data obtained.
 
             Returns:
-                list: fundamental data
+                DataFrame: fundamental data
         """
         return self._fetch_fundamentals('balance-sheet-statement')
 
@@ -1159,16 +1261,180 @@ class FmpStock(stock.StockFetcher):
                 FdataError: incorrect API key(limit reached), http error happened or no data obtained.
 
             Returns:
-                list: fundamental data
+                DataFrame: fundamental data
         """
         return self._fetch_fundamentals('cash-flow-statement')
 
+    def _get_reports(self):
+        """
+            Get the fundamental reports data.
+
+            Returns:
+                tuple: (interval column, table, fetch method, add method) for each report.
+        """
+        return (('income_statement_max_ts', self._income_statement_tbl, self.fetch_income_statement, self.add_income_statement),
+                ('balance_sheet_max_ts', self._balance_sheet_tbl, self.fetch_balance_sheet, self.add_balance_sheet),
+                ('cash_flow_max_ts', self._cash_flow_tbl, self.fetch_cash_flow, self.add_cash_flow))
+
+    def _get_fetch_jobs(self, stale=None):
+        """
+            Get the jobs to fetch the missing dividends, splits, fundamental, capitalization and surprises data
+            of the current symbol concurrently.
+
+            Args:
+                stale(set): the tables which data is stale according to the refresh plan. If None, the freshness
+                            of each data is checked separately.
+
+            Returns:
+                list: prerequisite jobs which results should be added before fetching quotes.
+                list: other jobs.
+        """
+        prerequisites, jobs = super()._get_fetch_jobs(stale)
+
+        if self.get_sectype() != SecType.Stock:
+            return (prerequisites, jobs)
+
+        for column, table, fetch_method, add_method in self._get_reports():
+            if stale is None:
+                need_reports = self.need_to_update(modified_ts=self._get_requested_ts(column, self._fundamental_intervals_tbl), table=table)
+            else:
+                need_reports = table in stale
+
+            if need_reports:
+                jobs.append((fetch_method, add_method))
+
+        # The number of days to fetch is needed for capitalization, so it is always checked
+        fetch_cap = None
+
+        if stale is None or 'fmp_capitalization' in stale:
+            fetch_cap = self._get_cap_fetcher(self.get_last_modified('fmp_capitalization'))
+
+        if fetch_cap is not None:
+            jobs.append((fetch_cap, self.add_cap))
+
+        if stale is None:
+            need_surprises = self._need_surprises(self.get_last_modified('fmp_surprises'), self.get_last_timestamp('fmp_surprises'))
+        else:
+            need_surprises = 'fmp_surprises' in stale
+
+        if need_surprises:
+            jobs.append((self.fetch_surprises, self.add_surprises))
+
+        return (prerequisites, jobs)
+
+    def _get_refresh_columns(self):
+        """
+            Get the columns of the query which obtains the state of the data of multiple symbols for the refresh plan
+            including fundamental, capitalization and surprises data.
+
+            Returns:
+                list: the columns of the query.
+        """
+        columns = super()._get_refresh_columns()
+
+        for column, table, _, _ in self._get_reports():
+            columns.append(f"""(SELECT MAX({column}) FROM {self._fundamental_intervals_tbl} fi
+                                WHERE fi.symbol_id = s.symbol_id AND fi.source_id = :source_id) AS {column}""")
+
+            for period in (ReportPeriod.Year, ReportPeriod.All, ReportPeriod.Quarter):
+                period_query = ''
+
+                if period != ReportPeriod.All:
+                    period_query = f"AND r.reported_period = (SELECT period_id FROM report_periods WHERE title='{period}')"
+
+                columns.append(f"""(SELECT MAX(fiscalDate) FROM {table} r
+                                    WHERE r.symbol_id = s.symbol_id AND r.source_id = :source_id
+                                    {period_query}) AS {table}_{period.lower()}_ts""")
+
+        # The same as get_last_modified() and get_last_timestamp()
+        for table in ('fmp_capitalization', 'fmp_surprises'):
+            columns.append(f"""(SELECT modified FROM {table} t
+                                WHERE t.symbol_id = s.symbol_id ORDER BY modified DESC LIMIT 1) AS {table}_mod_ts""")
+
+        columns.append("""(SELECT time_stamp FROM fmp_surprises t
+                            WHERE t.symbol_id = s.symbol_id ORDER BY modified DESC LIMIT 1) AS fmp_surprises_last_ts""")
+
+        return columns
+
+    def _get_stale_data(self, row):
+        """
+            Get the stale data of a symbol (including fundamental, capitalization and surprises data) using the state
+            obtained by the refresh plan query.
+
+            Args:
+                row(sqlite3.Row): the state of the symbol data.
+
+            Returns:
+                set: the tables which data is stale or None if the staleness can't be determined by the state.
+        """
+        stale = super()._get_stale_data(row)
+
+        if stale is None or row['sec_type'] != SecType.Stock:
+            return stale
+
+        for column, table, _, _ in self._get_reports():
+            fiscal_ts = tuple(row[f"{table}_{period.lower()}_ts"] for period in (ReportPeriod.Year, ReportPeriod.All, ReportPeriod.Quarter))
+
+            if self.need_to_update(modified_ts=row[column], table=table, fiscal_ts=fiscal_ts):
+                stale.add(table)
+
+        if self._get_cap_fetcher(row['fmp_capitalization_mod_ts']) is not None:
+            stale.add('fmp_capitalization')
+
+        if self._need_surprises(row['fmp_surprises_mod_ts'], row['fmp_surprises_last_ts']):
+            stale.add('fmp_surprises')
+
+        return stale
+
+    def _add_reports(self, reports, table, columns):
+        """
+            Add fundamental report entries to the database using one parameterized statement for all the entries.
+
+            Args:
+                reports(DataFrame, list of dictionaries): reports entries obtained from an API wrapper.
+                table(str): the table to add the entries to.
+                columns(tuple): the columns of the reports to add.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        if isinstance(reports, pd.DataFrame) is False:
+            reports = pd.DataFrame(list(reports))
+
+        if len(reports) == 0:
+            return
+
+        get_periods = "SELECT title, period_id FROM report_periods;"
+
+        try:
+            self.cur.execute(get_periods)
+            periods = dict(self.cur.fetchall())
+        except self.Error as e:
+            raise FdataError(f"Can't query table 'report_periods': {e}\n\nThe query is\n{get_periods}") from e
+
+        # Missing columns are NULL
+        frame = reports.reindex(columns=columns)
+        frame.insert(0, 'reported_period', reports['reported_period'].map(periods))
+
+        symbol_id = self.get_symbol_id()
+        source_id = self.get_source_id()
+
+        rows = [(symbol_id, source_id, *[get_sql_value(value) for value in row]) for row in frame.itertuples(index=False, name=None)]
+
+        insert_reports = f"""INSERT OR {self._update} INTO {table} (symbol_id, source_id, reported_period, {', '.join(columns)})
+                                VALUES ({', '.join(['?'] * (len(columns) + 3))});"""
+
+        try:
+            self.cur.executemany(insert_reports, rows)
+        except self.Error as e:
+            raise FdataError(f"Can't add records to a table '{table}': {e}\n\nThe query is\n{insert_reports}") from e
+
     def add_income_statement(self, reports):
         """
             Add income statement entries to the database.
 
             Args:
-                reports(list of dictionaries): reports entries obtained from an API wrapper.
+                reports(DataFrame, list of dictionaries): reports entries obtained from an API wrapper.
 
             Returns:
                 (int, int): total number of report entries in DB before and after the operation.
@@ -1184,81 +1450,15 @@ class FmpStock(stock.StockFetcher):
 
         num_before = self.get_income_statement_num()
 
-        for report in reports:
-            insert_report = f"""INSERT OR {self._update} INTO {self._income_statement_tbl} (symbol_id,
-                                    source_id,
-                                    reported_period,
-                                    time_stamp,
-                                    fiscalDate,
-                                    revenue,
-                                    costOfRevenue,
-                                    grossProfit,
-                                    grossProfitRatio,
-                                    researchAndDevelopmentExpenses,
-                                    generalAndAdministrativeExpenses,
-                                    sellingAndMarketingExpenses,
-                                    sellingGeneralAndAdministrativeExpenses,
-                                    otherExpenses,
-                                    operatingExpenses,
-                                    costAndExpenses,
-                                    interestIncome,
-                                    interestExpense,
-                                    depreciationAndAmortization,
-                                    ebitda,
-                                    ebitdaratio,
-                                    operatingIncome,
-                                    operatingIncomeRatio,
-                                    totalOtherIncomeExpensesNet,
-                                    incomeBeforeTax,
-                                    incomeBeforeTaxRatio,
-                                    incomeTaxExpense,
-                                    netIncome,
-                                    netIncomeRatio,
-                                    eps,
-                                    epsdiluted,
-                                    weightedAverageShsOut,
-                                    weightedAverageShsOutDil)
-                                    VALUES (
-                                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
-                                            (SELECT period_id FROM report_periods WHERE title = '{report['reported_period']}'),
-                                            {report['time_stamp']},
-                                            {report['fiscalDate']},
-                                            {report['revenue']},
-                                            {report['costOfRevenue']},
-                                            {report['grossProfit']},
-                                            {report['grossProfitRatio']},
-                                            {report['researchAndDevelopmentExpenses']},
-                                            {report['generalAndAdministrativeExpenses']},
-                                            {report['sellingAndMarketingExpenses']},
-                                            {report['sellingGeneralAndAdministrativeExpenses']},
-                                            {report['otherExpenses']},
-                                            {report['operatingExpenses']},
-                                            {report['costAndExpenses']},
-                                            {report['interestIncome']},
-                                            {report['interestExpense']},
-                                            {report['depreciationAndAmortization']},
-                                            {report['ebitda']},
-                                            {report['ebitdaratio']},
-                                            {report['operatingIncome']},
-                                            {report['operatingIncomeRatio']},
-                                            {report['totalOtherIncomeExpensesNet']},
-                                            {report['incomeBeforeTax']},
-                                            {report['incomeBeforeTaxRatio']},
-                                            {report['incomeTaxExpense']},
-                                            {report['netIncome']},
-                                            {report['netIncomeRatio']},
-                                            {report['eps']},
-                                            {report['epsdiluted']},
-                                            {report['weightedAverageShsOut']},
-                                            {report['weightedAverageShsOutDil']});"""
+        self.database.begin()
 
-            try:
-                self.cur.execute(insert_report)
-            except self.Error as e:
-                raise FdataError(f"Can't add a record to a table '{self._income_statement_tbl}': {e}\n\nThe query is\n{insert_report}") from e
+        try:
+            self._add_reports(reports, self._income_statement_tbl, income_statement_columns)
+        except FdataError:
+            self.database.rollback()
+            raise
 
-        self.commit()
+        self.database.release()
 
         self._update_intervals('income_statement_max_ts', self._fundamental_intervals_tbl)
 
@@ -1269,7 +1469,7 @@ class FmpStock(stock.StockFetcher):
             Add balance_sheet entries to the database.
 
             Args:
-                reports(list of dictionaries): reports entries obtained from an API wrapper.
+                reports(DataFrame, list of dictionaries): reports entries obtained from an API wrapper.
 
             Returns:
                 (int, int): total number of report entries in DB before and after the operation.
@@ -1285,113 +1485,15 @@ class FmpStock(stock.StockFetcher):
 
         num_before = self.get_balance_sheet_num()
 
-        for report in reports:
-            insert_report = f"""INSERT OR {self._update} INTO {self._balance_sheet_tbl} (symbol_id,
-                                    source_id,
-                                    reported_period,
-                                    time_stamp,
-                                    fiscalDate,
-                                    cashAndCashEquivalents,
-                                    shortTermInvestments,
-                                    cashAndShortTermInvestments,
-                                    netReceivables,
-                                    inventory,
-                                    otherCurrentAssets,
-                                    totalCurrentAssets,
-                                    propertyPlantEquipmentNet,
-                                    goodwill,
-                                    intangibleAssets,
-                                    goodwillAndIntangibleAssets,
-                                    longTermInvestments,
-                                    taxAssets,
-                                    otherNonCurrentAssets,
-                                    totalNonCurrentAssets,
-                                    otherAssets,
-                                    totalAssets,
-                                    accountPayables,
-                                    shortTermDebt,
-                                    taxPayables,
-                                    deferredRevenue,
-                                    otherCurrentLiabilities,
-                                    totalCurrentLiabilities,
-                                    longTermDebt,
-                                    deferredRevenueNonCurrent,
-                                    deferredTaxLiabilitiesNonCurrent,
-                                    otherNonCurrentLiabilities,
-                                    totalNonCurrentLiabilities,
-                                    otherLiabilities,
-                                    capitalLeaseObligations,
-                                    totalLiabilities,
-                                    preferredStock,
-                                    commonStock,
-                                    retainedEarnings,
-                                    accumulatedOtherComprehensiveIncomeLoss,
-                                    othertotalStockholdersEquity,
-                                    totalStockholdersEquity,
-                                    totalEquity,
-                                    totalLiabilitiesAndStockholdersEquity,
-                                    minorityInterest,
-                                    totalLiabilitiesAndTotalEquity,
-                                    totalInvestments,
-                                    totalDebt,
-                                    netDebt)
-                                    VALUES (
-                                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
-                                            (SELECT period_id FROM report_periods WHERE title = '{report['reported_period']}'),
-                                            {report['time_stamp']},
-                                            {report['fiscalDate']},
-                                            {report['cashAndCashEquivalents']},
-                                            {report['shortTermInvestments']},
-                                            {report['cashAndShortTermInvestments']},
-                                            {report['netReceivables']},
-                                            {report['inventory']},
-                                            {report['otherCurrentAssets']},
-                                            {report['totalCurrentAssets']},
-                                            {report['propertyPlantEquipmentNet']},
-                                            {report['goodwill']},
-                                            {report['intangibleAssets']},
-                                            {report['goodwillAndIntangibleAssets']},
-                                            {report['longTermInvestments']},
-                                            {report['taxAssets']},
-                                            {report['otherNonCurrentAssets']},
-                                            {report['totalNonCurrentAssets']},
-                                            {report['otherAssets']},
-                                            {report['totalAssets']},
-                                            {report['accountPayables']},
-                                            {report['shortTermDebt']},
-                                            {report['taxPayables']},
-                                            {report['deferredRevenue']},
-                                            {report['otherCurrentLiabilities']},
-                                            {report['totalCurrentLiabilities']},
-                                            {report['longTermDebt']},
-                                            {report['deferredRevenueNonCurrent']},
-                                            {report['deferredTaxLiabilitiesNonCurrent']},
-                                            {report['otherNonCurrentLiabilities']},
-                                            {report['totalNonCurrentLiabilities']},
-                                            {report['otherLiabilities']},
-                                            {report['capitalLeaseObligations']},
-                                            {report['totalLiabilities']},
-                                            {report['preferredStock']},
-                                            {report['commonStock']},
-                                            {report['retainedEarnings']},
-                                            {report['accumulatedOtherComprehensiveIncomeLoss']},
-                                            {report['othertotalStockholdersEquity']},
-                                            {report['totalStockholdersEquity']},
-                                            {report['totalEquity']},
-                                            {report['totalLiabilitiesAndStockholdersEquity']},
-                                            {report['minorityInterest']},
-                                            {report['totalLiabilitiesAndTotalEquity']},
-                                            {report['totalInvestments']},
-                                            {report['totalDebt']},
-                                            {report['netDebt']});"""
+        self.database.begin()
 
-            try:
-                self.cur.execute(insert_report)
-            except self.Error as e:
-                raise FdataError(f"Can't add a record to a table '{self._balance_sheet_tbl}': {e}\n\nThe query is\n{insert_report}") from e
+        try:
+            self._add_reports(reports, self._balance_sheet_tbl, balance_sheet_columns)
+        except FdataError:
+            self.database.rollback()
+            raise
 
-        self.commit()
+        self.database.release()
 
         self._update_intervals('balance_sheet_max_ts', self._fundamental_intervals_tbl)
 
@@ -1402,7 +1504,7 @@ class FmpStock(stock.StockFetcher):
             Add cash_flow entries to the database.
 
             Args:
-                reports(list of dictionaries): reports entries obtained from an API wrapper.
+                reports(DataFrame, list of dictionaries): reports entries obtained from an API wrapper.
 
             Returns:
                 (int, int): total number of report entries in DB before and after the operation.
@@ -1418,85 +1520,15 @@ class FmpStock(stock.StockFetcher):
 
         num_before = self.get_cash_flow_num()
 
-        for report in reports:
-            insert_report = f"""INSERT OR {self._update} INTO {self._cash_flow_tbl} (symbol_id,
-                                    source_id,
-                                    reported_period,
-                                    time_stamp,
-                                    fiscalDate,
-                                    netIncome,
-                                    depreciationAndAmortization,
-                                    deferredIncomeTax,
-                                    stockBasedCompensation,
-                                    changeInWorkingCapital,
-                                    accountsReceivables,
-                                    inventory,
-                                    accountsPayables,
-                                    otherWorkingCapital,
-                                    otherNonCashItems,
-                                    netCashProvidedByOperatingActivities,
-                                    investmentsInPropertyPlantAndEquipment,
-                                    acquisitionsNet,
-                                    purchasesOfInvestments,
-                                    salesMaturitiesOfInvestments,
-                                    otherInvestingActivites,
-                                    netCashUsedForInvestingActivites,
-                                    debtRepayment,
-                                    commonStockIssued,
-                                    commonStockRepurchased,
-                                    dividendsPaid,
-                                    otherFinancingActivites,
-                                    netCashUsedProvidedByFinancingActivities,
-                                    effectOfForexChangesOnCash,
-                                    netChangeInCash,
-                                    cashAtEndOfPeriod,
-                                    cashAtBeginningOfPeriod,
-                                    operatingCashFlow,
-                                    capitalExpenditure,
-                                    freeCashFlow)
-                                    VALUES (
-                                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
-                                            (SELECT period_id FROM report_periods WHERE title = '{report['reported_period']}'),
-                                            {report['time_stamp']},
-                                            {report['fiscalDate']},
-                                            {report['netIncome']},
-                                            {report['depreciationAndAmortization']},
-                                            {report['deferredIncomeTax']},
-                                            {report['stockBasedCompensation']},
-                                            {report['changeInWorkingCapital']},
-                                            {report['accountsReceivables']},
-                                            {report['inventory']},
-                                            {report['accountsPayables']},
-                                            {report['otherWorkingCapital']},
-                                            {report['otherNonCashItems']},
-                                            {report['netCashProvidedByOperatingActivities']},
-                                            {report['investmentsInPropertyPlantAndEquipment']},
-                                            {report['acquisitionsNet']},
-                                            {report['purchasesOfInvestments']},
-                                            {report['salesMaturitiesOfInvestments']},
-                                            {report['otherInvestingActivites']},
-                                            {report['netCashUsedForInvestingActivites']},
-                                            {report['debtRepayment']},
-                                            {report['commonStockIssued']},
-                                            {report['commonStockRepurchased']},
-                                            {report['dividendsPaid']},
-                                            {report['otherFinancingActivites']},
-                                            {report['netCashUsedProvidedByFinancingActivities']},
-                                            {report['effectOfForexChangesOnCash']},
-                                            {report['netChangeInCash']},
-                                            {report['cashAtEndOfPeriod']},
-                                            {report['cashAtBeginningOfPeriod']},
-                                            {report['operatingCashFlow']},
-                                            {report['capitalExpenditure']},
-                                            {report['freeCashFlow']});"""
+        self.database.begin()
 
-            try:
-                self.cur.execute(insert_report)
-            except self.Error as e:
-                raise FdataError(f"Can't add a record to a table '{self._cash_flow_tbl}': {e}\n\nThe query is\n{insert_report}") from e
+        try:
+            self._add_reports(reports, self._cash_flow_tbl, cash_flow_columns)
+        except FdataError:
+            self.database.rollback()
+            raise
 
-        self.commit()
+        self.database.release()
 
         self._update_intervals('cash_flow_max_ts', self._fundamental_intervals_tbl)
 
@@ -13,6 +13,9 @@ from os.path import exists
 import glob
 
 import numpy as np
+import pandas as pd
+
+from data.fvalues import Quotes
 
 import threading
 import multiprocessing
@@ -64,6 +67,63 @@ def get_dt(value, timezone=tz.UTC):
 
     return dt
 
+def get_dt_array(values, timezone=tz.UTC):
+    """
+        Get UTC adjusted datetimes from an array of values. It is the vectorized counterpart of get_dt().
+
+        Args:
+            values(array-like): ISO strings, datetimes or timestamps. All the values should be of the same type.
+            timezone: the initial time zone.
+
+        Raises:
+            ValueError: can't generate datetimes.
+
+        Return:
+            ndarray: datetime64[s] values without time zone obtained from the provided values.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+
+    if len(values) == 0:
+        return np.array([], dtype='datetime64[s]')
+
+    try:
+        # Timestamp
+        if pd.api.types.is_numeric_dtype(values):
+            dt = pd.to_datetime(values.astype(np.int64), unit='s')
+        # String or datetime
+        else:
+            dt = pd.to_datetime(values, format='ISO8601')
+
+            # The initial time zone is replaced by the provided one as get_dt() does
+            if dt.dt.tz is not None:
+                dt = dt.dt.tz_localize(None)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise ValueError(f"Can't generate datetimes: {e}") from e
+
+    # Set the time zone and UTC adjust the datetimes. Ambiguous and nonexistent wall times (DST transitions) are
+    # resolved the same way as get_dt() does.
+    dt = dt.dt.tz_localize(timezone, ambiguous=True, nonexistent=pd.Timedelta(hours=-1))
+    dt = dt.dt.tz_convert(tz.UTC).dt.tz_localize(None)
+
+    return dt.to_numpy(dtype='datetime64[s]')
+
+def get_ts_array(values, timezone=tz.UTC):
+    """
+        Get UTC timestamps from an array of values. It is the vectorized counterpart of get_dt() followed by
+        the timestamp calculation.
+
+        Args:
+            values(array-like): ISO strings, datetimes or timestamps. All the values should be of the same type.
+            timezone: the initial time zone.
+
+        Raises:
+            ValueError: can't generate timestamps.
+
+        Return:
+            ndarray: int64 timestamps.
+    """
+    return get_dt_array(values, timezone).astype(np.int64)
+
 def get_ts_from_str(value):
     """
         Get timestamp from datetime or datetime string representation.
@@ -186,7 +246,30 @@ def update_layout(fig, title, length):
         ),
         paper_bgcolor="LightSteelBlue")
 
-def get_labelled_ndarray(rows):
+def get_dtype(key, value):
+    """
+        Infer the dtype of a column by its name and a value.
+
+        Args:
+            key(str): the name of the column.
+            value: the value from the column.
+
+        Returns:
+            numpy.dtype: inferred dtype.
+    """
+    # Set Transactions dtype to object as not every data source have it.
+    if isinstance(value, str) or key == 'transactions':
+        return np.dtype('object')
+    elif key == 'declaration_date' or key == 'record_date' or key == 'payment_date':
+        # TODO MID It is better if it is handled on the caller's side (not here)
+        return np.dtype('object')  # These keys may be None
+
+    return np.array([value]).dtype
+
+# The number of rows converted at once by the columnar conversion
+block_size = 16384
+
+def get_labelled_ndarray(rows, names=None, dtypes=None):
     """
         Take a 2D list of sqlite3.Row and convert it to a labelled ndarray.
         Then it is possible to address this array like arr['date_time'].
@@ -194,36 +277,102 @@ def get_labelled_ndarray(rows):
         Regular list is preferred as it is fast for iterating and it is memory efficient but in some cases
         numpy arrays may be preferred (for example, if a lot of column-wise operations are supposed).
 
+        If names are provided, rows are considered as plain tuples and the array is filled column by column
+        which is much faster and uses less memory than the conversion of sqlite3.Row.
+
         Args:
-            rows(list(sqlite3.Row)): the data to convert.
+            rows(list(sqlite3.Row), list(tuple)): the data to convert.
+            names(list(str)): names of the columns if rows are plain tuples.
+            dtypes(dict): declared dtypes of the columns. Dtypes of other columns are inferred from the first row.
 
         Returns:
             ndarray: labelled ndarray.
     """
-    # At first, get all column names and types
-    key_types = []
-
     if len(rows) == 0:
         raise ValueError("Source data length is 0.")
 
-    for key, value in dict(rows[0]).items():
-        # Set Transactions dtype to object as not every data source have it.
-        if isinstance(value, str) or key == 'transactions':
-            key_type = 'object'
-        elif key == 'declaration_date' or key == 'record_date' or key == 'payment_date':
-            # TODO MID It is better if it is handled on the caller's side (not here)
-            key_type = 'object'  # These keys may be None
-        else:
-            key_type = np.array([value]).dtype
+    if dtypes is None:
+        dtypes = {}
+
+    if names is None:
+        # At first, get all column names and types
+        key_types = [(key, dtypes.get(key, get_dtype(key, value))) for key, value in dict(rows[0]).items()]
+
+        dtypes = np.dtype(key_types)
+
+        # Create tuples of each row
+        data = [tuple(row[name] for name in dtypes.names) for row in rows]
+
+        return np.array(data, dtypes)
 
-        key_types.append((key, key_type))
+    # Columnar conversion. The first column is used if names are duplicated (the same as for sqlite3.Row).
+    columns = {}
 
-    dtypes = np.dtype(key_types)
+    for i, name in enumerate(names):
+        if name not in columns:
+            columns[name] = i
 
-    # Create tuples of each row
-    data = [tuple(row[name] for name in dtypes.names) for row in rows]
+    key_types = [(name, dtypes.get(name, get_dtype(name, rows[0][i]))) for name, i in columns.items()]
 
-    return np.array(data, dtypes)
+    data = np.empty(len(rows), dtype=np.dtype(key_types))
+
+    # Rows are converted by blocks to keep the processed rows in CPU cache while iterating over columns
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        end = start + len(block)
+
+        for name, i in columns.items():
+            dtype = data.dtype[name]
+
+            try:
+                data[name][start:end] = np.fromiter((row[i] for row in block), dtype=dtype, count=len(block))
+            except (TypeError, ValueError):
+                data[name][start:end] = np.array([row[i] for row in block], dtype=dtype)
+
+    return data
+
+def get_sql_value(value):
+    """
+        Convert a value obtained from an API wrapper to the type suitable for a parameterized sqlite3 query.
+
+        Args:
+            value: the value to convert ('NULL' string, numpy scalar, NaN or any type supported by sqlite3).
+
+        Returns:
+            The converted value (None for 'NULL' and NaN).
+    """
+    if value is None or (isinstance(value, str) and value == 'NULL'):
+        return None
+
+    # Convert numpy scalars to native Python types
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if isinstance(value, float) and value != value:
+        return None
+
+    return value
+
+def get_split_factors(ts, split_ts, split_ratios):
+    """
+        Get the combined split ratio of each quote for the reverse-adjustment of quotes.
+
+        The ratio of a quote is the product of ratios of all the splits at or after the quote.
+
+        Args:
+            ts(ndarray): timestamps of quotes.
+            split_ts(ndarray): timestamps of splits (may be unsorted).
+            split_ratios(ndarray): ratios of splits.
+
+        Returns:
+            ndarray: the combined split ratio of each quote.
+    """
+    order = np.argsort(split_ts, kind='stable')
+
+    # The last element is the ratio of the quotes after all the splits
+    ratios = np.append(np.cumprod(np.asarray(split_ratios, dtype=float)[order][::-1])[::-1], 1)
+
+    return ratios[np.searchsorted(np.asarray(split_ts)[order], ts, side='left')]
 
 def add_column(rows, name, dtype=object, default=0.0):
     """
@@ -254,6 +403,109 @@ def add_column(rows, name, dtype=object, default=0.0):
 
     return rows
 
+def add_fields(rows, fields):
+    """
+        Add columns with the provided values to the labelled numpy array.
+
+        The dtype of each column is inferred from all its values. Columns with missing values (None) or strings
+        get the object dtype. The dtype of ndarray values is kept.
+
+        Args:
+            rows(ndarray): the initial array.
+            fields(list of tuple): pairs of (name, values) to add (values may be a list or ndarray).
+
+        Returns:
+            The new array with added columns.
+    """
+    arrays = []
+
+    for name, values in fields:
+        if isinstance(values, np.ndarray):
+            arrays.append((name, values))
+        elif any(value is None or isinstance(value, str) for value in values):
+            arrays.append((name, np.array(values, dtype=object)))
+        else:
+            arrays.append((name, np.array(values)))
+
+    # Names may be StrEnum members. Plain strings are used for the consistency with queried columns.
+    dt = np.dtype(rows.dtype.descr + [(str(name), array.dtype) for name, array in arrays])
+
+    result = np.empty(len(rows), dtype=dt)
+
+    for name in rows.dtype.names:
+        result[name] = rows[name]
+
+    for name, array in arrays:
+        result[str(name)] = array
+
+    return result
+
+def pack_objects(rows):
+    """
+        Convert the object columns of the labelled numpy array to fixed-width dtypes so the array may be saved
+        without pickling (and memory-mapped).
+
+        String columns become fixed-width unicode strings. Other object columns become floats where missing
+        values (None) are NaN.
+
+        Args:
+            rows(ndarray): the initial array.
+
+        Returns:
+            The new array without object columns.
+    """
+    fields = []
+
+    for name in rows.dtype.names:
+        column = rows[name]
+
+        if column.dtype == object:
+            try:
+                column = column.astype(np.float64)
+            except (TypeError, ValueError):
+                column = column.astype(str)
+
+        fields.append((name, column))
+
+    result = np.empty(len(rows), dtype=[(name, column.dtype) for name, column in fields])
+
+    for name, column in fields:
+        result[name] = column
+
+    return result
+
+def unpack_objects(rows, names):
+    """
+        Restore the object columns of the labelled numpy array converted by pack_objects.
+
+        Fixed-width strings become python strings. Floats become python integers and NaN becomes None.
+
+        Args:
+            rows(ndarray): the packed array.
+            names(list): the names of the object columns to restore.
+
+        Returns:
+            The new array with object columns.
+    """
+    dt = [(name, object if name in names else rows.dtype[name]) for name in rows.dtype.names]
+
+    result = np.empty(len(rows), dtype=dt)
+
+    for name in rows.dtype.names:
+        column = rows[name]
+
+        if name in names and column.dtype.kind == 'f':
+            missing = np.isnan(column)
+
+            column = np.where(missing, 0, column).astype(np.int64).astype(object)
+            column[missing] = None
+        elif name in names:
+            column = column.astype(object)
+
+        result[name] = column
+
+    return result
+
 def delete_row(self, data, row_num):
     """
         Deletes a row from data.
@@ -269,23 +521,143 @@ def delete_row(self, data, row_num):
 
     return data
 
-def trim_time(data, start=None, end=None):
+def get_day_seconds(value):
     """
-        Trim the time which is out of the time windows.
-        For example, if start='13:30' and end='21:00' then all quotes which are outside of this window will be deleted
-        from the dataset.
+        Get the number of seconds since the midnight from the time of day.
+
+        Args:
+            value(str): the time of day in HH:MM format.
+
+        Raises:
+            ValueError: incorrect time of day.
+
+        Returns:
+            int: the number of seconds since the midnight.
     """
-    pick_time = np.vectorize(lambda x: datetime.utcfromtimestamp(x).time())
+    time = datetime.strptime(value, '%H:%M')
 
-    if start is not None:
-        start_time = datetime.strptime(start, '%H:%M').replace(tzinfo=tz.UTC).time()
-        data = data[np.where(pick_time(data[Quotes.TimeStamp]) >= start_time)]
+    return time.hour * 3600 + time.minute * 60
 
-    if end is not None and len(data):
-        end_time = datetime.strptime(end, '%H:%M').replace(tzinfo=tz.UTC).time()
-        data = data[np.where(pick_time(data[Quotes.TimeStamp]) <= end_time)]
+def get_utc_offsets(ts, timezone=tz.UTC):
+    """
+        Get UTC offsets of the time zone for the timestamps.
 
-    return data
+        Args:
+            ts(array-like): timestamps.
+            timezone: the time zone.
+
+        Returns:
+            ndarray: int64 offsets in seconds.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+
+    if timezone == tz.UTC or len(ts) == 0:
+        return np.zeros(len(ts), dtype=np.int64)
+
+    local = pd.DatetimeIndex(ts.astype('datetime64[s]')).tz_localize(tz.UTC).tz_convert(timezone).tz_localize(None)
+
+    return local.to_numpy(dtype='datetime64[s]').astype(np.int64) - ts
+
+def get_session_window(start=None, end=None):
+    """
+        Get the session window in seconds since the midnight.
+
+        Args:
+            start(str): the start of the session in HH:MM format (the midnight if None).
+            end(str): the end of the session in HH:MM format (inclusive, the end of the day if None).
+
+        Returns:
+            (int, int): the start and the end of the session. The start is greater than the end if the session
+                        crosses the midnight.
+    """
+    start_seconds = 0 if start is None else get_day_seconds(start)
+    end_seconds = 86399 if end is None else get_day_seconds(end)
+
+    return (start_seconds, end_seconds)
+
+def get_session_mask(ts, start=None, end=None, timezone=tz.UTC):
+    """
+        Get the mask of the timestamps which are within the session window. The window may cross the midnight.
+
+        Args:
+            ts(array-like): timestamps.
+            start(str): the start of the session in HH:MM format.
+            end(str): the end of the session in HH:MM format (inclusive).
+            timezone: the time zone of the session.
+
+        Returns:
+            ndarray: boolean mask.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+
+    start_seconds, end_seconds = get_session_window(start, end)
+
+    seconds = (ts + get_utc_offsets(ts, timezone)) % 86400
+
+    if start_seconds <= end_seconds:
+        return (seconds >= start_seconds) & (seconds <= end_seconds)
+
+    return (seconds >= start_seconds) | (seconds <= end_seconds)
+
+def get_session_query(start=None, end=None, timezone=tz.UTC, first_ts=0, last_ts=0, column='time_stamp'):
+    """
+        Get the time of day SQL predicate for the session window.
+
+        The predicate compares the UTC time of day of the column. If the UTC offset of the time zone changes
+        within the interval (like DST), the predicate covers the session for all the offsets, so the quotes
+        should be filtered by get_session_mask() as well.
+
+        Args:
+            start(str): the start of the session in HH:MM format.
+            end(str): the end of the session in HH:MM format (inclusive).
+            timezone: the time zone of the session.
+            first_ts(int): the first timestamp of the queried interval.
+            last_ts(int): the last timestamp of the queried interval.
+            column(str): the timestamp column.
+
+        Returns:
+            str: the predicate (empty if any time of day matches).
+            bool: indicates if the predicate is exact.
+    """
+    start_seconds, end_seconds = get_session_window(start, end)
+
+    # Offsets are checked once per day of the interval
+    offsets = np.unique(get_utc_offsets(np.append(np.arange(first_ts, last_ts, 86400), last_ts), timezone))
+
+    length = (end_seconds - start_seconds) % 86400 + int(offsets[-1] - offsets[0])
+
+    if length >= 86399:
+        return ('', len(offsets) == 1)
+
+    utc_start = (start_seconds - int(offsets[-1])) % 86400
+    utc_end = (utc_start + length) % 86400
+
+    # SQLite keeps the sign of the dividend
+    seconds = f"(({column} % 86400) + 86400) % 86400"
+
+    if utc_start <= utc_end:
+        query = f"{seconds} BETWEEN {utc_start} AND {utc_end}"
+    else:
+        query = f"({seconds} >= {utc_start} OR {seconds} <= {utc_end})"
+
+    return (query, len(offsets) == 1)
+
+def trim_time(data, start=None, end=None, timezone=tz.UTC):
+    """
+        Trim the time which is out of the time windows.
+        For example, if start='13:30' and end='21:00' then all quotes which are outside of this window will be deleted
+        from the dataset. The window may cross the midnight (like start='22:00' and end='02:00').
+
+        Args:
+            data(ndarray): quotes data.
+            start(str): the start of the window in HH:MM format.
+            end(str): the end of the window in HH:MM format (inclusive).
+            timezone: the time zone of the window.
+
+        Returns:
+            ndarray: the trimmed data.
+    """
+    return data[get_session_mask(data[Quotes.TimeStamp], start, end, timezone)]
 
 def logger(verbosity, message):
     """
@@ -578,6 +578,22 @@ class DbTypes(StrEnum):
     """
     SQLite = "sqlite"
 
+class DbProfiles(StrEnum):
+    """
+        Database performance profiles enum.
+    """
+    Default = "Default"  # Database defaults
+    BulkLoad = "BulkLoad"  # Fast bulk writes at the expense of durability
+    ReadHeavy = "ReadHeavy"  # Concurrent readers (like backtests) while a refresh writes to the database
+
+class RefreshStatus(IntEnum):
+    """
+        Enum class for the status of a planned data refresh of a symbol.
+    """
+    Pending = 0
+    Done = 1
+    Failed = 2
+
 class Algorithm(IntEnum):
     """Enum with some algorithms for scikit-learn."""
     LR = 0
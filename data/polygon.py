@@ -10,6 +10,10 @@ import pytz
 from dateutil.relativedelta import relativedelta
 
 import json
+import re
+
+import numpy as np
+import pandas as pd
 
 from termcolor import colored
 
@@ -46,6 +50,7 @@ class Polygon(stock.StockFetcher):
         # Default values
         self.source_title = "Polygon.io"
         self.api_key = settings.Polygon.api_key
+        self.base_url = settings.Polygon.base_url
 
         # Maximum number of API queries per minute for the subscription plan.
         # Even in the case of payed subscription it is better to keep some limit here as Polygon has
@@ -120,6 +125,24 @@ class Polygon(stock.StockFetcher):
         else:
             raise FdataError(f"Unknown timespan for Polygon: {timespan}")
 
+    def get_response_ttl(self, url):
+        """
+            Get the time to live of the cached response for the URL. Unadjusted aggregates of ranges which ended
+            in the past never expire.
+
+            Args:
+                url(str): the requested URL.
+
+            Returns:
+                int: TTL in seconds. 0 means that the response should not be cached, None - the response never expires.
+        """
+        match = re.search(r'/v2/aggs/ticker/[^/]+/range/\d+/\w+/[\d-]+/([\d-]+)', url)
+
+        if match is not None and (datetime.now(pytz.utc).date() - get_dt(match.group(1)).date()).days > 1:
+            return None
+
+        return super().get_response_ttl(url)
+
     # TODO LOW Think if it should be abstract in the base class
     def query_and_parse(self, url, timeout=30):
         """
@@ -179,11 +202,11 @@ class Polygon(stock.StockFetcher):
         else:
             last_date = self.last_date.date()
 
-        # Parsed quotes data. Lets keep it in the same object because it is very unlikely that it won't fit in the memory.
-        quotes_data = []
+        # Parsed pages of quotes data. Lets keep them in memory because it is very unlikely that they won't fit.
+        pages = []
 
         while True:
-            url = f"https://api.polygon.io/v2/aggs/ticker/{self.symbol}/range/1/{self.get_timespan_str()}/{first_date}/{last_date}?adjusted=false&sort=asc&limit=50000&apiKey={self.api_key}"
+            url = f"{self.base_url}/v2/aggs/ticker/{self.symbol}/range/1/{self.get_timespan_str()}/{first_date}/{last_date}?adjusted=false&sort=asc&limit=50000&apiKey={self.api_key}"
 
             json_results = self.query_and_parse(url)
 
@@ -192,43 +215,41 @@ class Polygon(stock.StockFetcher):
 
                 break
 
-            for j in range(len(json_results)):
-                quote = json_results[j]
+            if len(json_results) == 0:
+                break
 
-                # No need in ms
-                ts = int(quote['t'] / 1000)
+            page = pd.DataFrame(json_results)
 
-                dt = datetime.utcfromtimestamp(ts)
-                dt = dt.replace(tzinfo=pytz.utc)
+            # No need in ms
+            ts = page['t'].to_numpy(dtype=np.int64) // 1000
 
-                # Keep all non-intraday timestamps at 23:59:59
-                if self.is_intraday() is False:
-                    dt = dt.replace(hour=23, minute=59, second=59)
-                    ts = int(datetime.timestamp(dt))
+            # Keep all non-intraday timestamps at 23:59:59
+            if self.is_intraday() is False:
+                ts = ts - ts % 86400 + 86399
 
-                # Sometimes the number of transactions does not exist in json
-                if 'n' not in quote:
-                    n = 'NULL'
-                else:
-                    n = quote['n']
+            # Sometimes the number of transactions does not exist in json
+            if 'n' in page:
+                transactions = page['n'].astype('Int64').astype(object).where(page['n'].notna(), 'NULL')
+            else:
+                transactions = 'NULL'
 
-                quote_dict = {
-                    'ts': ts,
-                    'open': quote['o'],
-                    'high': quote['h'],
-                    'low': quote['l'],
-                    'close': quote['c'],
-                    'volume': quote['v'],
-                    'transactions': n
-                }
+            pages.append(pd.DataFrame({
+                'ts': ts,
+                'open': page['o'],
+                'high': page['h'],
+                'low': page['l'],
+                'close': page['c'],
+                'volume': page['v'],
+                'transactions': transactions
+            }))
 
-                quotes_data.append(quote_dict)
+            last_page_date = get_dt(int(ts[-1])).date()
 
             # Likely the last days are days off so no quotes are obtained
-            if first_date == dt.date():
+            if first_date == last_page_date:
                 break
 
-            first_date = dt.date()
+            first_date = last_page_date
 
             # Enough quotes are obtained
             if first_date > last_date:
@@ -236,13 +257,16 @@ class Polygon(stock.StockFetcher):
             else:
                 self.log(f"Continue aggregate fetching quotes for {self.symbol} from {first_date} to {last_date}.")
 
-        return quotes_data
+        if len(pages) == 0:
+            return []
+
+        return pd.concat(pages, ignore_index=True).to_dict('records')
 
     def fetch_dividends(self):
         """
             Fetch the cash dividend data.
         """
-        url_divs = f"https://api.polygon.io/v3/reference/dividends?ticker={self.symbol}&limit=1000&apiKey={self.api_key}"
+        url_divs = f"{self.base_url}/v3/reference/dividends?ticker={self.symbol}&limit=1000&apiKey={self.api_key}"
 
         json_results = self.query_and_parse(url_divs)
 
@@ -288,7 +312,7 @@ class Polygon(stock.StockFetcher):
         """
             Fetch the split data.
         """
-        url_splits = f"https://api.polygon.io/v3/reference/splits?ticker={self.symbol}&limit=1000&apiKey={self.api_key}"
+        url_splits = f"{self.base_url}/v3/reference/splits?ticker={self.symbol}&limit=1000&apiKey={self.api_key}"
 
         json_results = self.query_and_parse(url_splits)
 
@@ -318,7 +342,7 @@ class Polygon(stock.StockFetcher):
             Returns
                 dict: stock info.
         """
-        profile_url = f"https://api.polygon.io/v3/reference/tickers/{self.symbol}?apiKey={self.api_key}"
+        profile_url = f"{self.base_url}/v3/reference/tickers/{self.symbol}?apiKey={self.api_key}"
 
         # Get company profile
         results = self.query_and_parse(profile_url)
@@ -4,12 +4,15 @@ The author is Zmicier Gotowka
 
 Distributed under Fcore License 1.1 (see license.md)
 """
-from data.fdata import FdataError, ReadOnlyData, ReadWriteData, BaseFetcher
+from data.fdata import FdataError, ReadOnlyData, ReadWriteData, BaseFetcher, batch_id, split_batch, quote_objects
 from data.fvalues import SecType, ReportPeriod, StockQuotes, Dividends, StockSplits, def_last_date, Sector
 
-from data.futils import get_labelled_ndarray, get_dt
+from data.futils import get_labelled_ndarray, get_dt, add_fields, pack_objects, unpack_objects
+
+import settings
 
 import abc
+import io
 
 import numpy as np
 
@@ -20,6 +23,15 @@ import calendar
 report_quearter = "AND report_tbl.reported_period = (SELECT period_id FROM report_periods where title = 'Quarter')"
 report_year = "AND report_tbl.reported_period = (SELECT period_id FROM report_periods where title = 'Year')"
 
+# Adjusted prices should not be truncated if raw prices are stored as integers
+adj_dtypes = {StockQuotes.AdjOpen: np.float64,
+              StockQuotes.AdjHigh: np.float64,
+              StockQuotes.AdjLow: np.float64,
+              StockQuotes.AdjClose: np.float64,
+              StockQuotes.ExDividends: np.float64,
+              StockQuotes.PayDividends: np.float64,
+              StockQuotes.Splits: np.float64}
+
 class ROStockData(ReadOnlyData):
     """
         The class for read only stock operations and database integrity check for storing stock data.
@@ -288,7 +300,6 @@ class ROStockData(ReadOnlyData):
 
             try:
                 self.cur.execute(insert_sectors)
-                self.commit()
             except self.Error as e:
                 raise FdataError(f"Can't execute a query on a table 'stock_sectors': {e}\n{insert_sectors}") from e
 
@@ -352,6 +363,67 @@ class ROStockData(ReadOnlyData):
             except self.Error as e:
                 raise FdataError(f"Can't create trigger for stock_info: {e}") from e
 
+        # Check if we need to create table 'adjusted_quotes_cache'
+        try:
+            check_adjusted_cache = "SELECT name FROM sqlite_master WHERE type='table' AND name='adjusted_quotes_cache';"
+
+            self.cur.execute(check_adjusted_cache)
+            rows = self.cur.fetchall()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'adjusted_quotes_cache': {e}\n{check_adjusted_cache}") from e
+
+        if len(rows) == 0:
+            create_adjusted_cache = """CREATE TABLE adjusted_quotes_cache (
+                                                cache_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                                symbol_id INTEGER NOT NULL,
+                                                cache_key TEXT NOT NULL UNIQUE,
+                                                first_ts INTEGER NOT NULL,
+                                                last_ts INTEGER NOT NULL,
+                                                quotes BLOB NOT NULL,
+                                                modified INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+                                                    CONSTRAINT fk_symbols
+                                                        FOREIGN KEY (symbol_id)
+                                                        REFERENCES symbols(symbol_id)
+                                                        ON DELETE CASCADE
+                                            );"""
+
+            try:
+                self.cur.execute(create_adjusted_cache)
+            except self.Error as e:
+                raise FdataError(f"Can't create table adjusted_quotes_cache: {e}") from e
+
+            # Create index for adjusted_quotes_cache
+            create_adjusted_cache_idx = "CREATE INDEX idx_adjusted_quotes_cache ON adjusted_quotes_cache(symbol_id, last_ts);"
+
+            try:
+                self.cur.execute(create_adjusted_cache_idx)
+            except self.Error as e:
+                raise FdataError(f"Can't create index for adjusted_quotes_cache table: {e}") from e
+
+            # Create triggers to invalidate the cached adjusted quotes when the data used for the adjustment is changed.
+            # Quotes affect the cached entries which include the changed time stamp. Dividends and splits affect
+            # all the cached entries which end after the event.
+            affected = {'quotes': "first_ts <= {row}.time_stamp AND last_ts >= {row}.time_stamp",
+                        'cash_dividends': "last_ts >= {row}.ex_date",
+                        'stock_splits': "last_ts >= {row}.split_date"}
+
+            for table, condition in affected.items():
+                for event, rows in (('INSERT', ('new', )), ('UPDATE', ('old', 'new')), ('DELETE', ('old', ))):
+                    conditions = " OR ".join([f"(symbol_id = {row}.symbol_id AND {condition.format(row=row)})" for row in rows])
+
+                    create_invalidate_trigger = f"""CREATE TRIGGER invalidate_adjusted_{table}_{event.lower()}
+                                                        AFTER {event}
+                                                            ON {table}
+                                                    BEGIN
+                                                        DELETE FROM adjusted_quotes_cache
+                                                        WHERE {conditions};
+                                                    END;"""
+
+                    try:
+                        self.cur.execute(create_invalidate_trigger)
+                    except self.Error as e:
+                        raise FdataError(f"Can't create trigger for adjusted_quotes_cache: {e}") from e
+
     def get_db_dividends(self, last_ts=def_last_date):
         """
             Get dividends.
@@ -367,6 +439,33 @@ class ROStockData(ReadOnlyData):
         if self.is_connected() is False:
             self.db_connect()
 
+        divs = self._select_dividends([self.get_symbol_id()], last_ts)
+
+        if initially_connected is False:
+            self.db_close()
+
+        return divs
+
+    def _select_dividends(self, symbol_ids, last_ts=def_last_date, batch=False):
+        """
+            Select dividends for the symbols.
+
+            Args:
+                symbol_ids(list): ids of the symbols.
+                last_ts(int): override last time stamp to get data.
+                batch(bool): indicates if the result is requested for multiple symbols (see split_batch()).
+
+            Returns:
+                ndarray: dividends for the symbols or None.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        batch_column = ''
+
+        if batch:
+            batch_column = f", cd.symbol_id AS {batch_id}"
+
         get_divs = f"""SELECT	declaration_date,
                                 ex_date,
                                 record_date,
@@ -374,15 +473,16 @@ class ROStockData(ReadOnlyData):
                                 amount,
                                 (SELECT title FROM currency c WHERE cd.currency_id = c.currency_id) AS currency,
                                 (SELECT title FROM sources s2 WHERE cd.source_id = s2.source_id) AS source
-                            FROM cash_dividends cd INNER JOIN symbols s ON cd.symbol_id = s.symbol_id
-                            WHERE s.ticker = '{self.symbol}'
+                                {batch_column}
+                            FROM cash_dividends cd
+                            WHERE cd.symbol_id IN ({', '.join(['?'] * len(symbol_ids))})
                             AND ex_date >= {self.first_date_ts}
                             AND ex_date <= {last_ts}
-                            AND source_id = (SELECT source_id FROM sources WHERE title = '{self.source_title}')
-                            ORDER BY ex_date;"""
+                            AND source_id = ?
+                            ORDER BY cd.symbol_id, ex_date;"""
 
         try:
-            self.cur.execute(get_divs)
+            self.cur.execute(get_divs, list(symbol_ids) + [self.get_source_id()])
             divs = self.cur.fetchall()
         except self.Error as e:
             raise FdataError(f"Can't obtain cash dividends: {e}\n\nThe query is\n{get_divs}") from e
@@ -392,9 +492,6 @@ class ROStockData(ReadOnlyData):
         else:
             divs = None
 
-        if initially_connected is False:
-            self.db_close()
-
         return divs
 
     def get_db_splits(self, last_ts=def_last_date):
@@ -412,21 +509,47 @@ class ROStockData(ReadOnlyData):
         if self.is_connected() is False:
             self.db_connect()
 
+        splits = self._select_splits([self.get_symbol_id()], last_ts)
+
+        if initially_connected is False:
+            self.db_close()
+
+        return splits
+
+    def _select_splits(self, symbol_ids, last_ts=def_last_date, batch=False):
+        """
+            Select stock splits for the symbols.
+
+            Args:
+                symbol_ids(list): ids of the symbols.
+                last_ts(int): override last time stamp to get data.
+                batch(bool): indicates if the result is requested for multiple symbols (see split_batch()).
+
+            Returns:
+                ndarray: splits for the symbols or None.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        batch_column = ''
+
+        if batch:
+            batch_column = f", ss.symbol_id AS {batch_id}"
+
         get_splits = f"""SELECT	split_date,
 		                        split_ratio,
 		                        (SELECT title FROM sources s2 WHERE ss.source_id = s2.source_id) AS source
-	                        FROM stock_splits ss INNER JOIN symbols s ON ss.symbol_id = s.symbol_id
-	                        WHERE s.ticker = '{self.symbol}'
+                                {batch_column}
+	                        FROM stock_splits ss
+	                        WHERE ss.symbol_id IN ({', '.join(['?'] * len(symbol_ids))})
                             AND split_date >= {self.first_date_ts}
                             AND split_date <= {last_ts}
-                            AND source_id = (SELECT source_id FROM sources WHERE title = '{self.source_title}')
-                            ORDER BY split_date;"""
+                            AND source_id = ?
+                            ORDER BY ss.symbol_id, split_date;"""
 
         try:
-            self.cur.execute(get_splits)
+            self.cur.execute(get_splits, list(symbol_ids) + [self.get_source_id()])
             splits = self.cur.fetchall()
-        except IndexError:
-            self.log(f"No split data for {self.symbol}")
         except self.Error as e:
             raise FdataError(f"Can't obtain split data: {e}\n\nThe query is\n{get_splits}") from e
 
@@ -435,13 +558,18 @@ class ROStockData(ReadOnlyData):
         else:
             splits = None
 
-        if initially_connected is False:
-            self.db_close()
-
         return splits
 
     # TODO MID Think if ignore last date is needed here
-    def get_quotes(self, num=0, columns=None, joins=None, queries=None, ignore_last_date=False, ignore_source=False):
+    def get_quotes(self,
+                   num=0,
+                   columns=None,
+                   joins=None,
+                   queries=None,
+                   ignore_last_date=False,
+                   ignore_source=False,
+                   asof=False,
+                   session=None):
         """
             Get quotes for specified symbol, dates and timespan (if any). Additional columns from other tables
             linked by symbol_id may be requested (like fundamental data)
@@ -453,6 +581,8 @@ class ROStockData(ReadOnlyData):
                 queries(list): additional queries from other tables (like funamental, global economic data).
                 ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
                 ignore_souce(bool): indicates if quotes should be obtained only from a particular source
+                asof(bool): indicates if additional queries should be aligned to quotes by as-of join.
+                session(tuple): the (start, end) session window in HH:MM format in the exchange time zone.
 
             Returns:
                 list: list with quotes data.
@@ -460,6 +590,285 @@ class ROStockData(ReadOnlyData):
             Raises:
                 FdataError: sql error happened.
         """
+        # Only the quotes which do not depend on other tables or the session window may be cached
+        cache_key = None
+
+        if settings.Quotes.adjusted_cache and columns is None and joins is None and queries is None and session is None:
+            cache_key = self._get_cache_key(num, ignore_last_date, ignore_source)
+
+            if cache_key is not None:
+                quotes = self._get_cached_quotes(cache_key)
+
+                if quotes is not None:
+                    return quotes
+
+        if columns is None and joins is None and queries is None:
+            # Adjusted quotes columns are calculated in numpy instead of being queried for each row
+            quotes = super().get_quotes(num=num,
+                                        ignore_last_date=ignore_last_date,
+                                        ignore_source=ignore_source,
+                                        session=session)
+
+            if quotes is not None:
+                quotes = self._add_adj_fields(quotes)
+        else:
+            quotes = super().get_quotes(num=num,
+                                        columns=self._get_adj_columns(columns),
+                                        joins=joins,
+                                        queries=queries,
+                                        ignore_last_date=ignore_last_date,
+                                        ignore_source=ignore_source,
+                                        asof=asof,
+                                        dtypes=adj_dtypes,
+                                        session=session)
+
+        if quotes is None:
+            return
+
+        # Calculate the adjusted close price.
+
+        last_ts = quotes[StockQuotes.TimeStamp][-1]
+
+        # Get all dividend data
+        divs = self.get_db_dividends(last_ts=last_ts)
+
+        # Get all split data
+        splits = self.get_db_splits(last_ts=last_ts)
+
+        quotes = self._adjust_quotes(quotes, divs, splits)
+
+        if cache_key is not None:
+            self._cache_quotes(cache_key, quotes, ignore_last_date)
+
+        return quotes
+
+    def _get_cache_key(self, num, ignore_last_date, ignore_source):
+        """
+            Get the key of the cached adjusted quotes for the current symbol, source, timespan and dates.
+
+            Args:
+                num(int): the number of rows to get.
+                ignore_last_date(bool): indicates if last date should be ignored.
+                ignore_souce(bool): indicates if quotes should be obtained only from a particular source.
+
+            Returns:
+                str: the cache key or None if the symbol is not in the database.
+        """
+        symbol_id = self.get_symbol_id()
+
+        if symbol_id is None:
+            return None
+
+        source_id = '*'
+
+        if ignore_source is False:
+            source_id = self.get_source_id()
+
+        first_ts, last_ts = self._get_cache_range(ignore_last_date)
+
+        return f"{symbol_id}:{source_id}:{self.timespan}:{first_ts}:{last_ts}:{num}"
+
+    def _get_cache_range(self, ignore_last_date):
+        """
+            Get the range of the quotes query. Changes of the quotes in this range invalidate the cached entry.
+
+            Args:
+                ignore_last_date(bool): indicates if last date should be ignored.
+
+            Returns:
+                tuple(int, int): the first and the last time stamps of the query.
+        """
+        # The same bound is used in the quotes query as EOD quotes have 23:59:59 time
+        last_ts = calendar.timegm(self.set_eod_time(self.last_date).utctimetuple())
+
+        if ignore_last_date:
+            last_ts = def_last_date
+
+        return (self.first_date_ts, last_ts)
+
+    def _get_cached_quotes(self, cache_key):
+        """
+            Get the cached adjusted quotes.
+
+            Args:
+                cache_key(str): the key of the cached quotes.
+
+            Returns:
+                ndarray: the cached adjusted quotes or None if the quotes are not cached.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        get_cached = "SELECT quotes FROM adjusted_quotes_cache WHERE cache_key = ?;"
+
+        try:
+            self.cur.execute(get_cached, (cache_key, ))
+            row = self.cur.fetchone()
+        except self.Error as e:
+            raise FdataError(f"Can't execute a query on a table 'adjusted_quotes_cache': {e}\n{get_cached}") from e
+
+        if row is None:
+            return None
+
+        try:
+            quotes = np.load(io.BytesIO(row[0]), allow_pickle=False)
+        except ValueError:
+            # The entry is written by the previous version with pickled object columns
+            return None
+
+        return unpack_objects(quotes, quote_objects)
+
+    def _cache_quotes(self, cache_key, quotes, ignore_last_date):
+        """
+            Put the adjusted quotes to the cache.
+
+            Args:
+                cache_key(str): the key of the cached quotes.
+                quotes(ndarray): the adjusted quotes.
+                ignore_last_date(bool): indicates if last date was ignored in the query.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        first_ts, last_ts = self._get_cache_range(ignore_last_date)
+
+        # Object columns (like date_time) are stored as fixed-width values to avoid pickling
+        data = io.BytesIO()
+        np.save(data, pack_objects(quotes), allow_pickle=False)
+
+        insert_cached = """INSERT OR REPLACE INTO adjusted_quotes_cache (symbol_id, cache_key, first_ts, last_ts, quotes)
+                            VALUES (?, ?, ?, ?, ?);"""
+
+        self.database.begin()
+
+        try:
+            self.cur.execute(insert_cached, (self.get_symbol_id(), cache_key, first_ts, last_ts, data.getvalue()))
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't add a record to a table 'adjusted_quotes_cache': {e}\n{insert_cached}") from e
+
+        # Evict the oldest entries. Ids are increasing as the replaced entries get the new ids.
+        evict_cached = """DELETE FROM adjusted_quotes_cache
+                            WHERE cache_id <= (SELECT MAX(cache_id) FROM adjusted_quotes_cache) - ?;"""
+
+        try:
+            self.cur.execute(evict_cached, (settings.Quotes.adjusted_cache_size, ))
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't execute a query on a table 'adjusted_quotes_cache': {e}\n{evict_cached}") from e
+
+        self.database.release()
+
+    def clear_quotes_cache(self):
+        """
+            Remove all the cached adjusted quotes from the database.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self.check_if_connected()
+
+        clear_cached = "DELETE FROM adjusted_quotes_cache;"
+
+        self.database.begin()
+
+        try:
+            self.cur.execute(clear_cached)
+        except self.Error as e:
+            self.database.rollback()
+            raise FdataError(f"Can't execute a query on a table 'adjusted_quotes_cache': {e}\n{clear_cached}") from e
+
+        self.database.release()
+
+    def get_quotes_batch(self,
+                         symbols,
+                         columns=None,
+                         joins=None,
+                         ignore_last_date=False,
+                         ignore_source=False,
+                         dtypes=None):
+        """
+            Get adjusted quotes for multiple symbols using the current dates, timespan and source.
+
+            Quotes, dividends and splits for all the symbols are obtained by one query each.
+
+            Args:
+                symbols(list): symbols to get quotes for.
+                columns(list): additional columns to query.
+                joins(list): additional joins to get data from other tables.
+                ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
+                ignore_souce(bool): indicates if quotes should be obtained only from a particular source
+                dtypes(dict): declared dtypes of additional columns. Otherwise dtypes are inferred from the first row.
+
+            Returns:
+                dict: labelled arrays with quotes by symbols (None if no quotes for a symbol).
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        # Adjusted quotes columns are calculated in numpy instead of being queried for each row
+        result = super().get_quotes_batch(symbols=symbols,
+                                          columns=columns,
+                                          joins=joins,
+                                          ignore_last_date=ignore_last_date,
+                                          ignore_source=ignore_source,
+                                          dtypes=dtypes)
+
+        for symbol, quotes in result.items():
+            if quotes is not None:
+                result[symbol] = self._add_adj_fields(quotes)
+
+        # Ids of the symbols which have quotes
+        symbol_ids = {symbol_id: symbol for symbol, symbol_id in self.get_symbol_ids(symbols).items()
+                      if result[symbol] is not None}
+
+        if len(symbol_ids) == 0:
+            return result
+
+        last_ts = max(result[symbol][StockQuotes.TimeStamp][-1] for symbol in symbol_ids.values())
+
+        all_divs = split_batch(self._select_dividends(symbol_ids.keys(), last_ts=last_ts, batch=True))
+        all_splits = split_batch(self._select_splits(symbol_ids.keys(), last_ts=last_ts, batch=True))
+
+        for symbol_id, symbol in symbol_ids.items():
+            quotes = result[symbol]
+            last_ts = quotes[StockQuotes.TimeStamp][-1]
+
+            # Keep only the data within the quotes of the symbol (the same as for a single symbol query)
+            divs = all_divs.get(symbol_id)
+
+            if divs is not None:
+                divs = divs[divs[Dividends.ExDate] <= last_ts]
+
+                if len(divs) == 0:
+                    divs = None
+
+            splits = all_splits.get(symbol_id)
+
+            if splits is not None:
+                splits = splits[splits[StockSplits.Date] <= last_ts]
+
+                if len(splits) == 0:
+                    splits = None
+
+            result[symbol] = self._adjust_quotes(quotes, divs, splits, symbol=symbol)
+
+        return result
+
+    def _get_adj_columns(self, columns):
+        """
+            Get the list of additional columns with the columns for adjusted quotes.
+
+            Args:
+                columns(list): additional columns requested by the caller.
+
+            Returns:
+                list: additional columns including the adjusted quotes columns.
+        """
         if isinstance(columns, list) is False:
             columns = []
 
@@ -472,25 +881,54 @@ class ROStockData(ReadOnlyData):
         columns.append('0.0 AS divs_pay')
         columns.append('1.0 AS splits')
 
-        quotes = super().get_quotes(num=num,
-                                    columns=columns,
-                                    joins=joins,
-                                    queries=queries,
-                                    ignore_last_date=ignore_last_date,
-                                    ignore_source=ignore_source)
+        return columns
 
-        if quotes is None:
-            return
+    def _add_adj_fields(self, quotes):
+        """
+            Add the columns for adjusted quotes (the same as obtained by the columns from _get_adj_columns).
 
-        # Calculate the adjusted close price.
+            Args:
+                quotes(ndarray): quotes without the adjusted quotes columns.
 
-        last_ts = quotes[StockQuotes.TimeStamp][-1]
+            Returns:
+                ndarray: the new array with the adjusted quotes columns.
+        """
+        return add_fields(quotes, [(StockQuotes.AdjOpen, quotes[StockQuotes.Open].astype(np.float64)),
+                                   (StockQuotes.AdjHigh, quotes[StockQuotes.High].astype(np.float64)),
+                                   (StockQuotes.AdjLow, quotes[StockQuotes.Low].astype(np.float64)),
+                                   (StockQuotes.AdjClose, quotes[StockQuotes.Close].astype(np.float64)),
+                                   (StockQuotes.AdjVolume, quotes[StockQuotes.Volume]),
+                                   (StockQuotes.ExDividends, np.zeros(len(quotes))),
+                                   (StockQuotes.PayDividends, np.zeros(len(quotes))),
+                                   (StockQuotes.Splits, np.ones(len(quotes)))])
+
+    def _adjust_quotes(self, quotes, divs, splits, symbol=None):
+        """
+            Adjust quotes for dividends and splits and trim the quotes to the last date.
 
-        # Get all dividend data
-        divs = self.get_db_dividends(last_ts=last_ts)
+            Args:
+                quotes(ndarray): quotes with the adjusted quotes columns.
+                divs(ndarray): dividends for the symbol (or None).
+                splits(ndarray): splits for the symbol (or None).
+                symbol(str): the symbol of the quotes. The current symbol is used if None.
 
-        # Get all split data
-        splits = self.get_db_splits(last_ts=last_ts)
+            Returns:
+                ndarray: adjusted quotes.
+        """
+        if symbol is None:
+            symbol = self.symbol
+
+        ts = quotes[StockQuotes.TimeStamp]
+        length = len(quotes)
+
+        # Adjustment factors of the events. An event at index idx adjusts all the quotes before idx. Factors are
+        # accumulated at the event indexes and the reverse cumulative product gives the factor of each quote.
+        # The last element is used for events which are out of the quotes range (they do not adjust anything).
+        price_factors = {column: np.ones(length + 1) for column in (StockQuotes.AdjOpen,
+                                                                     StockQuotes.AdjHigh,
+                                                                     StockQuotes.AdjLow,
+                                                                     StockQuotes.AdjClose)}
+        volume_factors = np.ones(length + 1)
 
         # TODO MID Find out why adjustment precision is a bit less than expected
         # Adjust the price for dividends
@@ -507,76 +945,55 @@ class ROStockData(ReadOnlyData):
                 divs[Dividends.PaymentDate] = np.nan
                 divs[Dividends.PaymentDate] = divs[Dividends.ExDate] + 604800  # Add 7 days to ex_date to estimate a payment date
 
-            for i in range(len(divs)):
-                idx_ex = np.searchsorted(quotes[StockQuotes.TimeStamp], [divs[Dividends.ExDate][i], ], side='right')[0]
+            amounts = divs[Dividends.Amount].astype(float)
 
-                amount = divs[Dividends.Amount][i]
+            # Dividends which are out of the requested quotes range are skipped
+            idx_ex = np.searchsorted(ts, divs[Dividends.ExDate].astype(float), side='right')
+            in_range = idx_ex < length
 
-                try:
-                    quotes[StockQuotes.ExDividends][idx_ex] = amount
+            quotes[StockQuotes.ExDividends][idx_ex[in_range]] = amounts[in_range]
 
-                    opened = quotes[StockQuotes.Open][idx_ex]
-                    high = quotes[StockQuotes.High][idx_ex]
-                    low = quotes[StockQuotes.Low][idx_ex]
-                    closed = quotes[StockQuotes.Close][idx_ex]
+            for column, price in ((StockQuotes.AdjOpen, StockQuotes.Open),
+                                  (StockQuotes.AdjHigh, StockQuotes.High),
+                                  (StockQuotes.AdjLow, StockQuotes.Low),
+                                  (StockQuotes.AdjClose, StockQuotes.Close)):
+                prices = quotes[price][idx_ex[in_range]].astype(float)
 
-                    o_ratio = 1
-                    h_ratio = 1
-                    l_ratio = 1
-                    c_ratio = 1
+                # In some cases the values may be 0. Need to skip such cases.
+                ratios = 1 - np.divide(amounts[in_range], prices, out=np.zeros(len(prices)), where=prices != 0)
 
-                    # In some cases the values may be 0. Need to skip such cases.
-                    if opened:
-                        o_ratio -= amount / opened
+                np.multiply.at(price_factors[column], idx_ex[in_range], ratios)
 
-                    if high:
-                        h_ratio -= amount / high
+            idx_pay = np.searchsorted(ts, divs[Dividends.PaymentDate].astype(float), side='right')
+            in_range = idx_pay < length
 
-                    if low:
-                        l_ratio -= amount / low
+            # Payments which haven't happened in the current stock history are skipped
+            quotes[StockQuotes.PayDividends][idx_pay[in_range]] = amounts[in_range]
+        else:
+            self.log(f"Warning: No dividend data for {symbol} in the requested period.")
 
-                    if closed:
-                        c_ratio -= amount / closed
+        # Adjust the price to stock splits
+        if splits is not None:
+            ratios = splits[StockSplits.Ratio].astype(float)
 
-                    quotes[StockQuotes.AdjOpen][:idx_ex] = quotes[StockQuotes.AdjOpen][:idx_ex] * o_ratio
-                    quotes[StockQuotes.AdjHigh][:idx_ex] = quotes[StockQuotes.AdjHigh][:idx_ex] * h_ratio
-                    quotes[StockQuotes.AdjLow][:idx_ex] = quotes[StockQuotes.AdjLow][:idx_ex] * l_ratio
-                    quotes[StockQuotes.AdjClose][:idx_ex] = quotes[StockQuotes.AdjClose][:idx_ex] * c_ratio
-                except IndexError:
-                    pass
-                    # No need to do anything - just requested quote data is shorter than available dividend data
+            # Splits which are out of the requested quotes range are skipped
+            idx_split = np.searchsorted(ts, splits[StockSplits.Date].astype(float), side='right')
+            in_range = idx_split < length
 
-                idx_pay = np.searchsorted(quotes[StockQuotes.TimeStamp], [divs[Dividends.PaymentDate][i], ], side='right')[0]
+            quotes[StockQuotes.Splits][idx_split[in_range]] = ratios[in_range]
 
-                try:
-                    quotes[StockQuotes.PayDividends][idx_pay] = amount
-                except IndexError:
-                    pass
-                    # No need to do anything as just payment haven't happened in the current stock history
-        else:
-            self.log(f"Warning: No dividend data for {self.symbol} in the requested period.")
+            for column in price_factors:
+                np.divide.at(price_factors[column], idx_split[in_range], ratios[in_range])
 
-        # Adjust the price to stock splits
-        if splits is not None:
-            for i in range(len(splits)):
-                idx_split = np.searchsorted(quotes[StockQuotes.TimeStamp], [splits[StockSplits.Date][i], ], side='right')[0]
-
-                try:
-                    ratio = splits[StockSplits.Ratio][i]
-                    quotes[StockQuotes.Splits][idx_split] = ratio
-
-                    if ratio != 1:
-                        # TODO LOW Think if such approach may be dangerous (whe value assigned to the copy of the array)
-                        quotes[StockQuotes.AdjOpen][:idx_split] = quotes[StockQuotes.AdjOpen][:idx_split] / ratio
-                        quotes[StockQuotes.AdjHigh][:idx_split] = quotes[StockQuotes.AdjHigh][:idx_split] / ratio
-                        quotes[StockQuotes.AdjLow][:idx_split] = quotes[StockQuotes.AdjLow][:idx_split] / ratio
-                        quotes[StockQuotes.AdjClose][:idx_split] = quotes[StockQuotes.AdjClose][:idx_split] / ratio
-                        quotes[StockQuotes.AdjVolume][:idx_split] = quotes[StockQuotes.AdjVolume][:idx_split] * ratio
-                except IndexError:
-                    # No need to do anything - just requested quote data is shorter than available split data
-                    pass
+            np.multiply.at(volume_factors, idx_split[in_range], ratios[in_range])
         else:
-            self.log(f"Warning: No split data for {self.symbol} in the requested period.")
+            self.log(f"Warning: No split data for {symbol} in the requested period.")
+
+        # Factor of a quote is the product of factors of all the events after it
+        for column, factors in price_factors.items():
+            quotes[column] = quotes[column] * np.cumprod(factors[::-1])[::-1][1:]
+
+        quotes[StockQuotes.AdjVolume] = quotes[StockQuotes.AdjVolume] * np.cumprod(volume_factors[::-1])[::-1][1:]
 
         last_date_ts = calendar.timegm(self.set_eod_time(self.last_date).utctimetuple())
 
@@ -648,8 +1065,8 @@ class RWStockData(ROStockData, ReadWriteData):
         except self.Error as e:
             raise FdataError(f"Can't execute a query to update intervals: {e}\n{get_columns}") from e
 
-        condition = f"""WHERE symbol_id = (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}')
-                        AND source_id = (SELECT source_id FROM sources WHERE title = '{self.source_title}')"""
+        condition = """WHERE symbol_id = :symbol_id
+                        AND source_id = :source_id"""
 
         to_insert = ''
         values = ''
@@ -661,8 +1078,8 @@ class RWStockData(ROStockData, ReadWriteData):
         now = self.current_ts(adjusted=False)
 
         update_intervals = f"""INSERT OR REPLACE INTO {table} (symbol_id, source_id, {to_insert} {column})
-                                VALUES ((SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                        (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
+                                VALUES (:symbol_id,
+                                        :source_id,
                                         {values}
                                         (SELECT ifnull(
                                                         (SELECT max({column}, {now})
@@ -671,12 +1088,18 @@ class RWStockData(ROStockData, ReadWriteData):
                                                 ), {now}))
                             );"""
 
+        params = {'symbol_id': self.get_symbol_id(), 'source_id': self.get_source_id()}
+
+        self.database.begin()
+
         try:
-            self.cur.execute(update_intervals)
-            self.conn.commit()
+            self.cur.execute(update_intervals, params)
         except self.Error as e:
+            self.database.rollback()
             raise FdataError(f"Can't execute a query to update intervals: {e}\n{update_intervals}") from e
 
+        self.database.release()
+
     def _get_requested_ts(self, column, table, period=None):
         """
             Get the timestamp of a particular data entry for varios stock data entries.
@@ -703,12 +1126,12 @@ class RWStockData(ROStockData, ReadWriteData):
             period_query = f"AND reported_period = (SELECT period_id FROM report_periods WHERE title='{period}')"
 
         query_requested_ts = f"""SELECT MAX({column}) FROM {table}
-                                WHERE symbol_id = (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}')
-                                AND source_id = (SELECT source_id FROM sources WHERE title = '{self.source_title}')
+                                WHERE symbol_id = ?
+                                AND source_id = ?
                                 {period_query};"""
 
         try:
-            self.cur.execute(query_requested_ts)
+            self.cur.execute(query_requested_ts, (self.get_symbol_id(), self.get_source_id()))
             result = self.cur.fetchone()[0]
         except self.Error as e:
             raise FdataError(f"Can't execute a query on a table '{table}': {e}\n{query_requested_ts}") from e
@@ -729,16 +1152,17 @@ class RWStockData(ROStockData, ReadWriteData):
             Return:
                 int: fiscal date ending timestamp.
         """
-        return self._get_requested_ts(column='fiscal_date_ending', table=table, period=period)
+        return self._get_requested_ts(column='fiscalDate', table=table, period=period)
 
-    def need_to_update(self, modified_ts, table=None):
+    def need_to_update(self, modified_ts, table=None, fiscal_ts=None):
         """
             Check if we need to update data in the table.
 
             Args:
                 table(str): table to perform the check.
                 modified_ts(int): the timestamp of last data request.
-                funadamental(bool): indicates if fundamental data should be checked as well.
+                fiscal_ts(tuple): fiscal date ending timestamps of the last annual, any and quarterly reports
+                                  in the table if they are already obtained.
 
             Returns:
                 bool: indicates if update is needed.
@@ -761,16 +1185,27 @@ class RWStockData(ROStockData, ReadWriteData):
 
         # Check fundamental data if needed
         if table is not None:
+            if fiscal_ts is None:
+                fiscal_ts = (self.get_fiscal_date_ending(table, ReportPeriod.Year),
+                             self.get_fiscal_date_ending(table, ReportPeriod.All),
+                             self.get_fiscal_date_ending(table, ReportPeriod.Quarter))
+
+            # Reports are not obtained yet
+            if None in fiscal_ts:
+                return True
+
+            year_ts, all_ts, quarter_ts = fiscal_ts
+
             # Need to check reports if the difference between the current date and the last annual fiscal date ending
             # is more than a year.
-            if relativedelta(current, get_dt(self.get_fiscal_date_ending(table, ReportPeriod.Year))).years > 0:
+            if relativedelta(current, get_dt(year_ts)).years > 0:
                 return True
 
             # Need to recheck reports if the difference between any report is more than 3 months
             # and 6 months for the third quarter report as some companies do not issue the 4-th quarter report.
-            months_delta = relativedelta(current, get_dt(self.get_fiscal_date_ending(table, ReportPeriod.All))).months
+            months_delta = relativedelta(current, get_dt(all_ts)).months
 
-            if get_dt(self.get_fiscal_date_ending(table, ReportPeriod.Quarter)).month != 9:
+            if get_dt(quarter_ts).month != 9:
                 return months_delta >= 3
             else:
                 return months_delta >= 6
@@ -827,6 +1262,8 @@ class RWStockData(ROStockData, ReadWriteData):
 
         num_before = self.get_dividends_num()
 
+        self.database.begin()
+
         for div in divs:
             insert_dividends = f"""INSERT OR {self._update} INTO cash_dividends (symbol_id,
                                         source_id,
@@ -837,8 +1274,8 @@ class RWStockData(ROStockData, ReadWriteData):
 										payment_date,
                                         amount)
 									VALUES (
-											(SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
+											({self.get_symbol_id()}),
+                                            ({self.get_source_id()}),
                                             (SELECT currency_id FROM currency WHERE title = '{div['currency']}'),
 											{div['decl_ts']},
 											{div['ex_ts']},
@@ -849,9 +1286,10 @@ class RWStockData(ROStockData, ReadWriteData):
             try:
                 self.cur.execute(insert_dividends)
             except self.Error as e:
+                self.database.rollback()
                 raise FdataError(f"Can't add a record to a table 'dividends': {e}\n\nThe query is\n{insert_dividends}") from e
 
-        self.commit()
+        self.database.release()
 
         self._update_intervals('div_max_ts', 'stock_intervals')
 
@@ -878,23 +1316,26 @@ class RWStockData(ROStockData, ReadWriteData):
 
         num_before = self.get_split_num()
 
+        self.database.begin()
+
         for split in splits:
             insert_splits = f"""INSERT OR {self._update} INTO stock_splits (symbol_id,
                                         source_id,
 										split_date,
                                         split_ratio)
 									VALUES (
-											(SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
+											({self.get_symbol_id()}),
+                                            ({self.get_source_id()}),
 											{split['ts']},
 											{split['split_ratio']});"""
 
             try:
                 self.cur.execute(insert_splits)
             except self.Error as e:
+                self.database.rollback()
                 raise FdataError(f"Can't add a record to a table 'dividends': {e}\n\nThe query is\n{insert_splits}") from e
 
-        self.commit()
+        self.database.release()
 
         self._update_intervals('split_max_ts', 'stock_intervals')
 
@@ -928,23 +1369,26 @@ class RWStockData(ROStockData, ReadWriteData):
                                         source_id,
                                         stock_sector_id)
                                     VALUES (
-                                            (SELECT symbol_id FROM symbols WHERE ticker = '{self.symbol}'),
-                                            (SELECT source_id FROM sources WHERE title = '{self.source_title}'),
+                                            ({self.get_symbol_id()}),
+                                            ({self.get_source_id()}),
                                             (SELECT stock_sector_id FROM stock_sectors WHERE title = '{sector}')
                                         );"""
 
+            self.database.begin()
+
             try:
                 self.cur.execute(insert_info)
             except self.Error as e:
+                self.database.rollback()
                 raise FdataError(f"Can't add a record to a table 'stock_info': {e}\n\nThe query is\n{insert_info}") from e
 
-            self.commit()
+            self.database.release()
 
 class StockFetcher(RWStockData, BaseFetcher, metaclass=abc.ABCMeta):
     """
         Abstract class to fetch quotes by API wrapper and add them to the database.
     """
-    def get(self, num=0, columns=None, joins=None, queries=None, ignore_last_date=False):
+    def get(self, num=0, columns=None, joins=None, queries=None, ignore_last_date=False, asof=False, session=None):
         """
             Get stock quotes, divs and splits data if needed.
 
@@ -954,6 +1398,8 @@ class StockFetcher(RWStockData, BaseFetcher, metaclass=abc.ABCMeta):
                 joins(list): additional joins to get data from other tables.
                 queries(list): additional queries from other tables (like funamental, global economic data).
                 ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
+                asof(bool): indicates if additional queries should be aligned to quotes by as-of join.
+                session(tuple): the (start, end) session window in HH:MM format in the exchange time zone.
 
             Returns:
                 array: the fetched quote entries.
@@ -965,7 +1411,126 @@ class StockFetcher(RWStockData, BaseFetcher, metaclass=abc.ABCMeta):
         else:
             self.log(f"Warning! Security type is not stock or ETF ({self.get_sectype()}) so split/dividend data is not obtained.")
 
-        return super().get(num=num, columns=columns, joins=joins, queries=queries, ignore_last_date=ignore_last_date)
+        return super().get(num=num,
+                           columns=columns,
+                           joins=joins,
+                           queries=queries,
+                           ignore_last_date=ignore_last_date,
+                           asof=asof,
+                           session=session)
+
+    def get_batch(self, symbols, columns=None, joins=None, ignore_last_date=False):
+        """
+            Get stock quotes, divs and splits data for multiple symbols using the current dates, timespan and source.
+
+            The freshness of the data for all the symbols is checked by a single query. Data is fetched only for the
+            symbols which need it, then quotes for all the symbols are obtained by a few set-based queries.
+
+            Args:
+                symbols(list): symbols to get quotes for.
+                columns(list): additional columns to query.
+                joins(list): additional joins to get data from other tables.
+                ignore_last_date(bool): indicates if last date should be ignored (all recent history is obtained)
+
+            Returns:
+                dict: labelled arrays with quotes by symbols (None if no quotes for a symbol).
+        """
+        initially_connected = self.is_connected()
+
+        if self.is_connected() is False:
+            self.db_connect()
+
+        for symbol in self.get_stale_symbols(symbols):
+            # Use a copy of the instance to keep the settings and the connection but not the cached symbol data
+            self.clone(symbol).fetch_missing_data()
+
+        # New symbols may be added by other instances
+        self.reset_ids('symbols')
+
+        result = self.get_quotes_batch(symbols, columns=columns, joins=joins, ignore_last_date=ignore_last_date)
+
+        if initially_connected is False:
+            self.db_close()
+
+        return result
+
+    def _get_fetch_jobs(self, stale=None):
+        """
+            Get the jobs to fetch the missing dividends and splits of the current symbol concurrently.
+            Splits are added before fetching quotes as some data sources need them for reverse-adjustment.
+
+            Args:
+                stale(set): the tables which data is stale according to the refresh plan. If None, the freshness
+                            of each data is checked separately.
+
+            Returns:
+                list: prerequisite jobs which results should be added before fetching quotes.
+                list: other jobs.
+        """
+        prerequisites, jobs = super()._get_fetch_jobs(stale)
+
+        if self.get_sectype() in (SecType.Stock, SecType.ETF):
+            if stale is None:
+                need_splits = self.need_to_update(modified_ts=self._get_requested_ts('split_max_ts', 'stock_intervals'))
+                need_divs = self.need_to_update(modified_ts=self._get_requested_ts('div_max_ts', 'stock_intervals'))
+            else:
+                need_splits = 'stock_splits' in stale
+                need_divs = 'cash_dividends' in stale
+
+            if need_splits:
+                prerequisites.append((self.fetch_splits, self.add_splits))
+
+            if need_divs:
+                jobs.append((self.fetch_dividends, self.add_dividends))
+        else:
+            self.log(f"Warning! Security type is not stock or ETF ({self.get_sectype()}) so split/dividend data is not obtained.")
+
+        return (prerequisites, jobs)
+
+    def _get_refresh_columns(self):
+        """
+            Get the columns of the query which obtains the state of the data of multiple symbols for the refresh plan
+            including dividends, splits and the security type.
+
+            Returns:
+                list: the columns of the query.
+        """
+        return super()._get_refresh_columns() + [
+                    """(SELECT MAX(div_max_ts) FROM stock_intervals si
+                        WHERE si.symbol_id = s.symbol_id AND si.source_id = :source_id) AS div_max_ts""",
+                    """(SELECT MAX(split_max_ts) FROM stock_intervals si
+                        WHERE si.symbol_id = s.symbol_id AND si.source_id = :source_id) AS split_max_ts""",
+                    """(SELECT st.title FROM sec_info i INNER JOIN sectypes st ON i.sec_type_id = st.sec_type_id
+                        WHERE i.symbol_id = s.symbol_id) AS sec_type"""]
+
+    def _get_stale_data(self, row):
+        """
+            Get the stale data of a symbol (including dividends and splits) using the state obtained by the refresh
+            plan query.
+
+            Args:
+                row(sqlite3.Row): the state of the symbol data.
+
+            Returns:
+                set: the tables which data is stale or None if the staleness can't be determined by the state.
+        """
+        stale = super()._get_stale_data(row)
+
+        if stale is None or self._sec_info_supported is False:
+            return stale
+
+        # Security info is not obtained yet
+        if row['sec_type'] is None:
+            return None
+
+        if row['sec_type'] in (SecType.Stock, SecType.ETF):
+            if self.need_to_update(row['div_max_ts']):
+                stale.add('cash_dividends')
+
+            if self.need_to_update(row['split_max_ts']):
+                stale.add('stock_splits')
+
+        return stale
 
     def get_quotes_only(self):
         """
@@ -1004,11 +1569,10 @@ class StockFetcher(RWStockData, BaseFetcher, metaclass=abc.ABCMeta):
 
             # Just sector title is used from info for now
             info_query = f"""SELECT title FROM stock_sectors WHERE stock_sector_id =
-                                (SELECT stock_sector_id FROM stock_info WHERE symbol_id =
-                                    (SELECT symbol_id FROM symbols WHERE ticker='{self.symbol}'))"""
+                                (SELECT stock_sector_id FROM stock_info WHERE symbol_id = ?)"""
 
             try:
-                self.cur.execute(info_query)
+                self.cur.execute(info_query, (self.get_symbol_id(), ))
                 row = self.cur.fetchone()[0]
             except self.Error as e:
                 raise FdataError(f"Can't execute a query on a table 'stock_info': {e}\n{info_query}") from e
@@ -0,0 +1,572 @@
+"""Synthetic data source for offline benchmarking and testing.
+
+The author is Zmicier Gotowka
+
+Distributed under Fcore License 1.1 (see license.md)
+"""
+from collections import defaultdict
+from datetime import datetime, date
+from dateutil import tz
+
+import zlib
+import math
+
+import numpy as np
+
+from data import fmp
+from data.fvalues import Timespans, SecType, sector_titles, trading_days_per_year
+from data.fdata import FdataError
+from data.futils import get_labelled_ndarray
+
+# The earliest possible listing date of a synthetic symbol
+base_date = date(1990, 1, 1)
+
+# Intraday session (UTC) and its length in minutes
+session_start = 14 * 3600 + 30 * 60
+session_minutes = 390
+
+# Bar length in minutes for intraday timespans
+timespan_minutes = {
+    Timespans.Minute: 1,
+    Timespans.TwoMinutes: 2,
+    Timespans.FiveMinutes: 5,
+    Timespans.TenMinutes: 10,
+    Timespans.FifteenMinutes: 15,
+    Timespans.TwentyMinutes: 20,
+    Timespans.ThirtyMinutes: 30,
+    Timespans.Hour: 60,
+    Timespans.NinetyMinutes: 90,
+    Timespans.FourHour: 240
+}
+
+# Random streams of the model. Each stream is generated from the listing date, so the history is the same
+# regardless of the requested interval.
+_params_stream = 0
+_returns_stream = 1
+_gaps_stream = 2
+_ranges_stream = 3
+_volumes_stream = 4
+_ratios_stream = 5
+_reports_stream = 6
+_intraday_stream = 7
+
+def get_synthetic_symbols(num, prefix='SYN'):
+    """
+        Get the list of symbols for the synthetic data source.
+
+        Args:
+            num(int): the number of symbols.
+            prefix(str): the prefix of symbols.
+
+        Returns:
+            list: the symbols.
+    """
+    width = len(str(max(num - 1, 0)))
+
+    return [f"{prefix}{i:0{width}d}" for i in range(num)]
+
+class Synthetic(fmp.FmpStock):
+    """
+        Synthetic data source which generates deterministic data for any symbol.
+
+        Daily prices follow the geometric Brownian motion with the parameters derived from the seed and the symbol.
+        Intraday bars (down to minute bars) are generated by the Brownian bridge between the daily opens and closes.
+        Dividends, splits, info, fundamental reports, capitalization and earnings surprises are generated as well.
+
+        The data is stored in the same tables as FMP data, so the tools and backtests which use FMP data may be
+        driven by this source without network access.
+    """
+    def __init__(self, seed=0, **kwargs):
+        """
+            Initialize the instance of Synthetic class.
+
+            Args:
+                seed(int): the seed of the generated data.
+        """
+        super().__init__(**kwargs)
+
+        self.source_title = "Synthetic"
+        self.seed = seed
+
+        # No API is used
+        self.api_key = None
+        self.max_queries = None
+
+    def _get_rng(self, stream, *keys):
+        """
+            Get the random numbers generator for the current symbol.
+
+            Args:
+                stream(int): the stream of the model.
+                keys(int): additional keys of the stream.
+
+            Returns:
+                numpy.random.Generator: the generator.
+        """
+        return np.random.default_rng([self.seed, zlib.crc32(self.symbol.encode()), stream, *keys])
+
+    def _get_params(self):
+        """
+            Get the parameters of the model for the current symbol.
+
+            Returns:
+                dict: the parameters.
+        """
+        rng = self._get_rng(_params_stream)
+
+        params = {
+            'listing_day': (base_date - date(1970, 1, 1)).days + int(rng.integers(0, 20 * 365)),
+            'price': math.exp(rng.uniform(math.log(5), math.log(120))),
+            'mu': rng.normal(0.08, 0.04),
+            'sigma': rng.uniform(0.15, 0.45),
+            'shares': math.exp(rng.uniform(math.log(1e7), math.log(5e9))),
+            'turnover': rng.uniform(0.002, 0.02),
+            'div_yield': rng.uniform(0.005, 0.05) if rng.random() < 0.5 else 0.0,
+            'split_price': rng.uniform(150, 500),
+            'ps_ratio': rng.uniform(0.5, 8),
+            'margin': rng.uniform(-0.05, 0.3),
+            'sector': sector_titles[int(rng.integers(0, len(sector_titles)))]
+        }
+
+        return params
+
+    def _get_history(self, last_day=None):
+        """
+            Generate the daily history of the current symbol from the listing date.
+
+            Args:
+                last_day(int): the last day (days since epoch) to generate. The current day is used if None.
+
+            Returns:
+                dict: arrays of days, unadjusted OHLC, volumes, shares, dividend amounts and split ratios.
+        """
+        params = self._get_params()
+
+        today = int(datetime.now(tz.UTC).timestamp()) // 86400
+
+        if last_day is None or last_day > today:
+            last_day = today
+
+        days = np.arange(params['listing_day'], max(last_day + 1, params['listing_day']))
+        days = days[(days + 3) % 7 < 5]  # 1970-01-01 is Thursday. Keep business days only.
+
+        n = len(days)
+        sigma_d = params['sigma'] / math.sqrt(trading_days_per_year)
+
+        returns = (params['mu'] - params['sigma'] ** 2 / 2) / trading_days_per_year + \
+                  sigma_d * self._get_rng(_returns_stream).standard_normal(n)
+        returns[:1] = 0
+
+        # Quarterly dividends
+        divs = np.zeros(n, dtype=bool)
+
+        if params['div_yield'] > 0:
+            divs[31::63] = True
+
+        q = params['div_yield'] / 4
+
+        log_closes = math.log(params['price']) + np.cumsum(returns + np.where(divs, math.log(1 - q), 0))
+
+        # Split the stock when the price exceeds the threshold. Reverse split it when the price is too low.
+        ratios = np.ones(n)
+        split_ratios = 2 + np.floor(self._get_rng(_ratios_stream).random(n) * 3)
+
+        while True:
+            split = np.nonzero((log_closes > math.log(params['split_price'])) | (log_closes < 0))[0]
+
+            if len(split) == 0:
+                break
+
+            i = split[0]
+            ratios[i] = split_ratios[i] if log_closes[i] > 0 else 0.1
+            log_closes[i:] -= math.log(ratios[i])
+
+        closes = np.exp(log_closes)
+
+        prev_closes = np.empty(n)
+        prev_closes[:1] = params['price']
+        prev_closes[1:] = closes[:-1]
+
+        opens = np.exp(log_closes - returns + 0.3 * sigma_d * self._get_rng(_gaps_stream).standard_normal(n))
+
+        ranges = np.abs(self._get_rng(_ranges_stream).standard_normal((n, 2))) * sigma_d * 0.5
+
+        shares = params['shares'] * np.cumprod(ratios)
+
+        history = {
+            'days': days,
+            'open': opens,
+            'high': np.maximum(opens, closes) * np.exp(ranges[:, 0]),
+            'low': np.minimum(opens, closes) * np.exp(-ranges[:, 1]),
+            'close': closes,
+            'volume': np.round(shares * params['turnover'] * np.exp(0.5 * self._get_rng(_volumes_stream).standard_normal(n))),
+            'shares': shares,
+            'dividends': np.where(divs, prev_closes * q, 0),
+            'splits': ratios,
+            'params': params
+        }
+
+        return history
+
+    def get_timespan_str(self):
+        """
+            Get the timespan string of the current timespan.
+
+            Raises:
+                FdataError: incorrect/unsupported timespan requested.
+
+            Returns:
+                str: timespan string.
+        """
+        if self.timespan == Timespans.Day:
+            return '1d'
+
+        if self.timespan not in timespan_minutes:
+            raise FdataError(f"Requested timespan is not supported by {type(self).__name__}: {self.timespan.value}")
+
+        return f"{timespan_minutes[self.timespan]}min"
+
+    def _fetch_quotes(self, first_ts=None, last_ts=None, splits=None):
+        """
+            Generate unadjusted quotes. Split data is not needed as the quotes are generated unadjusted.
+
+            Args:
+                first_ts(int): overridden first ts to fetch.
+                last_ts(int): overridden last ts to fetch.
+                splits(ndarray): not used.
+
+            Returns:
+                list: quotes data
+
+            Raises:
+                FdataError: invalid timespan.
+        """
+        if first_ts is None:
+            first_ts = self.first_date_ts
+
+        if last_ts is None:
+            last_ts = self.last_date_ts
+
+        history = self._get_history(last_ts // 86400)
+
+        days = history['days']
+        idx = np.nonzero(days >= first_ts // 86400)[0]
+
+        if self.is_intraday() is False:
+            ts = days[idx] * 86400 + 86399  # Keep all non-intraday timestamps at 23:59:59
+
+            return [{'ts': int(ts[j]),
+                     'open': float(history['open'][i]),
+                     'high': float(history['high'][i]),
+                     'low': float(history['low'][i]),
+                     'close': float(history['close'][i]),
+                     'volume': int(history['volume'][i]),
+                     'transactions': 'NULL'} for j, i in enumerate(idx)]
+
+        minutes = timespan_minutes.get(self.timespan)
+
+        if minutes is None:
+            raise FdataError(f"Requested timespan is not supported by {type(self).__name__}: {self.timespan.value}")
+
+        now = int(datetime.now(tz.UTC).timestamp())
+        sigma_m = history['params']['sigma'] / math.sqrt(trading_days_per_year * session_minutes)
+
+        starts = np.arange(0, session_minutes, minutes)
+        ends = np.minimum(starts + minutes, session_minutes)
+
+        # U-shaped distribution of the volume within a session
+        weights = 1 + 2 * ((starts + ends) / session_minutes - 1) ** 2
+        weights = weights * (ends - starts) / np.sum(weights * (ends - starts))
+
+        quotes = []
+
+        for i in idx:
+            rng = self._get_rng(_intraday_stream, int(days[i]))
+
+            # Brownian bridge from the open to the close of the day
+            t = np.arange(session_minutes + 1) / session_minutes
+            path = np.concatenate(([0], np.cumsum(rng.standard_normal(session_minutes) * sigma_m)))
+
+            log_open = math.log(history['open'][i])
+            log_close = math.log(history['close'][i])
+
+            prices = np.exp(path - t * path[-1] + log_open + t * (log_close - log_open))
+
+            highs = np.maximum(np.maximum.reduceat(prices[:-1], starts), prices[ends])
+            lows = np.minimum(np.minimum.reduceat(prices[:-1], starts), prices[ends])
+            volumes = np.round(history['volume'][i] * weights * np.exp(0.3 * rng.standard_normal(len(starts))))
+
+            ts = days[i] * 86400 + session_start + starts * 60
+
+            for j in np.nonzero((ts >= first_ts) & (ts <= last_ts) & (ts + (ends - starts) * 60 <= now))[0]:
+                quotes.append({'ts': int(ts[j]),
+                               'open': float(prices[starts[j]]),
+                               'high': float(highs[j]),
+                               'low': float(lows[j]),
+                               'close': float(prices[ends[j]]),
+                               'volume': int(volumes[j]),
+                               'transactions': 'NULL'})
+
+        return quotes
+
+    def fetch_dividends(self):
+        """
+            Generate the cash dividend data.
+
+            Returns:
+                list: dividends data.
+        """
+        history = self._get_history()
+
+        divs_data = []
+
+        for i in np.nonzero(history['dividends'])[0]:
+            ex_ts = int(history['days'][i]) * 86400
+
+            divs_data.append({'amount': float(history['dividends'][i]),
+                              'decl_ts': ex_ts - 14 * 86400,
+                              'ex_ts': ex_ts,
+                              'record_ts': ex_ts + 86400,
+                              'pay_ts': ex_ts + 14 * 86400,
+                              'currency': self.get_currency()})
+
+        return divs_data
+
+    def fetch_splits(self):
+        """
+            Generate the split data.
+
+            Returns:
+                list: splits data.
+        """
+        history = self._get_history()
+
+        return [{'ts': int(history['days'][i]) * 86400, 'split_ratio': float(history['splits'][i])}
+                for i in np.nonzero(history['splits'] != 1)[0]]
+
+    def fetch_info(self):
+        """
+            Generate stock related info.
+
+            Returns
+                dict: stock info.
+        """
+        params = self._get_params()
+
+        return {'symbol': self.symbol,
+                'companyName': f"{self.symbol} Synthetic Inc.",
+                'currency': 'USD',
+                'sector': params['sector'],
+                'fc_time_zone': 'America/New_York',
+                'fc_sec_type': SecType.Stock}
+
+    def get_recent_data(self, to_cache=False):
+        """
+            Get the most recent generated quote.
+
+            Returns:
+                array: the recent quote data.
+        """
+        history = self._get_history()
+
+        if len(history['days']) == 0:
+            raise FdataError(f"No data for {self.symbol} as it is not listed yet.")
+
+        dt = datetime.utcfromtimestamp(int(history['days'][-1]) * 86400 + 86399)
+
+        result = {'time_stamp': int(history['days'][-1]) * 86400 + 86399,
+                  'date_time': dt.isoformat(' '),
+                  'opened': history['open'][-1],
+                  'high': history['high'][-1],
+                  'low': history['low'][-1],
+                  'closed': history['close'][-1],
+                  'volume': int(history['volume'][-1]),
+                  'transactions': None,
+                  'adj_open': history['open'][-1],
+                  'adj_high': history['high'][-1],
+                  'adj_low': history['low'][-1],
+                  'adj_close': history['close'][-1],
+                  'adj_volume': int(history['volume'][-1]),
+                  'divs_ex': 0.0,
+                  'divs_pay': 0.0,
+                  'splits': 1.0
+                 }
+
+        return get_labelled_ndarray([result])
+
+    ##################################################
+    # Fundamental, capitalization and surprises data
+    ##################################################
+
+    def _get_annual_figures(self):
+        """
+            Generate the main annual figures of the current symbol for every completed year since the listing.
+
+            Returns:
+                list(dict): annual figures (fiscal year, filing timestamp and the main values).
+        """
+        history = self._get_history()
+        params = history['params']
+
+        if len(history['days']) == 0:
+            return []
+
+        now = int(datetime.now(tz.UTC).timestamp())
+
+        years = (history['days'] * 86400).astype('datetime64[s]').astype('datetime64[Y]').astype(int) + 1970
+
+        rng = self._get_rng(_reports_stream)
+        figures = []
+
+        for year in range(int(years[0]), int(years[-1])):
+            filing_ts = int(datetime(year + 1, 2, 15, tzinfo=tz.UTC).timestamp())
+
+            if filing_ts > now:
+                break
+
+            i = np.nonzero(years == year)[0][-1]
+
+            cap = history['close'][i] * history['shares'][i]
+            revenue = cap / params['ps_ratio'] * math.exp(0.1 * rng.standard_normal())
+            margin = params['margin'] + 0.03 * rng.standard_normal()
+
+            figures.append({'year': year,
+                            'filing_ts': filing_ts,
+                            'shares': int(history['shares'][i]),
+                            'revenue': int(revenue),
+                            'margin': margin,
+                            'net_income': int(revenue * margin),
+                            'assets': int(revenue * math.exp(rng.uniform(0, 1))),
+                            'leverage': rng.uniform(0.2, 0.8),
+                            'cash_ratio': rng.uniform(0.02, 0.3)})
+
+        return figures
+
+    def _fetch_fundamentals(self, report, reported_period='Year'):
+        """
+            Generate annual fundamental reports. Values which are not generated are NULL.
+
+            Args:
+                report(str): the report to generate (income-statement, balance-sheet-statement or cash-flow-statement).
+                reported_period(str): the period to fetch (only Year is supported).
+
+            Returns:
+                list: fundamental data
+        """
+        reports = []
+
+        for figures in self._get_annual_figures():
+            fiscal_ts = int(datetime(figures['year'], 12, 31, tzinfo=tz.UTC).timestamp())
+
+            report_dict = defaultdict(lambda: 'NULL',
+                                      reported_period=reported_period,
+                                      time_stamp=figures['filing_ts'],
+                                      fiscalDate=fiscal_ts)
+
+            revenue = figures['revenue']
+            net_income = figures['net_income']
+
+            if report == 'income-statement':
+                gross_profit = int(revenue * min(figures['margin'] + 0.3, 0.9))
+
+                report_dict.update({'revenue': revenue,
+                                    'costOfRevenue': revenue - gross_profit,
+                                    'grossProfit': gross_profit,
+                                    'grossProfitRatio': gross_profit / revenue,
+                                    'operatingIncome': int(net_income * 1.25),
+                                    'operatingIncomeRatio': net_income * 1.25 / revenue,
+                                    'incomeBeforeTax': int(net_income * 1.2),
+                                    'incomeTaxExpense': int(net_income * 0.2),
+                                    'netIncome': net_income,
+                                    'netIncomeRatio': net_income / revenue,
+                                    'eps': net_income / figures['shares'],
+                                    'epsdiluted': net_income / figures['shares'],
+                                    'weightedAverageShsOut': figures['shares'],
+                                    'weightedAverageShsOutDil': figures['shares']})
+            elif report == 'balance-sheet-statement':
+                assets = figures['assets']
+                liabilities = int(assets * figures['leverage'])
+                cash = int(assets * figures['cash_ratio'])
+                debt = int(liabilities * 0.5)
+
+                report_dict.update({'cashAndCashEquivalents': cash,
+                                    'totalCurrentAssets': int(assets * 0.4),
+                                    'totalAssets': assets,
+                                    'totalCurrentLiabilities': int(liabilities * 0.4),
+                                    'totalLiabilities': liabilities,
+                                    'totalStockholdersEquity': assets - liabilities,
+                                    'totalEquity': assets - liabilities,
+                                    'totalLiabilitiesAndStockholdersEquity': assets,
+                                    'totalLiabilitiesAndTotalEquity': assets,
+                                    'totalDebt': debt,
+                                    'netDebt': debt - cash})
+            elif report == 'cash-flow-statement':
+                operating = int(net_income * 1.3)
+                capex = -int(revenue * 0.05)
+
+                report_dict.update({'netIncome': net_income,
+                                    'netCashProvidedByOperatingActivities': operating,
+                                    'operatingCashFlow': operating,
+                                    'capitalExpenditure': capex,
+                                    'freeCashFlow': operating + capex})
+            else:
+                raise FdataError(f"Unknown report for {type(self).__name__}: {report}")
+
+            reports.append(report_dict)
+
+        return reports
+
+    def fetch_cap(self, num=1000000, first_ts=None, last_ts=None):
+        """
+            Generate the capitalization data.
+
+            Args:
+                num(int): the number of days to limit the request.
+                first_ts(int): overridden first ts to fetch.
+                last_ts(int): overridden last ts to fetch.
+
+            Returns:
+                list: capitalization data.
+        """
+        first_date, last_date = self.get_request_dates(first_ts, last_ts, trim_last=True)
+
+        history = self._get_history()
+        dates = (history['days'] * 86400).astype('datetime64[s]').astype('datetime64[D]')
+
+        idx = np.nonzero((dates >= np.datetime64(first_date)) & (dates <= np.datetime64(last_date)))[0][-num:]
+        caps = history['close'][idx] * history['shares'][idx]
+
+        # The most recent data goes first like in FMP responses
+        return [{'date': str(dates[i]), 'marketCap': int(cap)} for i, cap in zip(idx[::-1], caps[::-1])]
+
+    def fetch_surprises(self, num=None):
+        """
+            Generate the earnings surprises data.
+
+            Args:
+                num(int): the number of reports to limit the request.
+
+            Returns:
+                list: surprises data.
+        """
+        results = []
+
+        for figures in self._get_annual_figures():
+            rng = self._get_rng(_reports_stream, figures['year'])
+
+            eps = figures['net_income'] / figures['shares'] / 4
+
+            for month in (4, 7, 10, 13):
+                report_date = date(figures['year'] + month // 13, (month - 1) % 12 + 1, 25)
+                estimated = eps * math.exp(0.05 * rng.standard_normal())
+
+                results.append({'date': str(report_date),
+                                'actualEarningResult': round(eps * math.exp(0.1 * rng.standard_normal()), 4),
+                                'estimatedEarning': round(estimated, 4)})
+
+        results = results[::-1]
+
+        if num is not None:
+            results = results[:num]
+
+        return results
@@ -0,0 +1,222 @@
+"""Concurrent fetching of data for a universe of symbols.
+
+The author is Zmicier Gotowka
+
+Distributed under Fcore License 1.1 (see license.md)
+"""
+from data.fdata import FdataError
+from data.fdatabase import FdatabaseError
+from data.fvalues import RefreshStatus
+
+import asyncio
+import threading
+import queue
+
+class UniverseFetcher():
+    """
+        Fetches the missing data for multiple symbols by several worker threads.
+
+        API queries of all the workers are limited by the shared limiter of the data source, so the workers keep
+        the queries quota saturated instead of bursting and sleeping. Each worker uses its own database connection.
+        Consider using a WAL performance profile (settings.Quotes.db_profile) for concurrent writes.
+    """
+    def __init__(self, source, symbols, workers=4):
+        """
+            Initialize the universe fetcher.
+
+            Args:
+                source(BaseFetcher): the data source instance used as a template (dates, timespan, settings).
+                symbols(list): symbols to fetch the data for.
+                workers(int): the number of worker threads.
+        """
+        if workers < 1:
+            raise FdataError(f"The number of workers should be positive: {workers}")
+
+        self.source = source
+        self.symbols = symbols
+        self.workers = workers
+
+        self._queue = None
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """
+            Fetch the missing data for all the symbols.
+
+            Returns:
+                dict: error messages by symbols which data can't be fetched (empty if everything is fetched).
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        self._errors = {}
+        self._queue = queue.Queue()
+
+        with self.source:
+            tasks = self._get_tasks()
+
+        self.source.log(f"Fetching data for {len(tasks)} of {len(self.symbols)} symbols using {self.workers} workers...")
+
+        for task in tasks.items():
+            self._queue.put(task)
+
+        threads = [threading.Thread(target=self.__worker) for _ in range(min(self.workers, len(tasks)))]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        # The symbols may remain in the queue if workers can't connect to the database
+        while self._queue.empty() is False:
+            self._errors[self._queue.get()[0]] = "The symbol is not processed."
+
+        return self._errors
+
+    def _get_tasks(self):
+        """
+            Get the symbols to process. The symbols which data is already fetched are skipped.
+
+            Returns:
+                dict: the stale data (None if not determined) by the symbols to process.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        return dict.fromkeys(self.source.get_stale_symbols(self.symbols))
+
+    def _process(self, source, symbol, stale):
+        """
+            Fetch the data of a symbol.
+
+            Args:
+                source(BaseFetcher): the data source instance of the worker.
+                symbol(str): the symbol to fetch the data for.
+                stale(set): the stale data of the symbol (None if not determined).
+
+            Raises:
+                FdataError: sql error happened or the data can't be fetched.
+        """
+        source.clone(symbol).fetch_missing_data(stale)
+
+    def _set_processed(self, source, symbol, error):
+        """
+            Handle the processed symbol. Derived classes may track the progress here.
+
+            Args:
+                source(BaseFetcher): the data source instance of the worker.
+                symbol(str): the processed symbol.
+                error(str): the error message (None if the data is fetched).
+        """
+
+    def __worker(self):
+        """
+            Fetch the data for the symbols from the queue.
+        """
+        source = self.source.clone(share_connection=False)
+
+        try:
+            source.db_connect()
+        except (FdataError, FdatabaseError) as e:
+            source.log(f"Worker can't connect to the database: {e}")
+            return
+
+        try:
+            while True:
+                try:
+                    symbol, stale = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                error = None
+
+                try:
+                    self._process(source, symbol, stale)
+                except FdataError as e:
+                    source.log(f"Can't fetch data for {symbol}: {e}")
+                    error = str(e)
+
+                    with self._lock:
+                        self._errors[symbol] = error
+
+                self._set_processed(source, symbol, error)
+        finally:
+            source.db_close()
+
+class UniverseRefresher(UniverseFetcher):
+    """
+        Keeps the data of a universe of symbols up to date.
+
+        The staleness of each data of all the symbols is checked by a few set-based queries at first. Then only
+        the stale data is fetched by several worker threads. The refresh plan is stored in the database and each
+        processed symbol is marked there, so an interrupted refresh is resumed with the unprocessed symbols
+        (for the current source and timespan) instead of building a new plan.
+    """
+    def _get_tasks(self):
+        """
+            Get the pending symbols of the interrupted refresh or build and store a new refresh plan.
+
+            If the universe is changed since the refresh was interrupted, the symbols which are not in the stored
+            plan are planned and added to it. The pending symbols which are not in the universe any more are
+            processed as well, so the stored plan is always completed.
+
+            Returns:
+                dict: the stale data (None if not determined) by the symbols to process.
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        pending = self.source.get_refresh_tasks()
+
+        if len(pending) == 0:
+            plan = self.source.get_refresh_plan(self.symbols)
+            self.source.add_refresh_tasks(plan)
+
+            return plan
+
+        self.source.log(f"Resuming the interrupted refresh of {len(pending)} symbols...")
+
+        planned = set(pending)
+
+        for status in (RefreshStatus.Done, RefreshStatus.Failed):
+            planned.update(self.source.get_refresh_tasks(status))
+
+        symbols = [symbol for symbol in self.symbols if symbol not in planned]
+
+        if len(symbols):
+            plan = self.source.get_refresh_plan(symbols)
+            self.source.add_refresh_tasks(plan, replace=False)
+
+            pending.update(plan)
+
+        return pending
+
+    def _process(self, source, symbol, stale):
+        """
+            Fetch the stale data of a symbol issuing independent API requests concurrently.
+
+            Args:
+                source(BaseFetcher): the data source instance of the worker.
+                symbol(str): the symbol to fetch the data for.
+                stale(set): the stale data of the symbol (None if not determined).
+
+            Raises:
+                FdataError: sql error happened or the data can't be fetched.
+        """
+        asyncio.run(source.clone(symbol).fetch_missing_data_async(stale))
+
+    def _set_processed(self, source, symbol, error):
+        """
+            Mark the symbol as processed in the stored refresh plan.
+
+            Args:
+                source(BaseFetcher): the data source instance of the worker.
+                symbol(str): the processed symbol.
+                error(str): the error message (None if the data is fetched).
+
+            Raises:
+                FdataError: sql error happened.
+        """
+        source.set_refresh_status(symbol, RefreshStatus.Done if error is None else RefreshStatus.Failed)
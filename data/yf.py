@@ -6,7 +6,6 @@ Distributed under Fcore License 1.1 (see license.md)
 """
 from datetime import datetime, timedelta
 from dateutil import tz
-import calendar
 
 import pandas as pd
 import numpy as np
@@ -16,7 +15,7 @@ import yfinance as yfin
 from data import stock
 from data.fvalues import Timespans, SecType, Currency
 from data.fdata import FdataError
-from data.futils import get_labelled_ndarray, get_dt
+from data.futils import get_labelled_ndarray, get_split_factors, get_ts_array
 
 import urllib.error
 import http.client
@@ -103,51 +102,41 @@ class YF(stock.StockFetcher):
             self.log(f"Can not fetch quotes for {self.symbol}. No quotes fetched.")
             return
 
-        pick_ts = np.vectorize(lambda x: calendar.timegm(get_dt(str(x), self.get_timezone()).utctimetuple()))
-
         data = data.reset_index()
 
+        def column(name):
+            # Downloaded columns are labelled by (field, symbol)
+            return data[name].to_numpy().reshape(length, -1)[:, 0]
+
+        volume = column('Volume')
+        ratio = np.ones(length)
+
         if self.is_intraday() is False:
             # TODO LOW For simplicity just set time to 23:59:59 without time zone adjustments.
             # For some markets (non-US) timestamps (which are supposed to be UTC-adjusted) may be incorrect.
-            data['ts'] = data['Date'].dt.normalize() + timedelta(hours=23, minutes=59, seconds=59)
-            data['ts'] = data['ts'].astype(int).div(10**9).astype(int)  # One more astype to get rid of .0
+            ts = data['Date'].dt.normalize() + timedelta(hours=23, minutes=59, seconds=59)
+            ts = ts.astype(int).div(10**9).astype(int).to_numpy()  # One more astype to get rid of .0
 
             # Reverse-adjust the quotes
             splits = self.__fetch_splits()
 
-            for i in range(len(splits)):
-                ind = np.searchsorted(data['ts'], [splits['ts'][i] ,], side='right')[0] - 1
-                split_ratio = splits['split_ratio'][i]
-
-                data.loc[: ind, 'Open'] = data.loc[:ind, 'Open'][self.symbol] * split_ratio
-                data.loc[: ind, 'High'] = data.loc[:ind, 'High'][self.symbol] * split_ratio
-                data.loc[: ind, 'Low'] = data.loc[:ind, 'Low'][self.symbol] * split_ratio
-                data.loc[: ind, 'Close'] = data.loc[:ind, 'Close'][self.symbol] * split_ratio
-                data.loc[: ind, 'Volume'] = round(data.loc[:ind, 'Volume'][self.symbol] / split_ratio)
+            if len(splits):
+                ratio = get_split_factors(ts, splits['ts'].to_numpy(), splits['split_ratio'].to_numpy())
+                volume = np.round(volume / ratio)
         else:
-            data['ts'] = pick_ts(data['Datetime'])
-
-        # Create a list of dictionaries with quotes
-        quotes_data = []
-
-        for ind in range(length):
-            quote_dict = {
-                'volume': data.iloc[[ind]]['Volume'].values[0][0],
-                'open': data.iloc[[ind]]['Open'].values[0][0],
-                'close': data.iloc[[ind]]['Close'].values[0][0],
-                'high': data.iloc[[ind]]['High'].values[0][0],
-                'low': data.iloc[[ind]]['Low'].values[0][0],
-                'transactions': 'NULL',
-                'ts': data.iloc[[ind]]['ts'].values[0]
-            }
-
-            quotes_data.append(quote_dict)
-
-        if len(quotes_data) != length:
-            raise FdataError(f"Obtained and parsed data length does not match: {length} != {len(quotes_data)}.")
-
-        return quotes_data
+            ts = get_ts_array(data['Datetime'], self.get_timezone())
+
+        quotes = pd.DataFrame({
+            'volume': volume,
+            'open': column('Open') * ratio,
+            'close': column('Close') * ratio,
+            'high': column('High') * ratio,
+            'low': column('Low') * ratio,
+            'transactions': 'NULL',
+            'ts': ts
+        })
+
+        return quotes.to_dict('records')
 
     # TODI MID For correct screeners work it should correspond the data in the main dataset.
     def get_recent_data(self, to_cache=False):
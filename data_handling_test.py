@@ -5,9 +5,11 @@ The author is Zmicier Gotowka
 Distributed under Fcore License 1.1 (see license.md)
 """
 from data import yf, fmp
-from data.fvalues import Timespans, SecType, Currency, StockQuotes, def_last_date
+from data.fvalues import Timespans, SecType, Currency, StockQuotes, Dividends, StockSplits, def_last_date
 from data.futils import get_dt
 
+import numpy as np
+
 from datetime import datetime, timedelta
 from dateutil import tz
 
@@ -279,6 +281,144 @@ def test_request_intervals(source, timespans):
 
     print(colored("The max request timestamp for EOD quotes is expected", "green"))
 
+def reference_adjustment(quotes, divs, splits):
+    """
+        Adjust quotes for dividends and splits by iterating over each event (the reference method to compare with).
+
+        Args:
+            quotes(ndarray): quotes with the adjusted quotes columns.
+            divs(ndarray): dividends data.
+            splits(ndarray): splits data.
+
+        Returns:
+            ndarray: adjusted quotes.
+    """
+    for i in range(len(divs)):
+        idx_ex = np.searchsorted(quotes[StockQuotes.TimeStamp], [divs[Dividends.ExDate][i], ], side='right')[0]
+
+        amount = divs[Dividends.Amount][i]
+
+        try:
+            quotes[StockQuotes.ExDividends][idx_ex] = amount
+
+            for column, price in ((StockQuotes.AdjOpen, StockQuotes.Open),
+                                  (StockQuotes.AdjHigh, StockQuotes.High),
+                                  (StockQuotes.AdjLow, StockQuotes.Low),
+                                  (StockQuotes.AdjClose, StockQuotes.Close)):
+                ratio = 1
+
+                if quotes[price][idx_ex]:
+                    ratio -= amount / quotes[price][idx_ex]
+
+                quotes[column][:idx_ex] = quotes[column][:idx_ex] * ratio
+        except IndexError:
+            pass
+
+        idx_pay = np.searchsorted(quotes[StockQuotes.TimeStamp], [divs[Dividends.PaymentDate][i], ], side='right')[0]
+
+        try:
+            quotes[StockQuotes.PayDividends][idx_pay] = amount
+        except IndexError:
+            pass
+
+    for i in range(len(splits)):
+        idx_split = np.searchsorted(quotes[StockQuotes.TimeStamp], [splits[StockSplits.Date][i], ], side='right')[0]
+
+        try:
+            ratio = splits[StockSplits.Ratio][i]
+            quotes[StockQuotes.Splits][idx_split] = ratio
+
+            if ratio != 1:
+                for column in (StockQuotes.AdjOpen, StockQuotes.AdjHigh, StockQuotes.AdjLow, StockQuotes.AdjClose):
+                    quotes[column][:idx_split] = quotes[column][:idx_split] / ratio
+
+                quotes[StockQuotes.AdjVolume][:idx_split] = quotes[StockQuotes.AdjVolume][:idx_split] * ratio
+        except IndexError:
+            pass
+
+    return quotes
+
+def test_adjustment(source):
+    """
+        Test if the vectorized dividends and splits adjustment gives the same result as the reference iterative method.
+        Random quotes and events are used (including the events which are out of the quotes range and zero prices).
+
+        Args:
+            source(ROStockData): the data source.
+    """
+    print("\nSECTION10: Testing dividends and splits adjustment")
+    print("___________________________________________________")
+
+    rng = np.random.default_rng(42)
+
+    length = 10000
+    first_ts = 0
+    day = 86400
+
+    quotes = np.zeros(length, dtype=[(StockQuotes.TimeStamp, np.int64),
+                                     (StockQuotes.Open, np.float64),
+                                     (StockQuotes.High, np.float64),
+                                     (StockQuotes.Low, np.float64),
+                                     (StockQuotes.Close, np.float64),
+                                     (StockQuotes.Volume, np.int64),
+                                     (StockQuotes.AdjOpen, np.float64),
+                                     (StockQuotes.AdjHigh, np.float64),
+                                     (StockQuotes.AdjLow, np.float64),
+                                     (StockQuotes.AdjClose, np.float64),
+                                     (StockQuotes.AdjVolume, np.int64),
+                                     (StockQuotes.ExDividends, np.float64),
+                                     (StockQuotes.PayDividends, np.float64),
+                                     (StockQuotes.Splits, np.float64)])
+
+    quotes[StockQuotes.TimeStamp] = first_ts + np.arange(length) * day
+
+    for column in (StockQuotes.Open, StockQuotes.High, StockQuotes.Low, StockQuotes.Close):
+        quotes[column] = rng.uniform(10, 100, length)
+
+    quotes[StockQuotes.Close][100] = 0  # Zero price should not be used for the adjustment
+    quotes[StockQuotes.Volume] = rng.integers(1000, 100000, length)
+    quotes[StockQuotes.Splits] = 1
+
+    for column, price in ((StockQuotes.AdjOpen, StockQuotes.Open),
+                          (StockQuotes.AdjHigh, StockQuotes.High),
+                          (StockQuotes.AdjLow, StockQuotes.Low),
+                          (StockQuotes.AdjClose, StockQuotes.Close),
+                          (StockQuotes.AdjVolume, StockQuotes.Volume)):
+        quotes[column] = quotes[price]
+
+    # Events are spread beyond the quotes range
+    divs_num = 200
+    ex_dates = np.sort(rng.integers(first_ts - day * 10, first_ts + (length + 10) * day, divs_num))
+    ex_dates[50] = quotes[StockQuotes.TimeStamp][99]  # The dividend at the zero price
+
+    divs = np.zeros(divs_num, dtype=[(Dividends.ExDate, np.int64),
+                                     (Dividends.PaymentDate, np.int64),
+                                     (Dividends.Amount, np.float64)])
+    divs[Dividends.ExDate] = ex_dates
+    divs[Dividends.PaymentDate] = ex_dates + day * 7
+    divs[Dividends.Amount] = rng.uniform(0.01, 0.5, divs_num)
+
+    splits_num = 5
+    splits = np.zeros(splits_num, dtype=[(StockSplits.Date, np.int64), (StockSplits.Ratio, np.float64)])
+    splits[StockSplits.Date] = np.sort(rng.integers(first_ts, first_ts + (length + 10) * day, splits_num))
+    # Integer ratios are used as the reference method truncates the integer volume after each split
+    splits[StockSplits.Ratio] = rng.choice([1, 2, 3, 4], splits_num)
+
+    source.last_date = get_dt(int(quotes[StockQuotes.TimeStamp][-1]))
+
+    expected = reference_adjustment(quotes.copy(), divs.copy(), splits.copy())
+    result = source._adjust_quotes(quotes.copy(), divs.copy(), splits.copy())
+
+    if len(result) != len(expected):
+        failure(f"Adjusted quotes length differs: {len(result)} != {len(expected)}", source)
+
+    for column in (StockQuotes.AdjOpen, StockQuotes.AdjHigh, StockQuotes.AdjLow, StockQuotes.AdjClose,
+                   StockQuotes.AdjVolume, StockQuotes.ExDividends, StockQuotes.PayDividends, StockQuotes.Splits):
+        if np.allclose(result[column], expected[column], rtol=1e-9, atol=0) is False:
+            failure(f"Adjusted column {column} differs from the reference adjustment", source)
+
+    print(colored("The vectorized adjustment corresponds the reference adjustment", "green"))
+
 if __name__ == "__main__":
     print(colored("\nTesting YF data source:\n", "yellow"))
 
@@ -300,6 +440,8 @@ if __name__ == "__main__":
 
     test_request_intervals(yfi, timespans_yf)
 
+    test_adjustment(yfi)
+
     yfi.db_close()
 
     print(colored("ALL TESTS PASSED for YF data source!", "green"))
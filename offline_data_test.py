@@ -0,0 +1,1065 @@
+"""Offline data handling testing script. The data is generated locally, so no network access is needed.
+
+The author is Zmicier Gotowka
+
+Distributed under Fcore License 1.1 (see license.md)
+"""
+from data.fmp import FmpStock
+from data.synthetic import Synthetic, get_synthetic_symbols
+from data.fdata import FdataError, RateLimiter, get_rate_limiter
+from data import fexport
+from data.fvalues import StockQuotes, SecType, Currency, RefreshStatus, Timespans
+from data.futils import get_dt, get_ts_array, get_session_mask, get_session_query, trim_time
+from data.universe import UniverseRefresher
+
+import settings
+
+import numpy as np
+
+from termcolor import colored
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import date, timedelta
+from dateutil import tz
+from time import perf_counter, time
+
+import urllib.parse
+import calendar
+import threading
+import asyncio
+import json
+import tempfile
+import sqlite3
+import zlib
+import os
+import sys
+
+def failure(text, source=None):
+    """
+        Print error message, disconnect db and exit.
+
+        Args:
+            text(sts): the error message to print.
+            source(ReadOnlyData): data source instance
+    """
+    print(colored(text, "red"))
+
+    if source is not None:
+        source.db_close()
+
+    sys.exit(1)
+
+def get_source(db_dir, symbol='AAA', first_date='2020-1-1', last_date='2020-3-31', source_class=FmpStock, **kwargs):
+    """
+        Get the connected data source which uses the database in the directory.
+
+        Args:
+            db_dir(str): the directory of the database.
+            symbol(str): the symbol to use.
+            first_date(str): the first date.
+            last_date(str): the last date.
+            source_class(type): the class of the data source.
+
+        Returns:
+            ReadWriteData: the connected data source.
+    """
+    source = source_class(symbol=symbol, first_date=first_date, last_date=last_date, **kwargs)
+    source.db_name = os.path.join(db_dir, 'test.sqlite')
+    source.db_connect()
+
+    return source
+
+def get_test_quotes(source):
+    """
+        Generate the daily quotes of the current symbol for the working days within the dates.
+
+        Args:
+            source(ReadOnlyData): data source instance
+
+        Returns:
+            list: the quotes in the format of API wrappers.
+    """
+    days = np.arange(source.first_date_ts // 86400, source.last_date_ts // 86400 + 1)
+
+    # 1970-01-01 is Thursday
+    days = days[(days + 3) % 7 < 5]
+
+    rng = np.random.default_rng(zlib.crc32(source.symbol.encode()))
+
+    closes = np.round(50 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days)))), 2)
+    volumes = rng.integers(1000, 100000, len(days))
+
+    return [{'ts': int(day) * 86400 + 86399,
+             'open': close,
+             'high': round(close * 1.01, 2),
+             'low': round(close * 0.99, 2),
+             'close': close,
+             'volume': int(volume),
+             'transactions': None} for day, close, volume in zip(days, closes.tolist(), volumes)]
+
+def add_test_data(source):
+    """
+        Add the info, the generated quotes of the current symbol along with a split and a dividend within the dates.
+
+        Args:
+            source(ReadWriteData): data source instance
+
+        Returns:
+            list: the added quotes.
+    """
+    source.add_info({'fc_time_zone': 'America/New_York', 'fc_sec_type': SecType.Stock, 'sector': 'Technology'})
+
+    quotes = get_test_quotes(source)
+    source.add_quotes(quotes)
+
+    split_ts = quotes[len(quotes) // 3]['ts']
+    div_ts = quotes[len(quotes) * 2 // 3]['ts']
+
+    source.add_splits([{'ts': split_ts, 'split_ratio': 2}])
+    source.add_dividends([{'amount': 0.5,
+                           'decl_ts': div_ts,
+                           'ex_ts': div_ts,
+                           'record_ts': div_ts,
+                           'pay_ts': div_ts,
+                           'currency': Currency.Unknown}])
+
+    return quotes
+
+def check_equal(first, second, text, source=None):
+    """
+        Check if the labelled arrays are identical (including dtypes).
+
+        Args:
+            first(ndarray): the first array.
+            second(ndarray): the second array.
+            text(str): the error message.
+            source(ReadOnlyData): data source instance
+    """
+    if first is None and second is None:
+        return
+
+    if first is None or second is None or first.dtype != second.dtype or len(first) != len(second):
+        failure(f"{text}: the arrays have different dtypes or lengths", source)
+
+    for name in first.dtype.names:
+        if first.dtype[name] == object:
+            if list(first[name]) != list(second[name]):
+                failure(f"{text}: the column {name} is different", source)
+        elif np.array_equal(first[name], second[name], equal_nan=first.dtype[name].kind == 'f') is False:
+            failure(f"{text}: the column {name} is different", source)
+
+def test_add_quotes_bulk():
+    """
+        Test the statistics of inserted, replaced and ignored quotes when adding quotes by one statement.
+    """
+    print("Checking the bulk insertion of quotes...")
+    print("________________________________________")
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        source = get_source(db_dir)
+
+        quotes = get_test_quotes(source)
+
+        stats = source.add_quotes_bulk(quotes[:10])
+
+        if (stats['inserted'], stats['replaced'], stats['ignored']) != (10, 0, 0):
+            failure(f"Unexpected statistics of new quotes: {stats}", source)
+
+        # Half of quotes is already in the database
+        stats = source.add_quotes_bulk(quotes[5:15])
+
+        if (stats['inserted'], stats['replaced'], stats['ignored']) != (5, 5, 0):
+            failure(f"Unexpected statistics of replaced quotes: {stats}", source)
+
+        source.update = False
+        stats = source.add_quotes_bulk(quotes[10:20])
+
+        if (stats['inserted'], stats['replaced'], stats['ignored']) != (5, 0, 5):
+            failure(f"Unexpected statistics of ignored quotes: {stats}", source)
+
+        if source.get_total_symbol_quotes_num() != 20:
+            failure(f"Unexpected number of quotes: {source.get_total_symbol_quotes_num()}", source)
+
+        stats = source.add_quotes_bulk([])
+
+        if (stats['inserted'], stats['replaced'], stats['ignored']) != (0, 0, 0):
+            failure(f"Unexpected statistics of empty quotes: {stats}", source)
+
+        source.db_close()
+
+    print(colored("Bulk insertion of quotes tests passed", 'green'))
+
+def get_committed_symbols(db_name):
+    """
+        Get the committed descriptions of symbols using a separate connection.
+
+        Args:
+            db_name(str): the name of the database.
+
+        Returns:
+            dict: the descriptions by the tickers.
+    """
+    conn = sqlite3.connect(db_name)
+    symbols = dict(conn.execute("SELECT ticker, description FROM symbols;").fetchall())
+    conn.close()
+
+    return symbols
+
+def test_shared_connection():
+    """
+        Test if two instances which share the pooled connection do not discard or commit each other's pending
+        changes and do not use the stale cached ids.
+    """
+    print("Checking the shared connection...")
+    print("_________________________________")
+
+    db_pool = settings.Quotes.db_pool
+    settings.Quotes.db_pool = True
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        first = get_source(db_dir)
+        second = get_source(db_dir)
+
+        try:
+            if first.conn is not second.conn:
+                failure("The connection is not shared", first)
+
+            add_test_data(first)
+            symbol_id = first.get_symbol_id()
+
+            # The cached id of the first instance is invalidated when the symbol is removed by the second one
+            second.remove_symbol()
+
+            if first.get_symbol_id() is not None:
+                failure("The removed symbol id is still cached", first)
+
+            add_test_data(first)
+
+            if first.get_symbol_id() == symbol_id or first.get_symbol_id() != second.get_symbol_id():
+                failure("Unexpected symbol id after re-adding of the symbol", first)
+
+            # Pending changes of the second instance are kept when adding quotes fails in the first one
+            second.cur.execute("UPDATE symbols SET description = 'Pending' WHERE ticker = ?;", (second.symbol, ))
+
+            quote = {'ts': None, 'open': 1, 'high': 1, 'low': 1, 'close': 1, 'volume': 1, 'transactions': None}
+
+            try:
+                first.add_quotes_bulk([quote])
+                failure("Quotes without time stamps are added", first)
+            except FdataError:
+                pass
+
+            quote['ts'] = 0
+            stats = first.add_quotes_bulk([quote])
+
+            if stats['inserted'] != 1:
+                failure(f"Unexpected number of inserted quotes: {stats['inserted']}", first)
+
+            # The changes of both instances are pending until the second instance commits them
+            if first.conn.in_transaction is False:
+                failure("Pending changes of the second instance are committed by the first one", first)
+
+            second.cur.execute("SELECT description FROM symbols WHERE ticker = ?;", (second.symbol, ))
+
+            if second.cur.fetchone()[0] != 'Pending':
+                failure("Pending changes of the second instance are rolled back by the first one", first)
+
+            second.commit()
+
+            # Pending changes are not committed when the quotes of the new symbol are added
+            first.cur.execute("UPDATE symbols SET description = 'New' WHERE ticker = ?;", (first.symbol, ))
+
+            third = get_source(db_dir, symbol='BBB')
+            third.add_quotes_bulk(get_test_quotes(third))
+
+            if first.conn.in_transaction is False:
+                failure("Pending changes are committed when the new symbol is added", first)
+
+            committed = get_committed_symbols(first.db_name)
+
+            if committed[first.symbol] != 'Pending' or third.symbol in committed:
+                failure(f"Unexpected committed symbols: {committed}", first)
+
+            third.db_close()
+
+            first.conn.rollback()
+        finally:
+            settings.Quotes.db_pool = db_pool
+
+        second.db_close()
+        first.db_close()
+
+    print(colored("Shared connection tests passed", 'green'))
+
+def test_quotes_batch():
+    """
+        Test if the adjusted quotes of multiple symbols obtained by one query are the same as obtained per symbol.
+    """
+    print("Checking the multi-symbol quotes query...")
+    print("_________________________________________")
+
+    symbols = ['AAA', 'BBB', 'CCC']
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        sources = [get_source(db_dir, symbol=symbol) for symbol in symbols]
+
+        for source in sources:
+            add_test_data(source)
+
+        # The symbol which is not in the database
+        result = sources[0].get_quotes_batch(symbols + ['MISSING'])
+
+        if result['MISSING'] is not None:
+            failure("Quotes are obtained for the missing symbol", sources[0])
+
+        for source in sources:
+            check_equal(result[source.symbol], source.get_quotes(), f"Batch quotes of {source.symbol} differ", source)
+
+        for source in sources:
+            source.db_close()
+
+    print(colored("Multi-symbol quotes query tests passed", 'green'))
+
+def get_cached_num(source):
+    """
+        Get the number of cached adjusted quotes entries.
+
+        Args:
+            source(ReadOnlyData): data source instance
+
+        Returns:
+            int: the number of entries.
+    """
+    source.cur.execute("SELECT COUNT(*) FROM adjusted_quotes_cache;")
+
+    return source.cur.fetchone()[0]
+
+def test_adjusted_cache():
+    """
+        Test if the cached adjusted quotes are the same as the queried ones and they are invalidated when
+        the quotes or dividends of the last requested day are changed.
+    """
+    print("Checking the adjusted quotes cache...")
+    print("_____________________________________")
+
+    adjusted_cache = settings.Quotes.adjusted_cache
+    adjusted_cache_size = settings.Quotes.adjusted_cache_size
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        source = get_source(db_dir)
+
+        try:
+            add_test_data(source)
+
+            settings.Quotes.adjusted_cache = False
+            expected = source.get_quotes()
+
+            settings.Quotes.adjusted_cache = True
+            source.get_quotes()
+
+            if get_cached_num(source) != 1:
+                failure("Adjusted quotes are not cached", source)
+
+            check_equal(source.get_quotes(), expected, "Cached quotes differ", source)
+
+            # The last bar has 23:59:59 time
+            last_ts = int(expected[StockQuotes.TimeStamp][-1])
+
+            source.cur.execute(f"UPDATE quotes SET closed = closed * 2 WHERE time_stamp = {last_ts};")
+            source.commit()
+
+            if get_cached_num(source) != 0:
+                failure("Cache is not invalidated by the change of the last bar", source)
+
+            quotes = source.get_quotes()
+
+            if quotes[StockQuotes.Close][-1] != expected[StockQuotes.Close][-1] * 2:
+                failure("Changed last bar is not obtained", source)
+
+            if get_cached_num(source) != 1:
+                failure("Adjusted quotes are not cached", source)
+
+            source.add_dividends([{'amount': 1,
+                                   'decl_ts': last_ts,
+                                   'ex_ts': last_ts,
+                                   'record_ts': last_ts,
+                                   'pay_ts': last_ts,
+                                   'currency': Currency.Unknown}])
+
+            if get_cached_num(source) != 0:
+                failure("Cache is not invalidated by the dividend on the last day", source)
+
+            # The number of cached entries is limited
+            settings.Quotes.adjusted_cache_size = 2
+
+            for num in range(1, 5):
+                source.get_quotes(num=num)
+
+            if get_cached_num(source) != 2:
+                failure(f"Unexpected number of cached entries: {get_cached_num(source)}", source)
+
+            settings.Quotes.adjusted_cache = False
+            expected = source.get_quotes(num=4)
+
+            settings.Quotes.adjusted_cache = True
+            check_equal(source.get_quotes(num=4), expected, "Cached quotes differ", source)
+
+            # Pending changes on the shared connection are not committed by caching
+            source.cur.execute("UPDATE symbols SET description = description WHERE symbol_id = ?;", (source.get_symbol_id(), ))
+            source.get_quotes(num=5)
+
+            if source.conn.in_transaction is False:
+                failure("Pending changes are committed on caching of quotes", source)
+
+            source.commit()
+        finally:
+            settings.Quotes.adjusted_cache = adjusted_cache
+            settings.Quotes.adjusted_cache_size = adjusted_cache_size
+
+        source.db_close()
+
+    print(colored("Adjusted quotes cache tests passed", 'green'))
+
+def test_npy_cache():
+    """
+        Test if the quotes obtained from the memory-mapped quotes cache are the same as the queried ones
+        and the changes which are not committed are not cached.
+    """
+    print("Checking the memory-mapped quotes cache...")
+    print("__________________________________________")
+
+    npy_cache_dir = settings.Quotes.npy_cache_dir
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        source = get_source(db_dir, first_date='2019-1-1', last_date='2020-12-31')
+
+        def check_quotes(text, **kwargs):
+            """
+                Check if the cached quotes are the same as the queried ones.
+            """
+            settings.Quotes.npy_cache_dir = None
+            expected = source.get_quotes(**kwargs)
+
+            settings.Quotes.npy_cache_dir = os.path.join(db_dir, 'npy')
+            check_equal(source.get_quotes(**kwargs), expected, text, source)
+
+        try:
+            quotes = add_test_data(source)
+
+            queries = ({}, {'num': 10}, {'ignore_last_date': True}, {'session': ('12:00', '20:00')})
+
+            for _ in range(2):
+                for kwargs in queries:
+                    check_quotes(f"Cached quotes differ for {kwargs}", **kwargs)
+
+            if len(os.listdir(settings.Quotes.npy_cache_dir)) == 0:
+                failure("Quotes are not cached", source)
+
+            changed = [dict(quote, close=quote['close'] * 2) for quote in quotes]
+
+            # Quotes changed within the pending transaction are not cached, so they are discarded by the rollback
+            source.cur.execute("UPDATE symbols SET description = 'Pending' WHERE symbol_id = ?;", (source.get_symbol_id(), ))
+            source.add_quotes_bulk(changed)
+
+            check_quotes("Pending quotes differ")
+
+            source.conn.rollback()
+
+            check_quotes("Cached quotes differ after the rollback")
+
+            # The cache is invalidated when the pending changes are committed
+            source.cur.execute("UPDATE symbols SET description = 'Pending' WHERE symbol_id = ?;", (source.get_symbol_id(), ))
+            source.add_quotes_bulk(changed)
+            source.commit()
+
+            check_quotes("Cached quotes differ after the commit")
+        finally:
+            settings.Quotes.npy_cache_dir = npy_cache_dir
+
+        source.db_close()
+
+    print(colored("Memory-mapped quotes cache tests passed", 'green'))
+
+def get_table_rows(source, table):
+    """
+        Get the sorted rows of the table without the primary key and the modification time.
+
+        Args:
+            source(ReadOnlyData): data source instance
+            table(str): the table name.
+
+        Returns:
+            list: the rows of the table.
+    """
+    source.cur.execute(f"SELECT name FROM pragma_table_info('{table}') WHERE pk = 0 AND name <> 'modified';")
+    columns = [row[0] for row in source.cur.fetchall()]
+
+    source.cur.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {', '.join(columns)};")
+
+    return [tuple(row) for row in source.cur.fetchall()]
+
+def test_parquet():
+    """
+        Test if the tables exported to Parquet datasets and imported to the empty database are the same.
+    """
+    print("Checking the export and import of Parquet datasets...")
+    print("_____________________________________________________")
+
+    if fexport.pa is None:
+        print(colored("pyarrow is not installed. Skipping the test.", 'yellow'))
+        return
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        source = get_source(db_dir, first_date='2019-1-1', last_date='2020-12-31')
+        add_test_data(source)
+
+        target = FmpStock(symbol=source.symbol, first_date='2019-1-1', last_date='2020-12-31')
+        target.db_name = os.path.join(db_dir, 'imported.sqlite')
+        target.db_connect()
+
+        exported = fexport.export_parquet(source, os.path.join(db_dir, 'parquet'))
+
+        # Datasets are not created for empty tables
+        exported = {table: num for table, num in exported.items() if num}
+
+        imported = fexport.import_parquet(target, os.path.join(db_dir, 'parquet'))
+
+        if exported != imported:
+            failure(f"The numbers of exported and imported rows differ: {exported}, {imported}", source)
+
+        for table in exported:
+            if get_table_rows(source, table) != get_table_rows(target, table):
+                failure(f"The table '{table}' differs after import", source)
+
+        check_equal(target.get_quotes(), source.get_quotes(), "Imported quotes differ", source)
+
+        target.db_close()
+        source.db_close()
+
+    print(colored("Parquet datasets tests passed", 'green'))
+
+def test_rate_limiter():
+    """
+        Test if the queries of several threads are limited by the shared limiter at the expected rate.
+    """
+    print("Checking the limiter of API queries...")
+    print("______________________________________")
+
+    max_queries = 6000
+    burst = 10
+    queries = 110
+
+    limiter = RateLimiter(max_queries, burst)
+
+    waits = [limiter.acquire() for _ in range(burst)]
+
+    if any(waits):
+        failure(f"Queries within the burst are delayed: {waits}")
+
+    start = perf_counter()
+
+    # The rest of queries are issued by several threads
+    threads = [threading.Thread(target=lambda: [limiter.acquire() for _ in range((queries - burst) // 4)]) for _ in range(4)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = perf_counter() - start
+    expected = (queries - burst) / ((max_queries - burst) / 60)
+
+    if elapsed < expected * 0.95 or elapsed > expected + 0.5:
+        failure(f"Unexpected time of queries: {round(elapsed, 3)} instead of {round(expected, 3)} seconds")
+
+    if get_rate_limiter('Test', 'key', max_queries) is not get_rate_limiter('Test', 'key', max_queries):
+        failure("The limiter is not shared for the same API key")
+
+    print(colored("Limiter of API queries tests passed", 'green'))
+
+class FmpStubHandler(BaseHTTPRequestHandler):
+    """
+        Handler of the local stub server which imitates FMP API.
+    """
+    # The split-adjusted prices of a bar and the split date
+    price = 100.0
+    split_date = date(2020, 1, 15)
+
+    def get_quotes(self, symbol, query):
+        """
+            Get the daily quotes in the descending order.
+
+            Args:
+                symbol(str): the requested symbol.
+                query(dict): the query parameters.
+
+            Returns:
+                dict: the quotes.
+        """
+        day = date.fromisoformat(query['to'][0])
+        first_day = date.fromisoformat(query['from'][0])
+
+        historical = []
+
+        while day >= first_day:
+            if day.weekday() < 5:
+                historical.append({'date': day.isoformat(),
+                                   'open': self.price,
+                                   'high': self.price,
+                                   'low': self.price,
+                                   'close': self.price,
+                                   'unadjustedVolume': 1000})
+
+            day -= timedelta(days=1)
+
+        return {'symbol': symbol, 'historical': historical}
+
+    def get_response(self, path, query):
+        """
+            Get the response of the stub API.
+
+            Args:
+                path(str): the requested path.
+                query(dict): the query parameters.
+
+            Returns:
+                the response data.
+        """
+        symbol = path.split('/')[-1]
+
+        if '/profile/' in path:
+            return [{'symbol': symbol, 'exchangeShortName': 'NYSE', 'sector': 'Technology'}]
+        if '/stock_split/' in path:
+            return {'historical': [{'date': self.split_date.isoformat(), 'numerator': 2, 'denominator': 1}]}
+        if '/stock_dividend/' in path:
+            return {'historical': [{'date': '2020-01-10', 'declarationDate': '', 'recordDate': '', 'paymentDate': '',
+                                    'dividend': 0.5}]}
+        if '/historical-price-full/' in path:
+            return self.get_quotes(symbol, query)
+        if '/historical-market-capitalization/' in path:
+            return [{'date': '2020-01-31', 'marketCap': 1000000}]
+        if '/earnings-surprises/' in path:
+            return [{'date': '2020-01-20', 'actualEarningResult': 1.0, 'estimatedEarning': 0.9}]
+
+        # Fundamental reports
+        return [{'date': '2019-12-31', 'fillingDate': '2020-01-25', 'netIncome': 100}]
+
+    def do_GET(self):
+        """
+            Handle GET request.
+        """
+        parts = urllib.parse.urlsplit(self.path)
+
+        with self.server.lock:
+            self.server.requests.append(parts.path)
+
+        data = json.dumps(self.get_response(parts.path, urllib.parse.parse_qs(parts.query))).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        """
+            Do not log the requests.
+        """
+
+def start_fmp_stub():
+    """
+        Start the local stub server of FMP API in a separate thread.
+
+        Returns:
+            ThreadingHTTPServer: the started server. The requested paths are stored in its requests list.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FmpStubHandler)
+    server.requests = []
+    server.lock = threading.Lock()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def test_fetch_async():
+    """
+        Test if the data of several symbols is fetched concurrently from the local stub of FMP API and splits are
+        added before fetching quotes (as they are needed for reverse-adjustment).
+    """
+    print("Checking the concurrent fetching of data...")
+    print("___________________________________________")
+
+    server = start_fmp_stub()
+
+    base_url = settings.FMP.base_url
+    api_key = settings.FMP.api_key
+    response_cache_dir = settings.Http.response_cache_dir
+
+    settings.FMP.base_url = f"http://127.0.0.1:{server.server_port}"
+    settings.FMP.api_key = 'test'
+    settings.Http.response_cache_dir = None
+
+    symbols = ['AAA', 'BBB', 'CCC']
+
+    try:
+        with tempfile.TemporaryDirectory() as db_dir:
+            for symbol in symbols:
+                source = FmpStock(symbol=symbol, first_date='2020-1-1', last_date='2020-1-31')
+                source.db_name = os.path.join(db_dir, 'test.sqlite')
+
+                asyncio.run(source.fetch_missing_data_async())
+
+            for symbol in symbols:
+                source = FmpStock(symbol=symbol, first_date='2020-1-1', last_date='2020-1-31')
+                source.db_name = os.path.join(db_dir, 'test.sqlite')
+                source.db_connect()
+
+                splits_idx = server.requests.index(f"/api/v3/historical-price-full/stock_split/{symbol}")
+                quotes_idx = server.requests.index(f"/api/v3/historical-price-full/{symbol}")
+
+                if splits_idx > quotes_idx:
+                    failure(f"Quotes of {symbol} are fetched before splits", source)
+
+                quotes = source.get_quotes()
+
+                # January of 2020 has 23 trading days
+                if quotes is None or len(quotes) != 23:
+                    failure(f"Unexpected number of quotes for {symbol}", source)
+
+                for table in ('stock_splits', 'cash_dividends', 'fmp_capitalization', 'fmp_surprises',
+                              'fmp_income_statement', 'fmp_balance_sheet', 'fmp_cash_flow'):
+                    if source._get_data_num(table) != 1:
+                        failure(f"Unexpected number of rows in {table} for {symbol}", source)
+
+                # Quotes before the split are reverse-adjusted
+                expected = np.where(quotes[StockQuotes.TimeStamp] < calendar.timegm(FmpStubHandler.split_date.timetuple()),
+                                    FmpStubHandler.price * 2, FmpStubHandler.price)
+
+                if np.array_equal(quotes[StockQuotes.Open], expected) is False:
+                    failure(f"Quotes of {symbol} are not reverse-adjusted", source)
+
+                source.db_close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+        settings.FMP.base_url = base_url
+        settings.FMP.api_key = api_key
+        settings.Http.response_cache_dir = response_cache_dir
+
+    print(colored("Concurrent fetching tests passed", 'green'))
+
+def test_response_cache():
+    """
+        Test if the API responses are cached according to their TTLs and only the cached responses are used
+        in the replay mode.
+    """
+    print("Checking the cache of API responses...")
+    print("______________________________________")
+
+    server = start_fmp_stub()
+
+    base_url = settings.FMP.base_url
+    response_cache_dir = settings.Http.response_cache_dir
+    response_ttl = settings.Http.response_ttl
+    response_replay = settings.Http.response_replay
+
+    settings.FMP.base_url = f"http://127.0.0.1:{server.server_port}"
+    settings.Http.response_ttl = 100
+
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            settings.Http.response_cache_dir = cache_dir
+
+            source = FmpStock(symbol='AAA')
+
+            profile_url = f"{settings.FMP.base_url}/api/v3/profile/AAA?apikey=first"
+            quote_url = f"{settings.FMP.base_url}/api/v3/quote-order/AAA?apikey=first"
+            history_url = f"{settings.FMP.base_url}/api/v3/historical-price-full/AAA?from=2020-01-01&to=2020-01-31&apikey=first"
+
+            def check_requests(num, text):
+                """
+                    Check the number of requests to the stub server.
+                """
+                if len(server.requests) != num:
+                    failure(f"{text}: {len(server.requests)} requests instead of {num}")
+
+            def expire(url):
+                """
+                    Make the cached response older than the TTL.
+                """
+                path = source._get_response_path(url)
+                os.utime(path, (time() - 1000, time() - 1000))
+
+            expected = source.query_api(profile_url).json()
+
+            # API key is not the part of the cache key
+            if source.query_api(profile_url.replace('first', 'second')).json() != expected:
+                failure("Cached response differs")
+
+            check_requests(1, "Response is not cached")
+
+            expire(profile_url)
+            source.query_api(profile_url)
+
+            check_requests(2, "Expired response is used")
+
+            # Real time quotes are never cached
+            source.query_api(quote_url)
+            source.query_api(quote_url)
+
+            check_requests(4, "Real time quotes are cached")
+
+            # Historical ranges which ended in the past never expire
+            source.query_api(history_url)
+            expire(history_url)
+            source.query_api(history_url)
+
+            check_requests(5, "Past historical range is expired")
+
+            # Only the cached responses are used in the replay mode (even if they are expired)
+            settings.Http.response_replay = True
+
+            expire(profile_url)
+            source.query_api(profile_url)
+
+            try:
+                source.query_api(profile_url.replace('AAA', 'BBB'))
+                failure("Not cached response is obtained in the replay mode")
+            except FdataError:
+                pass
+
+            check_requests(5, "API is requested in the replay mode")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+        settings.FMP.base_url = base_url
+        settings.Http.response_cache_dir = response_cache_dir
+        settings.Http.response_ttl = response_ttl
+        settings.Http.response_replay = response_replay
+
+    print(colored("Cache of API responses tests passed", 'green'))
+
+def test_quote_ranges():
+    """
+        Test the merging of the requested ranges of quotes and the intervals which need to be fetched.
+    """
+    print("Checking the requested ranges of quotes...")
+    print("__________________________________________")
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        source = get_source(db_dir, first_date='2020-1-1', last_date='2020-12-31')
+        source.add_symbol()
+
+        first_ts = source.first_date_ts
+        last_ts = source.last_date_ts
+        day = 86400
+
+        if source.get_missing_intervals() != [[first_ts, last_ts]]:
+            failure(f"Unexpected missing intervals without ranges: {source.get_missing_intervals()}", source)
+
+        source.update_quote_intervals(first_ts + 10 * day, first_ts + 20 * day - 1)
+        source.update_quote_intervals(first_ts + 30 * day, first_ts + 40 * day)
+
+        if len(source.get_quote_ranges()) != 2:
+            failure(f"Separate ranges are merged: {source.get_quote_ranges()}", source)
+
+        # The range which adjoins both ranges merges them
+        source.update_quote_intervals(first_ts + 20 * day, first_ts + 30 * day - 1)
+
+        if source.get_quote_ranges() != [(first_ts + 10 * day, first_ts + 40 * day)]:
+            failure(f"Adjoining ranges are not merged: {source.get_quote_ranges()}", source)
+
+        if source.get_missing_intervals() != [[first_ts, first_ts + 10 * day - 1], [first_ts + 40 * day + 1, last_ts]]:
+            failure(f"Unexpected missing intervals: {source.get_missing_intervals()}", source)
+
+        # Removal of quotes punches a hole in the range
+        source._remove_quote_ranges(first_ts + 15 * day, first_ts + 25 * day)
+        source.commit()
+
+        if source.get_quote_ranges() != [(first_ts + 10 * day, first_ts + 15 * day - 1),
+                                         (first_ts + 25 * day + 1, first_ts + 40 * day)]:
+            failure(f"Unexpected ranges after the removal: {source.get_quote_ranges()}", source)
+
+        if source.get_missing_intervals() != [[first_ts, first_ts + 10 * day - 1],
+                                              [first_ts + 15 * day, first_ts + 25 * day],
+                                              [first_ts + 40 * day + 1, last_ts]]:
+            failure(f"Unexpected missing intervals after the removal: {source.get_missing_intervals()}", source)
+
+        # Only the intervals within the current dates are missing
+        source.first_date = first_ts + 12 * day
+        source.last_date = first_ts + 30 * day
+
+        if source.get_missing_intervals() != [[first_ts + 15 * day, first_ts + 25 * day]]:
+            failure(f"Unexpected missing intervals within the dates: {source.get_missing_intervals()}", source)
+
+        source.db_close()
+
+    print(colored("Requested ranges of quotes tests passed", 'green'))
+
+def test_refresh_plan():
+    """
+        Test if the refresh plan contains only the stale symbols and the interrupted refresh is resumed with
+        the pending symbols (including the case when the universe is changed).
+    """
+    print("Checking the refresh plan...")
+    print("____________________________")
+
+    symbols = get_synthetic_symbols(3)
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        source = get_source(db_dir, symbol=symbols[0], source_class=Synthetic)
+        source.fetch_missing_data()
+
+        plan = source.get_refresh_plan(symbols)
+
+        if plan != {symbols[1]: None, symbols[2]: None}:
+            failure(f"Unexpected refresh plan: {plan}", source)
+
+        # Emulate the refresh interrupted after the first symbol of the plan
+        source.add_refresh_tasks(plan)
+        source.set_refresh_status(symbols[1], RefreshStatus.Done)
+
+        if source.get_refresh_tasks() != {symbols[2]: None}:
+            failure(f"Unexpected pending tasks: {source.get_refresh_tasks()}", source)
+
+        if source.get_refresh_tasks(RefreshStatus.Done) != {symbols[1]: None}:
+            failure(f"Unexpected processed tasks: {source.get_refresh_tasks(RefreshStatus.Done)}", source)
+
+        source.db_close()
+
+        # Only the pending symbol is fetched when the refresh is resumed
+        errors = UniverseRefresher(source, symbols, workers=2).fetch()
+
+        source.db_connect()
+
+        if len(errors):
+            failure(f"Errors while refreshing: {errors}", source)
+
+        if len(source.get_refresh_tasks()) or source.get_refresh_tasks(RefreshStatus.Done) != {symbols[1]: None, symbols[2]: None}:
+            failure(f"Unexpected tasks after resuming: {source.get_refresh_tasks(RefreshStatus.Done)}", source)
+
+        if source.get_symbol_id(symbols[1]) is not None or source.get_symbol_id(symbols[2]) is None:
+            failure("Unexpected symbols are fetched when the refresh is resumed", source)
+
+        # The new plan is built when there are no pending tasks
+        if source.get_refresh_plan(symbols) != {symbols[1]: None}:
+            failure(f"Unexpected refresh plan: {source.get_refresh_plan(symbols)}", source)
+
+        source.db_close()
+
+        errors = UniverseRefresher(source, symbols, workers=2).fetch()
+
+        source.db_connect()
+
+        if len(errors) or source.get_refresh_plan(symbols) != {}:
+            failure(f"Symbols are not refreshed: {errors}", source)
+
+        # The universe is changed after the interrupted refresh. The new symbols are planned in addition to
+        # the pending ones and the pending symbols which are not in the universe any more are completed as well.
+        source.add_refresh_tasks({symbols[1]: None, symbols[2]: None})
+        source.set_refresh_status(symbols[1], RefreshStatus.Done)
+
+        new_symbols = get_synthetic_symbols(5)[3:]
+        universe = [symbols[1]] + new_symbols
+
+        source.db_close()
+
+        errors = UniverseRefresher(source, universe, workers=2).fetch()
+
+        source.db_connect()
+
+        if len(errors) or len(source.get_refresh_tasks()):
+            failure(f"Pending tasks are left after resuming: {errors}, {source.get_refresh_tasks()}", source)
+
+        if source.get_refresh_tasks(RefreshStatus.Done) != dict.fromkeys(symbols[1:] + new_symbols):
+            failure(f"Unexpected tasks of the changed universe: {source.get_refresh_tasks(RefreshStatus.Done)}", source)
+
+        if source.get_refresh_plan(universe) != {}:
+            failure(f"New symbols are not refreshed: {source.get_refresh_plan(universe)}", source)
+
+        source.db_close()
+
+    print(colored("Refresh plan tests passed", 'green'))
+
+def test_session_query():
+    """
+        Test if the SQL predicate of the session window selects the same quotes as the session mask including
+        the intervals with DST changes.
+    """
+    print("Checking the session window queries...")
+    print("______________________________________")
+
+    timezone = tz.gettz('America/New_York')
+
+    # Five minute timestamps around the DST changes and the summer interval without changes
+    intervals = get_ts_array(['2023-03-10', '2023-03-15', '2023-11-02', '2023-11-07', '2023-07-03', '2023-07-08']).reshape(-1, 2).tolist()
+
+    windows = (('09:30', '16:00'), ('22:00', '02:00'), (None, '01:30'), ('23:00', None), ('00:00', '23:59'))
+
+    conn = sqlite3.connect(':memory:')
+
+    for first_ts, last_ts in intervals:
+        ts = np.arange(first_ts, last_ts, 300)
+
+        conn.execute("DROP TABLE IF EXISTS quotes;")
+        conn.execute("CREATE TABLE quotes (time_stamp INTEGER);")
+        conn.executemany("INSERT INTO quotes VALUES (?);", [(int(value), ) for value in ts])
+
+        for start, end in windows:
+            expected = ts[get_session_mask(ts, start, end, timezone)]
+
+            predicate, exact = get_session_query(start, end, timezone, first_ts, last_ts)
+
+            if exact != (first_ts == intervals[-1][0]):
+                failure(f"Unexpected exactness of the predicate for {start}-{end} from {get_dt(first_ts)}")
+
+            if len(predicate):
+                predicate = f"WHERE {predicate}"
+
+            selected = np.array([row[0] for row in conn.execute(f"SELECT time_stamp FROM quotes {predicate} ORDER BY time_stamp;")])
+
+            if exact:
+                if np.array_equal(selected, expected) is False:
+                    failure(f"Exact predicate for {start}-{end} from {get_dt(first_ts)} differs from the mask")
+            elif np.array_equal(selected[get_session_mask(selected, start, end, timezone)], expected) is False:
+                failure(f"Predicate for {start}-{end} from {get_dt(first_ts)} does not cover the session")
+
+    conn.close()
+
+    # Intraday quotes obtained for the session are the same as the trimmed quotes
+    with tempfile.TemporaryDirectory() as db_dir:
+        source = get_source(db_dir, symbol='SYN0', first_date='2023-03-09', last_date='2023-03-15', source_class=Synthetic,
+                            timespan=Timespans.FiveMinutes)
+        source.get()
+
+        for start, end in windows:
+            expected = trim_time(source.get_quotes(), start, end, source.get_timezone())
+
+            # None is returned if no quotes are within the session
+            if len(expected) == 0:
+                expected = None
+
+            check_equal(source.get_quotes(session=(start, end)), expected, f"Quotes for the session {start}-{end} differ", source)
+
+        source.db_close()
+
+    print(colored("Session window queries tests passed", 'green'))
+
+if __name__ == "__main__":
+    test_add_quotes_bulk()
+    test_shared_connection()
+    test_quotes_batch()
+    test_adjusted_cache()
+    test_npy_cache()
+    test_parquet()
+    test_rate_limiter()
+    test_fetch_async()
+    test_response_cache()
+    test_quote_ranges()
+    test_refresh_plan()
+    test_session_query()
+
+    print(colored("ALL OFFLINE TESTS PASSED!", "green"))
@@ -6,7 +6,7 @@ Distributed under Fcore License 1.1 (see license.md)
 """
 from enum import Enum
 
-from data.fvalues import DbTypes
+from data.fvalues import DbTypes, DbProfiles
 
 class Quotes():
     """
@@ -14,6 +14,24 @@ class Quotes():
     """
     db_name = 'data.sqlite'
     db_type = DbTypes.SQLite
+    db_pool = True  # Indicates if database connections should be shared among data source instances in a thread
+    db_profile = DbProfiles.Default  # Performance profile (set of pragmas) applied to new connections
+    db_pragmas = {}  # Pragmas to override the profile values. For example: {'cache_size': -65536}
+    adjusted_cache = False  # Indicates if adjusted stock quotes should be cached in the database
+    adjusted_cache_size = 1000  # The maximum number of cached adjusted quotes entries (the oldest are evicted)
+    npy_cache_dir = None  # Directory for memory-mapped quotes histories shared among processes (None disables it)
+
+class Http():
+    """
+        Settings for HTTP sessions of the data sources.
+    """
+    pool_size = 10  # The maximum number of kept alive connections per host
+    retries = 3  # The number of retries of failed requests
+    backoff_factor = 0.5  # Delay between retries is backoff_factor * (2 ** (retry - 1)) seconds
+    retry_statuses = (429, 500, 502, 503, 504)  # HTTP statuses to retry the request
+    response_cache_dir = None  # Directory for cached API responses (None disables the cache)
+    response_ttl = 86400  # Default time to live of cached responses in seconds
+    response_replay = False  # Indicates if all the responses should be obtained from the cache only (offline mode)
 
 # Settings for derivative data sources. They'll be applied after the settings above.
 
@@ -33,6 +51,7 @@ class Polygon():
 
     stocks_plan = Stocks.Basic  # Subscription plan
     api_key = None  # Get your free api key at polygon.io
+    base_url = 'https://api.polygon.io'  # May be overridden to use a proxy or a local stub server
 
 class FMP():
     """
@@ -51,3 +70,4 @@ class FMP():
 
     plan = Plan.Basic
     api_key = None
+    base_url = 'https://financialmodelingprep.com'  # May be overridden to use a proxy or a local stub server